@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from agents.llm_cache import mix_llm_class
+
+# --- 取消与截止时间 ---
+# worker 执行任务时在上下文中设置中止信号：每个阶段开始前、LLM 调用等待期间定期检查
+# 任务是否已被取消或超过截止时间，满足任一条件就抛出 TaskAborted，crew 随即停止。
+# 每次 LLM 调用各用一个守护线程，不设共享线程池：被放弃的调用不占用其他任务的并发，
+# 其 HTTP 请求最多再持续 LLM_TIMEOUT_SECONDS 秒后结束，结果直接丢弃。
+CANCEL_POLL_SECONDS = float(os.getenv("CANCEL_POLL_SECONDS", "1"))
+# 单次 LLM HTTP 请求的超时（秒），传给底层客户端
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "180"))
+
+
+class TaskAborted(Exception):
+    """任务被取消（reason=cancelled）或超过截止时间（reason=deadline）"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"task aborted: {reason}")
+
+
+class AbortSignal:
+    """
+    deadline 为绝对时间戳（None 表示不限）；is_cancelled 查询任务是否已被取消，
+    最多每 CANCEL_POLL_SECONDS 秒查询一次
+    """
+
+    def __init__(self, deadline: Optional[float], is_cancelled: Callable[[], bool]):
+        self.deadline = deadline
+        self._is_cancelled = is_cancelled
+        self._checked_at = 0.0
+        self._cancelled = False
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def check(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise TaskAborted("deadline")
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at >= CANCEL_POLL_SECONDS:
+            self._checked_at = now
+            try:
+                self._cancelled = self._is_cancelled()
+            except Exception as e:
+                logging.warning(f"查询任务取消状态失败: {str(e)}")
+        if self._cancelled:
+            raise TaskAborted("cancelled")
+
+
+_current = contextvars.ContextVar("abort_signal", default=None)
+
+
+@contextmanager
+def abort_scope(signal: AbortSignal):
+    """在该上下文（含 crewai 异步任务等复制了上下文的线程）中生效"""
+    token = _current.set(signal)
+    try:
+        yield signal
+    finally:
+        _current.reset(token)
+
+
+def check_abort():
+    signal = _current.get()
+    if signal is not None:
+        signal.check()
+
+
+def run_abortable(fn: Callable, *args, **kwargs):
+    """在后台线程中执行 fn，等待期间定期检查中止信号；没有中止信号时直接执行"""
+    signal = _current.get()
+    if signal is None:
+        return fn(*args, **kwargs)
+    signal.check()
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(fn, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="llm-call", daemon=True).start()
+    while True:
+        timeout = CANCEL_POLL_SECONDS
+        remaining = signal.remaining()
+        if remaining is not None:
+            timeout = max(min(timeout, remaining), 0.01)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            signal.check()
+
+
+class AbortableLLMMixin:
+    """LLM.call 在等待模型响应期间可被取消或截止时间打断"""
+    __slots__ = ()
+
+    def call(self, *args, **kwargs):
+        return run_abortable(super().call, *args, **kwargs)
+
+
+def with_abort(llm):
+    return mix_llm_class(llm, AbortableLLMMixin, "Abortable")
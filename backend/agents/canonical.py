@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import unicodedata
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+# 请求规范化：把等价的请求（目的地别名、偏好同义词、同月同天数的行程）映射到同一个缓存键。
+# 行程只按 (月份, 天数) 区分，命中时结果中的日期按请求的出发日期重新标注。
+# 不在别名表中的目的地只在缓存键里转小写，交给 crew 和存入任务记录的仍是用户的写法。
+
+# 目的地别名 -> 规范名，键为 normalize_text 之后的形式
+DESTINATION_ALIASES: Dict[str, str] = {
+    "tokyo": "东京", "東京": "东京", "东京都": "东京",
+    "kyoto": "京都",
+    "osaka": "大阪",
+    "hokkaido": "北海道", "sapporo": "札幌",
+    "okinawa": "冲绳", "沖縄": "冲绳", "沖繩": "冲绳",
+    "seoul": "首尔", "首爾": "首尔", "汉城": "首尔",
+    "busan": "釜山",
+    "jeju": "济州岛", "济州": "济州岛", "濟州島": "济州岛",
+    "bangkok": "曼谷",
+    "chiang mai": "清迈",
+    "phuket": "普吉岛", "普吉": "普吉岛",
+    "singapore": "新加坡",
+    "bali": "巴厘岛", "巴厘": "巴厘岛",
+    "paris": "巴黎",
+    "london": "伦敦", "倫敦": "伦敦",
+    "rome": "罗马", "羅馬": "罗马",
+    "new york": "纽约", "nyc": "纽约", "紐約": "纽约",
+    "beijing": "北京", "peking": "北京",
+    "shanghai": "上海",
+    "hong kong": "香港", "hongkong": "香港",
+    "macau": "澳门", "macao": "澳门", "澳門": "澳门",
+    "taipei": "台北", "臺北": "台北", "台北市": "台北",
+    "chengdu": "成都",
+    "chongqing": "重庆", "重慶": "重庆",
+    "xi'an": "西安", "xian": "西安",
+    "hangzhou": "杭州",
+    "guangzhou": "广州", "廣州": "广州",
+    "shenzhen": "深圳",
+    "sanya": "三亚", "三亞": "三亚",
+    "lijiang": "丽江", "麗江": "丽江",
+    "guilin": "桂林",
+    "xiamen": "厦门", "廈門": "厦门",
+    "qingdao": "青岛", "青島": "青岛",
+    "harbin": "哈尔滨", "哈爾濱": "哈尔滨",
+    "jilin": "吉林",
+    "changbai mountain": "长白山", "長白山": "长白山",
+    "yunnan": "云南", "雲南": "云南",
+}
+
+# 偏好取值的同义词，按偏好项分别归一
+PREFERENCE_ALIASES: Dict[str, Dict[str, str]] = {
+    "budget": {
+        "low": "low", "cheap": "low", "budget": "low", "economy": "low", "经济": "low", "经济型": "low",
+        "medium": "medium", "mid": "medium", "moderate": "medium", "中等": "medium", "适中": "medium",
+        "high": "high", "luxury": "high", "premium": "high", "豪华": "high", "豪华型": "high", "高端": "high",
+    },
+    "travel_style": {
+        "cultural": "cultural", "culture": "cultural", "文化": "cultural", "文化体验": "cultural",
+        "adventure": "adventure", "冒险": "adventure", "冒险探索": "adventure",
+        "relaxation": "relaxation", "relax": "relaxation", "休闲": "relaxation", "休闲度假": "relaxation",
+        "food": "food", "foodie": "food", "美食": "food", "美食之旅": "food",
+        "photography": "photography", "photo": "photography", "摄影": "photography", "摄影打卡": "photography",
+        "shopping": "shopping", "购物": "shopping", "购物天堂": "shopping",
+    },
+}
+
+# 可选：额外的目的地别名表（JSON 对象，别名 -> 规范名），合并到内置表
+DESTINATION_ALIASES_FILE = os.getenv("DESTINATION_ALIASES_FILE")
+
+
+def _clean_text(value: str) -> str:
+    """全角转半角、合并空白"""
+    value = unicodedata.normalize("NFKC", value or "")
+    return re.sub(r"\s+", " ", value.strip())
+
+
+def normalize_text(value: str) -> str:
+    """全角转半角、合并空白、转小写"""
+    return _clean_text(value).lower()
+
+
+def _load_alias_file():
+    if not DESTINATION_ALIASES_FILE:
+        return
+    try:
+        with open(DESTINATION_ALIASES_FILE, encoding="utf-8") as f:
+            extra = json.load(f)
+        DESTINATION_ALIASES.update({normalize_text(k): v for k, v in extra.items()})
+        logging.info(f"已加载 {len(extra)} 个目的地别名: {DESTINATION_ALIASES_FILE}")
+    except Exception as e:
+        logging.warning(f"加载目的地别名表失败: {str(e)}")
+
+
+_load_alias_file()
+
+
+def canonical_destination(destination: str) -> str:
+    """缓存键中的目的地：别名换成规范名，其余转小写并去掉行政区后缀"""
+    text = normalize_text(destination)
+    if text in DESTINATION_ALIASES:
+        return DESTINATION_ALIASES[text]
+    # “北京市”“杭州市”等去掉行政区后缀再查一次
+    stripped = re.sub(r"(市|省|县|縣)$", "", text)
+    if len(stripped) >= 2:
+        return DESTINATION_ALIASES.get(stripped, stripped)
+    return text
+
+
+def display_destination(destination: str) -> str:
+    """prompt 和任务记录中的目的地：别名换成规范名，其余保留用户的写法"""
+    canonical = canonical_destination(destination)
+    if canonical in DESTINATION_ALIASES.values():
+        return canonical
+    return _clean_text(destination)
+
+
+def _canonical_value(value: Any, aliases: Optional[Dict[str, str]] = None) -> Any:
+    if isinstance(value, str):
+        text = normalize_text(value)
+        return (aliases or {}).get(text, text)
+    if isinstance(value, (list, tuple, set)):
+        # 列表类偏好（兴趣等）与顺序、重复无关
+        items = (_canonical_value(v, aliases) for v in value)
+        unique = {json.dumps(v, sort_keys=True, ensure_ascii=False): v for v in items if v not in (None, "", [], {})}
+        return [unique[k] for k in sorted(unique)]
+    if isinstance(value, dict):
+        return canonical_preferences(value)
+    return value
+
+
+def canonical_preferences(preferences: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """键名归一、取值按同义词表归一，丢弃空值"""
+    result = {}
+    for key, value in (preferences or {}).items():
+        key = normalize_text(str(key)).replace(" ", "_")
+        value = _canonical_value(value, PREFERENCE_ALIASES.get(key))
+        if value in (None, "", [], {}):
+            continue
+        result[key] = value
+    return result
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def trip_shape(start_date: Optional[str], end_date: Optional[str]) -> Tuple[int, int]:
+    """行程用 (出发月份, 天数) 表示；日期无法解析时返回 (0, 0)"""
+    start, end = _parse_date(start_date), _parse_date(end_date)
+    if not start:
+        return 0, 0
+    duration = (end - start).days + 1 if end and end >= start else 0
+    return start.month, duration
+
+
+def canonicalize_request(travel_input: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """
+    返回 (交给 crew 的规范化输入, 缓存键)。
+    小红书账号不参与推荐，直接丢弃；日期只有月份和天数进入缓存键。
+    """
+    destination = canonical_destination(travel_input.get("destination"))
+    preferences = canonical_preferences(travel_input.get("preferences"))
+    month, duration = trip_shape(travel_input.get("start_date"), travel_input.get("end_date"))
+    canonical_input = {
+        "destination": display_destination(travel_input.get("destination")),
+        "start_date": travel_input.get("start_date"),
+        "end_date": travel_input.get("end_date"),
+        "preferences": preferences
+    }
+    if not duration:
+        # 日期不完整时无法按天数复用，退回按原始日期区分
+        shape = {"start_date": travel_input.get("start_date"), "end_date": travel_input.get("end_date")}
+    else:
+        shape = {"month": month, "duration": duration}
+    key_str = json.dumps({"destination": destination, "trip": shape, "preferences": preferences},
+                         sort_keys=True, ensure_ascii=False)
+    return canonical_input, hashlib.md5(key_str.encode("utf-8")).hexdigest()
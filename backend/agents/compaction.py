@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+from task_queue import metrics
+
+# --- 上下文压缩 ---
+# 下游任务通过 context 读取上游任务的完整输出：行程规划读取目的地和偏好报告，最终整合再读取一遍并加上行程，
+# 最后两个阶段的 prompt 因此最长。开启后，上游输出交给下游前先压缩为按小节组织、不超过 token 预算的摘要：
+# JSON 输出只去掉多余空白（不丢内容），文字报告去掉 markdown 装饰和重复行，超出预算时各小节轮流保留条目。
+# 压缩不调用模型，写入缓存和推送给前端的仍是完整输出。
+CONTEXT_COMPACTION_ENABLED = os.getenv("CONTEXT_COMPACTION_ENABLED", "true").lower() == "true"
+# 按 token 预算截断目的地/偏好报告（有损，可能丢掉下游需要的细节）；默认关闭，只做无损压缩
+CONTEXT_COMPACTION_LOSSY = os.getenv("CONTEXT_COMPACTION_LOSSY", "false").lower() == "true"
+# 每份上游输出压缩后的 token 上限，仅在有损压缩开启时生效
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+# 单个条目保留的最大字符数
+CONTEXT_LINE_MAX_CHARS = int(os.getenv("CONTEXT_LINE_MAX_CHARS", "160"))
+# 作为下游 context 的阶段 -> token 预算，None 为只做无损压缩；行程的每一项都要出现在最终结果里，总是无损
+_REPORT_BUDGET = CONTEXT_TOKEN_BUDGET if CONTEXT_COMPACTION_LOSSY else None
+COMPACTED_STAGES = {
+    "destination_task": _REPORT_BUDGET,
+    "preference_task": _REPORT_BUDGET,
+    "itinerary_task": None,
+}
+
+_FENCE = re.compile(r"^```[\w-]*\s*|\s*```$")
+_BULLET = re.compile(r"^(?:[-*•·]|\d+[.、)）])\s*")
+_SEPARATOR = re.compile(r"^[-=*_|:\s]{3,}$")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken 的编码表首次使用时需要下载，失败后不再重试，改用字符数估算"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logging.info(f"tiktoken 不可用，按字符数估算 token: {str(e)}")
+                _encoding = False
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 中英文混合约 3 个字符一个 token
+    return len(text) // 3 + 1
+
+
+def _compact_json(text: str) -> Optional[str]:
+    stripped = _FENCE.sub("", text.strip())
+    if not stripped or stripped[0] not in "[{":
+        return None
+    try:
+        value = json.loads(stripped)
+    except json.JSONDecodeError:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _clean_line(line: str) -> Tuple[str, bool]:
+    """返回 (去掉 markdown 装饰的文本, 是否为小节标题)"""
+    line = line.strip()
+    heading = line.startswith("#")
+    line = line.lstrip("#").replace("**", "").replace("__", "").strip()
+    if not heading and len(line) <= 30 and line.endswith((":", "：")):
+        heading = True
+    if heading:
+        return line.rstrip(":：").strip(), True
+    return _BULLET.sub("", line), False
+
+
+def parse_sections(text: str) -> List[Tuple[str, List[str]]]:
+    """按标题拆分为 (小节标题, 条目列表)，去掉空行、分隔线和重复条目"""
+    sections: List[Tuple[str, List[str]]] = [("", [])]
+    seen = set()
+    for raw_line in _FENCE.sub("", text.strip()).splitlines():
+        if not raw_line.strip() or _SEPARATOR.match(raw_line.strip()):
+            continue
+        line, heading = _clean_line(raw_line)
+        if not line:
+            continue
+        if heading:
+            sections.append((line, []))
+            continue
+        if line in seen:
+            continue
+        seen.add(line)
+        if len(line) > CONTEXT_LINE_MAX_CHARS:
+            line = line[:CONTEXT_LINE_MAX_CHARS] + "…"
+        sections[-1][1].append(line)
+    return [s for s in sections if s[0] or s[1]]
+
+
+def _render(sections: List[Tuple[str, List[str]]]) -> str:
+    lines = []
+    for title, items in sections:
+        if title:
+            lines.append(f"## {title}")
+        lines.extend(f"- {item}" for item in items)
+    return "\n".join(lines)
+
+
+def compact_text(text: str, budget: Optional[int] = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    把上游输出压缩为不超过 budget 个 token 的摘要。
+    JSON 只做紧凑序列化；文字报告超出预算时保留全部小节标题，各小节按顺序轮流加入条目直到用完预算。
+    budget 为 None 时只做无损压缩（紧凑 JSON、去掉空行）。
+    """
+    if not text:
+        return text
+    compacted = _compact_json(text)
+    if compacted is not None:
+        return compacted if len(compacted) < len(text) else text
+    if budget is None:
+        return "\n".join(line.rstrip() for line in text.strip().splitlines() if line.strip())
+
+    sections = parse_sections(text)
+    full = _render(sections)
+    if count_tokens(full) <= budget:
+        return full
+
+    kept: List[Tuple[str, List[str]]] = [(title, []) for title, _ in sections]
+    used = count_tokens(_render(kept))
+    depth = 0
+    progressed = True
+    while progressed:
+        progressed = False
+        for (_, items), (_, kept_items) in zip(sections, kept):
+            if depth >= len(items):
+                continue
+            progressed = True
+            cost = count_tokens(f"- {items[depth]}\n")
+            if used + cost > budget:
+                return _render(kept)
+            kept_items.append(items[depth])
+            used += cost
+        depth += 1
+    return _render(kept)
+
+
+def compact_stage_output(stage: str, text: str) -> str:
+    """压缩作为下游 context 的阶段输出，记录压缩前后的 token 数"""
+    before = count_tokens(text)
+    compacted = compact_text(text, COMPACTED_STAGES.get(stage, CONTEXT_TOKEN_BUDGET))
+    after = count_tokens(compacted)
+    metrics.observe("travel_context_tokens", before, stage=stage, phase="before")
+    metrics.observe("travel_context_tokens", after, stage=stage, phase="after")
+    logging.info(f"🗜️ 压缩上下文 {stage}: {before} -> {after} tokens")
+    return compacted
@@ -0,0 +1,88 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from task_queue.queue_config import redis_client
+from agents.canonical import canonical_destination
+
+# --- 目的地报告缓存配置 ---
+DESTINATION_CACHE_ENABLED = os.getenv("DESTINATION_CACHE_ENABLED", "true").lower() == "true"
+# 报告在该时间内视为新鲜，直接复用
+DESTINATION_REPORT_TTL = int(os.getenv("DESTINATION_REPORT_TTL", str(7 * 24 * 3600)))
+# 过期但未超过该时间的报告仍可使用，同时在后台刷新
+DESTINATION_REPORT_MAX_STALE = int(os.getenv("DESTINATION_REPORT_MAX_STALE", str(30 * 24 * 3600)))
+# 后台刷新锁的过期时间，避免同一目的地被重复刷新
+DESTINATION_REFRESH_LOCK_TTL = 600
+
+KEY_PREFIX = "travel:destination:"
+
+
+def travel_month(travel_input: Dict[str, Any]) -> int:
+    """取出发日期的月份，日期缺失或格式错误时返回 0"""
+    try:
+        return int(str(travel_input.get("start_date"))[5:7])
+    except (TypeError, ValueError):
+        return 0
+
+
+def destination_key(travel_input: Dict[str, Any]) -> Tuple[str, int]:
+    return canonical_destination(travel_input.get("destination")), travel_month(travel_input)
+
+
+class DestinationReportStore:
+    """按 (目的地, 月份) 缓存目的地分析报告"""
+
+    def __init__(self, redis=redis_client):
+        self.redis = redis
+
+    @staticmethod
+    def _key(destination: str, month: int) -> str:
+        digest = hashlib.md5(destination.encode("utf-8")).hexdigest()
+        return f"{KEY_PREFIX}{digest}:{month}"
+
+    def get(self, destination: str, month: int) -> Optional[Tuple[str, bool]]:
+        """返回 (报告, 是否新鲜)，没有可用报告时返回 None"""
+        try:
+            data = self.redis.hgetall(self._key(destination, month))
+        except Exception as e:
+            logging.warning(f"读取目的地报告缓存失败: {str(e)}")
+            return None
+        if not data:
+            return None
+        data = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                for k, v in data.items()}
+        age = time.time() - float(data.get("created_at", 0))
+        return data.get("report", ""), age < DESTINATION_REPORT_TTL
+
+    def put(self, destination: str, month: int, report: str):
+        if not report:
+            return
+        key = self._key(destination, month)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping={
+                "destination": destination,
+                "month": month,
+                "report": report,
+                "created_at": time.time()
+            })
+            pipe.expire(key, DESTINATION_REPORT_MAX_STALE)
+            pipe.delete(f"{key}:refreshing")
+            pipe.execute()
+            logging.info(f"🗂️ 目的地报告已缓存: {destination} {month}月")
+        except Exception as e:
+            logging.warning(f"写入目的地报告缓存失败: {str(e)}")
+
+    def try_acquire_refresh(self, destination: str, month: int) -> bool:
+        """抢占后台刷新权，同一时间每个目的地只刷新一次"""
+        try:
+            lock_key = f"{self._key(destination, month)}:refreshing"
+            return bool(self.redis.set(lock_key, 1, nx=True, ex=DESTINATION_REFRESH_LOCK_TTL))
+        except Exception as e:
+            logging.warning(f"获取目的地刷新锁失败: {str(e)}")
+            return False
+
+
+destination_store = DestinationReportStore()
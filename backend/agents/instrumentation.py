@@ -0,0 +1,102 @@
+import re
+import time
+import logging
+import threading
+from typing import Dict, List
+
+try:
+    from crewai.events import (
+        crewai_event_bus, LLMCallStartedEvent, LLMCallCompletedEvent, LLMCallFailedEvent
+    )
+except ImportError:  # crewai < 1.0
+    from crewai.utilities.events import (
+        crewai_event_bus, LLMCallStartedEvent, LLMCallCompletedEvent, LLMCallFailedEvent
+    )
+
+from task_queue import metrics
+
+# 通过 crewai 事件总线采集每次 LLM 调用的耗时和 token 数，按阶段（任务名）打标签。
+# worker 内多个 agent 共用一个 LLM 实例，crew.usage_metrics 会重复累计，因此不使用它。
+
+_call_started: Dict[str, float] = {}
+_lock = threading.Lock()
+_registered = False
+# 本进程累计消耗的 LLM token，用于预计算等按预算执行的任务
+_tokens_used = 0
+
+
+# 按天生成行程的任务名带有天数（itinerary_day_3），作为标签会随行程长度无限增长，统一记为 itinerary_day
+_DAY_TASK = re.compile(r"^itinerary_day_\d+$")
+
+
+def _task_name(event) -> str:
+    task = getattr(event, "from_task", None)
+    return getattr(task, "name", None) or getattr(event, "task_name", None) or "unknown"
+
+
+def stage_label(name: str) -> str:
+    """任务名转为指标的阶段标签；天数只出现在日志里"""
+    return "itinerary_day" if _DAY_TASK.match(name) else name
+
+
+def _stage(event) -> str:
+    return stage_label(_task_name(event))
+
+
+def _on_llm_started(source, event):
+    call_id = getattr(event, "call_id", None)
+    if call_id is not None:
+        with _lock:
+            _call_started[call_id] = time.monotonic()
+
+
+def _on_llm_completed(source, event):
+    stage = _stage(event)
+    with _lock:
+        started = _call_started.pop(getattr(event, "call_id", None), None)
+    if started is not None:
+        metrics.observe("travel_llm_call_seconds", time.monotonic() - started, stage=stage)
+    usage = getattr(event, "usage", None) or {}
+    if usage.get("prompt_tokens") is not None:
+        metrics.observe("travel_llm_prompt_tokens", usage["prompt_tokens"], stage=stage)
+    if usage.get("completion_tokens") is not None:
+        metrics.observe("travel_llm_completion_tokens", usage["completion_tokens"], stage=stage)
+    tokens = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+    if tokens:
+        global _tokens_used
+        with _lock:
+            _tokens_used += tokens
+
+
+def _on_llm_failed(source, event):
+    with _lock:
+        _call_started.pop(getattr(event, "call_id", None), None)
+    name = _task_name(event)
+    logging.warning(f"LLM调用失败: {name}")
+    metrics.inc("travel_llm_call_failures_total", stage=stage_label(name))
+
+
+def register_llm_metrics():
+    """注册 LLM 调用指标的事件监听，重复调用无副作用"""
+    global _registered
+    with _lock:
+        if _registered:
+            return
+        crewai_event_bus.on(LLMCallStartedEvent)(_on_llm_started)
+        crewai_event_bus.on(LLMCallCompletedEvent)(_on_llm_completed)
+        crewai_event_bus.on(LLMCallFailedEvent)(_on_llm_failed)
+        _registered = True
+    logging.info("LLM metrics listeners registered")
+
+
+def llm_tokens_used() -> int:
+    """本进程累计的 LLM token 数；两次读数之差即期间（含同进程其他任务）的消耗"""
+    return _tokens_used
+
+
+def record_stage_durations(tasks: List) -> None:
+    """kickoff 结束后记录本次实际执行的各阶段耗时（注入缓存输出的阶段没有起止时间）"""
+    for task in tasks:
+        if task.start_time and task.end_time:
+            metrics.observe("travel_stage_duration_seconds", task.execution_duration,
+                            stage=stage_label(getattr(task, "name", None) or "unknown"))
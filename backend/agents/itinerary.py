@@ -0,0 +1,86 @@
+import os
+import json
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+# --- 行程生成模式 ---
+# single：一次生成完整行程；per_day：先生成逐日骨架，再按天并发生成详细安排后合并
+ITINERARY_MODE = os.getenv("ITINERARY_MODE", "per_day")
+# 同时生成的天数上限
+ITINERARY_FANOUT_LIMIT = max(int(os.getenv("ITINERARY_FANOUT_LIMIT", "4")), 1)
+# 行程天数达到该值才按天拆分，短行程一次生成更省调用
+ITINERARY_PER_DAY_MIN_DAYS = int(os.getenv("ITINERARY_PER_DAY_MIN_DAYS", "3"))
+# 行程天数上限：API 拒绝更长的请求；其他途径进入的超长行程不按天拆分，避免每天一次调用
+ITINERARY_MAX_DAYS = max(int(os.getenv("ITINERARY_MAX_DAYS", "30")), 1)
+
+
+def trip_dates(travel_input: Dict[str, Any]) -> List[date]:
+    """行程中的每一天；日期缺失或无效时返回空列表"""
+    try:
+        start = date.fromisoformat(str(travel_input.get("start_date"))[:10])
+        end = date.fromisoformat(str(travel_input.get("end_date"))[:10])
+    except (TypeError, ValueError):
+        return []
+    if end < start:
+        return []
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def trip_too_long(travel_input: Dict[str, Any]) -> bool:
+    return len(trip_dates(travel_input)) > ITINERARY_MAX_DAYS
+
+
+def use_per_day_itinerary(travel_input: Dict[str, Any]) -> bool:
+    days = len(trip_dates(travel_input))
+    return ITINERARY_MODE == "per_day" and ITINERARY_PER_DAY_MIN_DAYS <= days <= ITINERARY_MAX_DAYS
+
+
+def _extract_json(text: str) -> Optional[Any]:
+    """从模型输出中取出第一个 JSON 数组或对象"""
+    pairs = sorted((("[", "]"), ("{", "}")), key=lambda p: text.find(p[0]) if p[0] in text else len(text))
+    for open_char, close_char in pairs:
+        start, end = text.find(open_char), text.rfind(close_char)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except json.JSONDecodeError:
+                continue
+    return None
+
+
+def parse_skeleton(raw: str, dates: List[date]) -> List[Dict[str, Any]]:
+    """
+    解析逐日骨架，按行程日期补齐 day/date。
+    模型输出无法解析或天数不符时，缺失的天只保留日期，由单日任务自行安排。
+    """
+    parsed = _extract_json(raw or "")
+    if isinstance(parsed, dict):
+        parsed = next((v for v in parsed.values() if isinstance(v, list)), [])
+    entries = [e for e in (parsed or []) if isinstance(e, dict)]
+    if len(entries) != len(dates):
+        logging.warning(f"行程骨架天数 {len(entries)} 与行程天数 {len(dates)} 不符，按日期补齐")
+    skeleton = []
+    for i, day in enumerate(dates):
+        entry = dict(entries[i]) if i < len(entries) else {}
+        entry["day"] = i + 1
+        entry["date"] = day.isoformat()
+        skeleton.append(entry)
+    return skeleton
+
+
+def parse_day(raw: str, skeleton_day: Dict[str, Any]) -> Dict[str, Any]:
+    """解析单日输出为 ItineraryDay 结构，day/date 以骨架为准"""
+    parsed = _extract_json(raw or "")
+    if isinstance(parsed, list):
+        parsed = next((e for e in parsed if isinstance(e, dict)), None)
+    day = parsed if isinstance(parsed, dict) else {}
+    if "schedule" not in day and isinstance(day.get("itinerary"), list):
+        # 模型有时会把单日结果包在 itinerary 数组里
+        days = [d for d in day["itinerary"] if isinstance(d, dict)]
+        day = next((d for d in days if d.get("day") == skeleton_day["day"]), days[0] if days else {})
+    return {
+        "day": skeleton_day["day"],
+        "date": skeleton_day["date"],
+        "schedule": day.get("schedule") if isinstance(day.get("schedule"), list) else []
+    }
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from task_queue.queue_config import redis_client
+
+if TYPE_CHECKING:
+    from crewai import LLM
+
+# --- LLM 响应缓存配置 ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256"))
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv("LLM_CACHE_MAX_VALUE_BYTES", str(256 * 1024)))
+
+CACHE_KEY_PREFIX = "travel:llm:cache:"
+CACHE_STATS_KEY = "travel:llm:stats"
+
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_llm_cache():
+    """在该上下文中的 LLM 调用跳过缓存：不读取，结果也不写入（与 LLM_CACHE_BYPASS 一致）"""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+class LRUCache:
+    """线程安全的进程内 LRU，条目带过期时间"""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LLMResponseCache:
+    """两级 prompt 响应缓存：进程内 LRU + Redis（多个 worker 共享）"""
+
+    def __init__(self, redis=redis_client, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl: int = LLM_CACHE_TTL, max_value_bytes: int = LLM_CACHE_MAX_VALUE_BYTES):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_value_bytes = max_value_bytes
+        self.local = LRUCache(max_entries, ttl)
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, messages: Any, params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+        try:
+            self.redis.hincrby(CACHE_STATS_KEY, name, 1)
+        except Exception as e:
+            logging.warning(f"LLM缓存统计写入失败: {str(e)}")
+
+    def get(self, key: str) -> Optional[str]:
+        if _bypass.get():
+            self._count("bypassed")
+            return None
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return value
+        try:
+            raw = self.redis.get(CACHE_KEY_PREFIX + key)
+        except Exception as e:
+            logging.warning(f"LLM缓存读取Redis失败: {str(e)}")
+            raw = None
+        if raw is not None:
+            value = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            self.local.set(key, value)
+            self._count("redis_hits")
+            return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str):
+        if _bypass.get():
+            return
+        data = value.encode("utf-8")
+        if not value or len(data) > self.max_value_bytes:
+            return
+        self.local.set(key, value)
+        try:
+            self.redis.set(CACHE_KEY_PREFIX + key, data, ex=self.ttl)
+        except Exception as e:
+            logging.warning(f"LLM缓存写入Redis失败: {str(e)}")
+        self._count("stores")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["local_entries"] = len(self.local)
+        stats["hit_ratio"] = (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+llm_response_cache = LLMResponseCache()
+
+# 参与缓存键计算的生成参数
+_GENERATION_PARAMS = ("temperature", "top_p", "max_tokens", "seed",
+                      "frequency_penalty", "presence_penalty", "n")
+
+
+class CachedLLMMixin:
+    """拦截 LLM.call：相同模型、消息和生成参数的请求直接返回缓存结果"""
+    __slots__ = ()
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, *args, **kwargs):
+        # 带工具调用的请求可能有副作用，不缓存
+        if tools or available_functions:
+            return super().call(messages, tools, callbacks, available_functions, *args, **kwargs)
+
+        params = {name: getattr(self, name, None) for name in _GENERATION_PARAMS}
+        params["stop"] = getattr(self, "stop_sequences", None) or getattr(self, "stop", None)
+        response_model = kwargs.get("response_model")
+        if response_model is not None:
+            params["response_model"] = response_model.model_json_schema()
+        key = llm_response_cache.make_key(self.model, messages, params)
+
+        cached = llm_response_cache.get(key)
+        if cached is not None:
+            logging.info(f"💾 LLM缓存命中: {key[:12]}")
+            return cached
+
+        result = super().call(messages, tools, callbacks, available_functions, *args, **kwargs)
+        if isinstance(result, str):
+            llm_response_cache.set(key, result)
+        return result
+
+
+_mixed_classes: Dict[tuple, type] = {}
+
+
+def mix_llm_class(llm: "LLM", mixin: type, prefix: str) -> "LLM":
+    """
+    在已创建的 LLM 实例上挂载 mixin。
+
+    crewai 的 LLM 构造函数会按模型前缀返回不同的 provider 子类，
+    因此这里对实际返回的类动态派生子类，而不是固定继承 LLM。
+    """
+    base = type(llm)
+    mixed_cls = _mixed_classes.get((base, mixin))
+    if mixed_cls is None:
+        mixed_cls = type(f"{prefix}{base.__name__}", (mixin, base), {"__slots__": ()})
+        _mixed_classes[(base, mixin)] = mixed_cls
+    object.__setattr__(llm, "__class__", mixed_cls)
+    return llm
+
+
+def with_llm_cache(llm: "LLM") -> "LLM":
+    """开启缓存时在实例上挂载缓存层"""
+    if not LLM_CACHE_ENABLED or os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true":
+        return llm
+    return mix_llm_class(llm, CachedLLMMixin, "Cached")
+
+
+def create_llm(**kwargs) -> "LLM":
+    """创建 LLM 实例；开启缓存时在实例上挂载缓存层"""
+    # 本模块也被 API 进程导入（LRUCache、统计 key），crewai 只在真正创建 LLM 时加载
+    from crewai import LLM
+    return with_llm_cache(LLM(**kwargs))
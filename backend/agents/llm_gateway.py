@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from typing import Any, Dict, List, Optional
+
+from crewai import LLM
+from task_queue.queue_config import redis_client
+from task_queue import metrics
+from agents.llm_cache import mix_llm_class, with_llm_cache
+from agents.cancellation import LLM_TIMEOUT_SECONDS, check_abort
+
+# --- LLM 网关配置 ---
+# 所有 worker 共享的 LLM 入口：多个端点、Redis 分布式令牌桶限流、抖动退避重试、故障转移与对冲请求
+# 端点列表（JSON 数组），每项: name, model, base_url, api_key 或 api_key_env, rpm, tpm（0 表示不限）
+# 未设置时使用 DEEPSEEK_*，配置了 OPENROUTER_API_KEY 时追加 OpenRouter 作为备用端点
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS")
+# 未设置时仅在显式配置了 LLM_ENDPOINTS 时开启
+LLM_GATEWAY_ENABLED = (os.getenv("LLM_GATEWAY_ENABLED") or ("true" if LLM_ENDPOINTS else "false")).lower() == "true"
+LLM_RETRY_ATTEMPTS = max(int(os.getenv("LLM_RETRY_ATTEMPTS", "3")), 1)
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+# 等待限流配额的最长时间，超过后本次调用失败
+LLM_RATE_WAIT_TIMEOUT = float(os.getenv("LLM_RATE_WAIT_TIMEOUT", "120"))
+# 主端点超过该时长未返回时向备用端点发起对冲请求，取先返回的结果；0 表示不对冲
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))
+# 单次调用超过该时长视为端点变慢，冷却期内优先使用其他端点
+LLM_FAILOVER_LATENCY_SECONDS = float(os.getenv("LLM_FAILOVER_LATENCY_SECONDS", "60"))
+LLM_ENDPOINT_COOLDOWN_SECONDS = float(os.getenv("LLM_ENDPOINT_COOLDOWN_SECONDS", "30"))
+# 令牌桶按 prompt 估算 token，补全部分按该值预留，调用返回后按实际用量退回或补扣差额
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1500"))
+
+BUCKET_KEY_PREFIX = "travel:llm:bucket:"
+
+# 请求数、token 两个桶，容量为每分钟限额，按限额/60 每秒匀速补充。
+# 两个桶都够时一起扣减并返回 0，否则不扣减并返回需要等待的秒数。
+_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local costs = {1, tonumber(ARGV[4])}
+local names = {"requests", "tokens"}
+local last = tonumber(redis.call("HGET", KEYS[1], "ts") or now)
+local elapsed = math.max(now - last, 0)
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local limit = limits[i]
+    if limit > 0 then
+        local level = tonumber(redis.call("HGET", KEYS[1], names[i]) or limit)
+        level = math.min(limit, level + elapsed * limit / 60)
+        costs[i] = math.min(costs[i], limit)
+        levels[i] = level
+        if level < costs[i] then
+            wait = math.max(wait, (costs[i] - level) * 60 / limit)
+        end
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, 2 do
+    if limits[i] > 0 then
+        redis.call("HSET", KEYS[1], names[i], tostring(levels[i] - costs[i]))
+    end
+end
+redis.call("HSET", KEYS[1], "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], 120)
+return "0"
+"""
+
+# 按实际用量结算 token 桶：ARGV 为每分钟限额、预留与实际用量之差（正数退回，负数补扣）
+_SETTLE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local level = tonumber(redis.call("HGET", KEYS[1], "tokens") or limit)
+redis.call("HSET", KEYS[1], "tokens", tostring(math.min(limit, level + tonumber(ARGV[2]))))
+redis.call("EXPIRE", KEYS[1], 120)
+return 1
+"""
+
+# 当前这次端点调用实际消耗的 token，由端点客户端收到响应的 usage 时追加
+_call_usage: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("llm_call_usage", default=None)
+
+
+class UsageRecordingMixin:
+    """端点客户端共享于多个线程，累计用量无法区分调用；这里把每次响应的 usage 记到当前调用上"""
+    __slots__ = ()
+
+    def _track_token_usage_internal(self, usage_data: Dict[str, Any]) -> None:
+        super()._track_token_usage_internal(usage_data)
+        usage = _call_usage.get()
+        if usage is None:
+            return
+        from crewai.types.usage_metrics import UsageMetrics
+        parsed = UsageMetrics.from_provider_dict(usage_data)
+        if parsed is not None:
+            usage.append(parsed.total_tokens)
+
+
+class LLMEndpoint:
+    """一个 LLM 服务端点及其每分钟请求数/token 限额"""
+
+    def __init__(self, name: str, model: str, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.rpm = int(rpm or 0)
+        self.tpm = int(tpm or 0)
+        self._clients: Dict[bool, LLM] = {}
+
+    @property
+    def llm_kwargs(self) -> Dict[str, Any]:
+        return {"model": self.model, "base_url": self.base_url, "api_key": self.api_key, "timeout": LLM_TIMEOUT_SECONDS}
+
+    def client(self, stream: bool = False) -> LLM:
+        """流式与非流式各用一个客户端，stream 是 LLM 实例上的属性"""
+        llm = self._clients.get(stream)
+        if llm is None:
+            llm = LLM(**self.llm_kwargs, stream=stream)
+            llm = self._clients[stream] = mix_llm_class(llm, UsageRecordingMixin, "Metered")
+        return llm
+
+
+def parse_endpoints(raw: Optional[str] = LLM_ENDPOINTS) -> List[LLMEndpoint]:
+    if raw:
+        configs = json.loads(raw)
+    else:
+        configs = [{
+            "name": "deepseek",
+            "model": os.getenv("DEEPSEEK_MODEL"),
+            "base_url": os.getenv("DEEPSEEK_BASE_URL"),
+            "api_key_env": "DEEPSEEK_API_KEY",
+            "rpm": os.getenv("DEEPSEEK_RPM", "0"),
+            "tpm": os.getenv("DEEPSEEK_TPM", "0")
+        }]
+        if os.getenv("OPENROUTER_API_KEY"):
+            configs.append({
+                "name": "openrouter",
+                "model": os.getenv("OPENROUTER_MODEL", "openrouter/deepseek/deepseek-r1:free"),
+                "base_url": os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+                "api_key_env": "OPENROUTER_API_KEY",
+                "rpm": os.getenv("OPENROUTER_RPM", "0"),
+                "tpm": os.getenv("OPENROUTER_TPM", "0")
+            })
+    endpoints = []
+    for i, config in enumerate(configs):
+        api_key = config.get("api_key")
+        if not api_key and config.get("api_key_env"):
+            api_key = os.getenv(config["api_key_env"])
+        endpoints.append(LLMEndpoint(
+            name=config.get("name") or f"endpoint{i}",
+            model=config["model"],
+            base_url=config.get("base_url"),
+            api_key=api_key,
+            rpm=config.get("rpm", 0),
+            tpm=config.get("tpm", 0)
+        ))
+    if not endpoints:
+        raise ValueError("LLM_ENDPOINTS 至少需要一个端点")
+    return endpoints
+
+
+def estimate_tokens(messages: Any) -> int:
+    """按字符数粗略估算 prompt token（中英文混合约 3 个字符一个 token），加上补全预留"""
+    if isinstance(messages, str):
+        chars = len(messages)
+    else:
+        chars = sum(len(str(m.get("content") or "")) if isinstance(m, dict) else len(str(m)) for m in messages or [])
+    return chars // 3 + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def backoff_delay(attempt: int) -> float:
+    """指数退避加全抖动，避免多个 worker 同时重试"""
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+# 对冲请求在线程池中执行；落后的请求无法中断，会在后台跑完后丢弃结果
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_POOL_SIZE", "16")),
+                                 thread_name_prefix="llm-hedge")
+
+
+class LLMGateway:
+    def __init__(self, endpoints: List[LLMEndpoint], redis=redis_client):
+        self.endpoints = endpoints
+        self.redis = redis
+        self._bucket = redis.register_script(_BUCKET_SCRIPT)
+        self._settle = redis.register_script(_SETTLE_SCRIPT)
+        self._cooldown_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _ordered(self) -> List[LLMEndpoint]:
+        """健康的端点在前，冷却中的端点在后，各自保持配置顺序"""
+        now = time.monotonic()
+        with self._lock:
+            return sorted(self.endpoints, key=lambda ep: self._cooldown_until.get(ep.name, 0) > now)
+
+    def _cool_down(self, endpoint: LLMEndpoint):
+        with self._lock:
+            self._cooldown_until[endpoint.name] = time.monotonic() + LLM_ENDPOINT_COOLDOWN_SECONDS
+
+    def try_acquire(self, endpoint: LLMEndpoint, tokens: int) -> float:
+        """尝试从端点的令牌桶取配额，成功返回 0，否则返回需等待的秒数"""
+        if not endpoint.rpm and not endpoint.tpm:
+            return 0.0
+        try:
+            wait_seconds = self._bucket(keys=[BUCKET_KEY_PREFIX + endpoint.name],
+                                        args=[time.time(), endpoint.rpm, endpoint.tpm, tokens])
+            return float(wait_seconds)
+        except Exception as e:
+            # 限流依赖 Redis，Redis 不可用时放行，由服务端限流兜底
+            logging.warning(f"LLM限流检查失败: {str(e)}")
+            return 0.0
+
+    def settle(self, endpoint: LLMEndpoint, reserved: int, used: int):
+        """调用返回后按实际用量修正 token 桶：预留多了退回，少了补扣"""
+        if not endpoint.tpm:
+            return
+        # 令牌桶单次最多扣除一分钟的限额
+        diff = min(reserved, endpoint.tpm) - used
+        if not diff:
+            return
+        try:
+            self._settle(keys=[BUCKET_KEY_PREFIX + endpoint.name], args=[endpoint.tpm, diff])
+        except Exception as e:
+            logging.warning(f"LLM限流结算失败: {str(e)}")
+
+    def acquire(self, tokens: int) -> LLMEndpoint:
+        """选出第一个有配额的端点；都没有配额时等待最先补足的一个"""
+        started = time.monotonic()
+        while True:
+            # 任务已中止时不再占用配额（被放弃的调用仍在后台线程里等待）
+            check_abort()
+            waits = []
+            for endpoint in self._ordered():
+                wait_seconds = self.try_acquire(endpoint, tokens)
+                if wait_seconds <= 0:
+                    waited = time.monotonic() - started
+                    if waited > 0.01:
+                        metrics.observe("travel_llm_rate_limit_wait_seconds", waited, endpoint=endpoint.name)
+                    return endpoint
+                waits.append(wait_seconds)
+            sleep_for = min(waits) + random.uniform(0, 0.2)
+            if time.monotonic() - started + sleep_for > LLM_RATE_WAIT_TIMEOUT:
+                metrics.inc("travel_llm_gateway_calls_total", endpoint="*", outcome="throttled")
+                raise RuntimeError(f"LLM调用等待限流配额超过 {LLM_RATE_WAIT_TIMEOUT:.0f}s")
+            time.sleep(sleep_for)
+
+    def _call_endpoint(self, endpoint: LLMEndpoint, tokens: int, messages, args, kwargs, stream: bool = False):
+        started = time.monotonic()
+        usage: List[int] = []
+        usage_token = _call_usage.set(usage)
+        try:
+            result = endpoint.client(stream).call(messages, *args, **kwargs)
+        except Exception as e:
+            self._cool_down(endpoint)
+            metrics.inc("travel_llm_gateway_calls_total", endpoint=endpoint.name, outcome="error")
+            logging.warning(f"LLM端点 {endpoint.name} 调用失败: {str(e)}")
+            raise
+        finally:
+            _call_usage.reset(usage_token)
+        # 响应没有 usage 时保留按估算扣除的配额
+        if usage:
+            self.settle(endpoint, tokens, sum(usage))
+        elapsed = time.monotonic() - started
+        if elapsed > LLM_FAILOVER_LATENCY_SECONDS:
+            logging.warning(f"LLM端点 {endpoint.name} 响应 {elapsed:.1f}s，冷却期内优先使用其他端点")
+            self._cool_down(endpoint)
+        metrics.inc("travel_llm_gateway_calls_total", endpoint=endpoint.name, outcome="ok")
+        return result
+
+    def _submit(self, endpoint: LLMEndpoint, tokens: int, messages, args, kwargs, stream: bool):
+        ctx = contextvars.copy_context()
+        return _hedge_pool.submit(ctx.run, self._call_endpoint, endpoint, tokens, messages, args, kwargs, stream)
+
+    def _call_hedged(self, primary: LLMEndpoint, tokens: int, messages, args, kwargs, stream: bool):
+        first = self._submit(primary, tokens, messages, args, kwargs, stream)
+        try:
+            return first.result(timeout=LLM_HEDGE_AFTER_SECONDS)
+        except FutureTimeoutError:
+            pass
+        # 对冲请求同样要占用备用端点的配额，没有配额时继续等主端点
+        backup = next((ep for ep in self._ordered()
+                       if ep is not primary and self.try_acquire(ep, tokens) <= 0), None)
+        if backup is None:
+            return first.result()
+        logging.info(f"LLM端点 {primary.name} 超过 {LLM_HEDGE_AFTER_SECONDS:.0f}s 未返回，对冲到 {backup.name}")
+        metrics.inc("travel_llm_gateway_calls_total", endpoint=backup.name, outcome="hedged")
+        pending = {first, self._submit(backup, tokens, messages, args, kwargs, stream)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, messages, *args, stream: bool = False, **kwargs):
+        tokens = estimate_tokens(messages)
+        # 带工具的调用可能有副作用，不做对冲
+        tools = kwargs.get("tools") or (args[0] if args else None)
+        functions = kwargs.get("available_functions") or (args[2] if len(args) > 2 else None)
+        hedge = LLM_HEDGE_AFTER_SECONDS > 0 and len(self.endpoints) > 1 and not tools and not functions
+        last_error = None
+        for attempt in range(LLM_RETRY_ATTEMPTS):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+                check_abort()
+            endpoint = self.acquire(tokens)
+            try:
+                if hedge:
+                    return self._call_hedged(endpoint, tokens, messages, args, kwargs, stream)
+                return self._call_endpoint(endpoint, tokens, messages, args, kwargs, stream)
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(parse_endpoints())
+            logging.info(f"LLM网关端点: {', '.join(ep.name for ep in _gateway.endpoints)}")
+        return _gateway
+
+
+class GatewayLLMMixin:
+    """把 LLM.call 转交给网关；实例本身只提供主端点的模型属性给 crewai"""
+    __slots__ = ()
+
+    def call(self, messages, *args, **kwargs):
+        return get_llm_gateway().call(messages, *args, stream=bool(getattr(self, "stream", False)), **kwargs)
+
+
+def create_gateway_llm(stream: bool = False) -> LLM:
+    """crew 使用的 LLM：调用经过网关，开启缓存时缓存层在网关之前"""
+    primary = get_llm_gateway().endpoints[0]
+    llm = mix_llm_class(LLM(**primary.llm_kwargs, stream=stream), GatewayLLMMixin, "Gateway")
+    return with_llm_cache(llm)
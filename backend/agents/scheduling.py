@@ -0,0 +1,80 @@
+import os
+import logging
+from typing import List
+
+from crewai import Task
+
+# 执行模式：dag - 按 context 依赖并发执行相互独立的任务；sequential - 全部串行
+CREW_EXECUTION_MODE = os.getenv("CREW_EXECUTION_MODE", "dag").lower()
+
+
+def _context_tasks(task: Task) -> List[Task]:
+    context = getattr(task, "context", None)
+    return context if isinstance(context, list) else []
+
+
+def build_dag_levels(tasks: List[Task]) -> List[List[Task]]:
+    """根据每个任务的 context 推导依赖图，按层返回（同层任务互不依赖）"""
+    known = {id(t) for t in tasks}
+    levels_by_id = {}
+    for task in tasks:
+        deps = [levels_by_id[id(dep)] for dep in _context_tasks(task) if id(dep) in known]
+        # crewai 已校验 context 不能引用后续任务，这里按原顺序遍历即可得到拓扑序
+        levels_by_id[id(task)] = max(deps) + 1 if deps else 0
+
+    levels: List[List[Task]] = []
+    for task in tasks:
+        level = levels_by_id[id(task)]
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(task)
+    return levels
+
+
+def plan_tasks(tasks: List[Task], mode: str = CREW_EXECUTION_MODE) -> List[Task]:
+    """
+    生成交给 Process.sequential 的任务顺序。
+
+    dag 模式下同层多个任务标记为 async_execution，由 crewai 并发启动，
+    并在下一层第一个同步任务前统一等待，这样整体耗时等于关键路径而非所有 LLM 调用之和。
+    """
+    if mode != "dag":
+        for task in tasks:
+            task.async_execution = False
+        return list(tasks)
+
+    levels = build_dag_levels(tasks)
+    ordered: List[Task] = []
+    previous_async = False
+    for idx, level in enumerate(levels):
+        is_last = idx == len(levels) - 1
+        # crewai 只在同步任务处等待异步任务：连续两层异步之间没有屏障，
+        # 且 crew 末尾最多只能有一个异步任务，这两种情况退回串行
+        concurrent = len(level) > 1 and not previous_async and not is_last
+        if len(level) > 1 and not concurrent:
+            logging.info(f"⚠️ 第 {idx} 层的 {len(level)} 个任务无法并发，按顺序执行")
+        for task in level:
+            task.async_execution = concurrent
+        ordered.extend(level)
+        previous_async = concurrent
+    return ordered
+
+
+def log_stage_timeline(tasks: List[Task]):
+    """输出各阶段的起止时间，便于观察并发重叠情况"""
+    timed = [t for t in tasks if t.start_time and t.end_time]
+    if not timed:
+        return
+    origin = min(t.start_time for t in timed)
+    finish = max(t.end_time for t in timed)
+    wall = (finish - origin).total_seconds()
+    busy = sum(t.execution_duration for t in timed)
+
+    logging.info("📊 阶段耗时时间线:")
+    for task in timed:
+        name = getattr(task, "name", None) or task.description.strip()[:20]
+        start = (task.start_time - origin).total_seconds()
+        end = (task.end_time - origin).total_seconds()
+        mode = "并发" if task.async_execution else "串行"
+        logging.info(f"   [{mode}] {name}: {start:7.2f}s -> {end:7.2f}s (耗时 {task.execution_duration:.2f}秒)")
+    logging.info(f"⏱️ 墙钟耗时: {wall:.2f}秒, 各阶段累计: {busy:.2f}秒, 并发节省: {max(busy - wall, 0):.2f}秒")
@@ -0,0 +1,133 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, Iterable, Optional
+
+from task_queue.queue_config import redis_client
+
+# --- 阶段输出缓存配置 ---
+# 按任务的实际输入缓存阶段输出，修改请求后只重跑输入变化的阶段
+STAGE_MEMO_ENABLED = os.getenv("STAGE_MEMO_ENABLED", "true").lower() == "true"
+STAGE_MEMO_TTL = int(os.getenv("STAGE_MEMO_TTL", str(7 * 24 * 3600)))
+# 参与缓存的阶段；目的地分析由 destination_store 按 (目的地, 月份) 缓存，最终整合每次都重新执行
+MEMOIZED_STAGES = ("preference_task", "itinerary_task")
+
+KEY_PREFIX = "travel:stage:"
+
+# --- 执行检查点 ---
+# 每个阶段完成时按本次执行（任务的输入哈希）记录输出，huey 重试或 worker 崩溃后重新提交时
+# 从最后完成的阶段继续，不受上面的阶段缓存开关影响。任务成功后删除。
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", str(6 * 3600)))
+# 最终整合的输出就是任务结果，失败后总是重新执行
+CHECKPOINT_STAGES = ("destination_task", "preference_task", "itinerary_task")
+
+CHECKPOINT_KEY_PREFIX = "travel:checkpoint:"
+
+
+def checkpoint_run_key(input_hash: Optional[str], travel_input: Dict, task_id: str) -> str:
+    """
+    检查点所属的执行：规范化的输入哈希只区分 (目的地, 月份, 天数)，出发日期不同的请求哈希相同，
+    行程里的日期却不同，因此再加上出发日期；没有输入哈希时按任务 id
+    """
+    if not input_hash:
+        return task_id
+    return f"{input_hash}:{travel_input.get('start_date') or ''}"
+
+
+def stage_input_key(task, upstream_keys: Iterable[str] = ()) -> str:
+    """
+    任务输入的摘要：渲染后的任务描述（已包含目的地、偏好、日期等输入）、期望输出、
+    负责的 agent 设定，以及上游任务的输入摘要
+    """
+    agent = task.agent
+    parts = [
+        task.name or "",
+        task.description,
+        task.expected_output,
+        getattr(agent, "role", ""),
+        getattr(agent, "goal", ""),
+        getattr(agent, "backstory", ""),
+        *upstream_keys
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class StageOutputStore:
+    """按输入摘要缓存阶段输出"""
+
+    def __init__(self, redis=redis_client):
+        self.redis = redis
+
+    @staticmethod
+    def _key(stage: str, input_key: str) -> str:
+        return f"{KEY_PREFIX}{stage}:{input_key}"
+
+    def get(self, stage: str, input_key: str) -> Optional[str]:
+        try:
+            raw = self.redis.hget(self._key(stage, input_key), "output")
+        except Exception as e:
+            logging.warning(f"读取阶段缓存失败: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+    def put(self, stage: str, input_key: str, output: str):
+        if not output:
+            return
+        key = self._key(stage, input_key)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping={"output": output, "created_at": time.time()})
+            pipe.expire(key, STAGE_MEMO_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"写入阶段缓存失败: {str(e)}")
+
+
+stage_store = StageOutputStore()
+
+
+class CheckpointStore:
+    """一次执行的各阶段输出：travel:checkpoint:{run_key}，field 为阶段名"""
+
+    def __init__(self, redis=redis_client):
+        self.redis = redis
+
+    @staticmethod
+    def _key(run_key: str) -> str:
+        return f"{CHECKPOINT_KEY_PREFIX}{run_key}"
+
+    def load(self, run_key: str) -> Dict[str, str]:
+        try:
+            raw = self.redis.hgetall(self._key(run_key))
+        except Exception as e:
+            logging.warning(f"读取检查点失败: {str(e)}")
+            return {}
+        return {
+            (k.decode("utf-8") if isinstance(k, bytes) else k): (v.decode("utf-8") if isinstance(v, bytes) else v)
+            for k, v in raw.items()
+        }
+
+    def save(self, run_key: str, stage: str, output: str):
+        if not output:
+            return
+        key = self._key(run_key)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(key, stage, output)
+            pipe.expire(key, CHECKPOINT_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"写入检查点失败: {str(e)}")
+
+    def clear(self, run_key: str):
+        try:
+            self.redis.delete(self._key(run_key))
+        except Exception as e:
+            logging.warning(f"删除检查点失败: {str(e)}")
+
+
+checkpoint_store = CheckpointStore()
@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+try:
+    from crewai.events import crewai_event_bus, LLMStreamChunkEvent
+except ImportError:  # crewai < 1.0
+    from crewai.utilities.events import crewai_event_bus, LLMStreamChunkEvent
+
+from agents.types import ItineraryDay, Restaurant, Attraction, Accommodation
+
+# --- 整合阶段流式输出 ---
+# 整合任务以流式方式调用模型，边接收边解析 JSON：推荐结果中每个板块数组里的元素一闭合就校验并交给回调，
+# 不必等整份报告生成完。最终结果仍以 crewai 对完整输出的解析为准。
+COORDINATION_STREAMING = os.getenv("COORDINATION_STREAMING", "true").lower() == "true"
+
+# 板块 -> 元素的模型，tips 的元素是字符串
+SECTION_MODELS: Dict[str, Optional[type]] = {
+    "itinerary": ItineraryDay,
+    "restaurants": Restaurant,
+    "attractions": Attraction,
+    "accommodations": Accommodation,
+    "tips": None,
+}
+
+# ReAct 格式中，中间步骤（Thought / Action Input）里的 JSON 不是最终答案
+_FINAL_MARKER = "Final Answer:"
+_STEP_MARKERS = ("Thought:", "Action:")
+
+
+def _validate(section: str, value: Any) -> Optional[Any]:
+    model = SECTION_MODELS[section]
+    if model is None:
+        return value if isinstance(value, str) else None
+    try:
+        return model.model_validate(value).model_dump()
+    except ValidationError as e:
+        logging.debug(f"流式解析的 {section} 元素未通过校验: {str(e)}")
+        return None
+
+
+class IncrementalSectionParser:
+    """
+    增量扫描模型输出：找到最终答案的 JSON 对象后跟踪字符串、括号嵌套和顶层 key，
+    顶层板块数组中的元素闭合时返回 (板块, 序号, 校验后的元素)。
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._rooted = False
+        self._done = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._item_start: Optional[int] = None
+        self._counts: Dict[str, int] = defaultdict(int)
+
+    def _find_root(self) -> bool:
+        while True:
+            start = self._text.find("{", self._pos)
+            if start == -1:
+                self._pos = len(self._text)
+                return False
+            prefix = self._text[:start]
+            if _FINAL_MARKER not in prefix and any(m in prefix for m in _STEP_MARKERS):
+                self._pos = start + 1
+                continue
+            self._pos = start
+            self._rooted = True
+            return True
+
+    def _emit(self, raw: str, items: List[Tuple[str, int, Any]]):
+        section = self._key
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        item = _validate(section, value)
+        if item is None:
+            return
+        items.append((section, self._counts[section], item))
+        self._counts[section] += 1
+
+    def feed(self, chunk: str) -> List[Tuple[str, int, Any]]:
+        items: List[Tuple[str, int, Any]] = []
+        if self._done or not chunk:
+            return items
+        self._text += chunk
+        if not self._rooted and not self._find_root():
+            return items
+        text, stack = self._text, self._stack
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if len(stack) == 1 and self._expect_key:
+                        self._key = json.loads(text[self._string_start:i + 1])
+                    elif len(stack) == 2 and stack[1] == "[" and self._key in SECTION_MODELS:
+                        self._emit(text[self._string_start:i + 1], items)
+                continue
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                stack.append(c)
+                if len(stack) == 1:
+                    self._expect_key = True
+                elif len(stack) == 3 and stack[1] == "[" and c == "{" and self._key in SECTION_MODELS:
+                    self._item_start = i
+            elif c in "}]":
+                if len(stack) == 3 and self._item_start is not None:
+                    self._emit(text[self._item_start:i + 1], items)
+                    self._item_start = None
+                stack.pop()
+                if not stack:
+                    self._done = True
+                    break
+            elif len(stack) == 1 and c in ":,":
+                self._expect_key = c == ","
+        self._pos = len(text)
+        return items
+
+
+# 正在流式输出的任务（按 task.id，事件里只保留 task_id）-> 元素回调；
+# 每次 LLM 调用（重试、对冲各算一次）各用一个解析器
+_streams: Dict[str, Callable[[str, int, Any], None]] = {}
+_parsers: Dict[Tuple[str, str], IncrementalSectionParser] = {}
+_lock = threading.Lock()
+_registered = False
+
+
+def _on_chunk(source, event):
+    task_id = getattr(event, "task_id", None)
+    if task_id is None or getattr(event, "tool_call", None) is not None:
+        return
+    with _lock:
+        callback = _streams.get(task_id)
+        if callback is None:
+            return
+        parser = _parsers.setdefault((task_id, str(event.call_id)), IncrementalSectionParser())
+    for section, index, item in parser.feed(event.chunk):
+        try:
+            callback(section, index, item)
+        except Exception as e:
+            logging.warning(f"处理流式输出失败: {str(e)}")
+
+
+def register_section_stream(task, callback: Callable[[str, int, Any], None]):
+    """task 的 LLM 输出中每个板块元素闭合时调用 callback(板块, 序号, 元素)"""
+    global _registered
+    with _lock:
+        if not _registered:
+            crewai_event_bus.on(LLMStreamChunkEvent)(_on_chunk)
+            _registered = True
+        _streams[str(task.id)] = callback
+
+
+def unregister_section_stream(task):
+    with _lock:
+        _streams.pop(str(task.id), None)
+        for key in [k for k in _parsers if k[0] == str(task.id)]:
+            del _parsers[key]
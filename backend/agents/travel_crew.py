@@ -1,12 +1,33 @@
 import os
 import time
+import datetime
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from dotenv import load_dotenv
-from crewai import Agent, Task, Crew, Process, LLM
+from crewai import Agent, Task, Crew, Process
 from crewai.project import CrewBase, agent, crew, task
 from typing import Dict, Any, Optional
 import json
+from crewai.tasks.task_output import TaskOutput
 from agents.types import TravelRecommendation
+from task_queue.events import publish_task_event
+from agents.destination_store import DESTINATION_CACHE_ENABLED, destination_store, destination_key, travel_month
+from agents.llm_cache import create_llm
+from agents.llm_gateway import LLM_GATEWAY_ENABLED, create_gateway_llm
+from agents.itinerary import ITINERARY_FANOUT_LIMIT, use_per_day_itinerary, trip_dates, parse_skeleton, parse_day
+from agents.stage_store import (
+    STAGE_MEMO_ENABLED, MEMOIZED_STAGES, stage_store, stage_input_key,
+    CHECKPOINT_ENABLED, CHECKPOINT_STAGES, checkpoint_store
+)
+from agents.scheduling import CREW_EXECUTION_MODE, plan_tasks, log_stage_timeline
+from agents.instrumentation import record_stage_durations
+from agents.streaming import COORDINATION_STREAMING, register_section_stream, unregister_section_stream
+from agents.compaction import CONTEXT_COMPACTION_ENABLED, COMPACTED_STAGES, compact_stage_output
+from agents.cancellation import LLM_TIMEOUT_SECONDS, TaskAborted, check_abort, with_abort
+from task_queue import metrics
+from task_queue.queue_config import redis_client
+from task_queue.results import partial_field
 # 加载 .env 文件中的环境变量
 load_dotenv()
 # 配置日志
@@ -14,30 +35,216 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-@CrewBase
-class TravelRecommendationCrew:
-    def __init__(self):
-        # self.llm = LLM(
-        #     model="openrouter/deepseek/deepseek-r1:free",
-        #     base_url="https://openrouter.ai/api/v1",
-        #     api_key=os.getenv("OPENROUTER_API_KEY")
-        # )
-        self.llm = LLM(
+def create_travel_llm(stream: bool = False):
+    """创建 crew 使用的 LLM 客户端，worker 内可跨任务复用；stream 为整合阶段使用的流式客户端"""
+    if LLM_GATEWAY_ENABLED:
+        # 经 LLM 网关调用：多端点限流、重试与故障转移，端点由 LLM_ENDPOINTS 或 DEEPSEEK_*/OPENROUTER_* 配置
+        llm = create_gateway_llm(stream=stream)
+    else:
+        # 带两级响应缓存的 LLM，相同 prompt 不再重复请求模型
+        llm = create_llm(
             model=os.getenv("DEEPSEEK_MODEL"),
             base_url=os.getenv("DEEPSEEK_BASE_URL"),
-            api_key=os.getenv("DEEPSEEK_API_KEY")
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            stream=stream,
+            timeout=LLM_TIMEOUT_SECONDS
         )
+    # 任务被取消或超过截止时间时，正在等待的调用立即中止
+    return with_abort(llm)
+
+@CrewBase
+class TravelRecommendationCrew:
+    def __init__(self, llm=None, streaming_llm=None):
+        self.llm = llm or create_travel_llm()
+        if COORDINATION_STREAMING:
+            self.streaming_llm = streaming_llm or create_travel_llm(stream=True)
+        else:
+            self.streaming_llm = self.llm
         self.travel_input = None
+        # 当前执行的推荐任务 id，用于推送阶段进度
+        self.task_id = None
+        # 检查点的 key（任务的输入哈希），为 None 时不记录检查点
+        self.checkpoint_key = None
+        # 已有现成输出、无需再执行的任务
+        self._preloaded_tasks = set()
+        # 整合阶段流式解析出的各板块元素
+        self._partial_sections: Dict[str, list] = {}
+
+    def release(self):
+        """
+        清理 crewai 为本实例 memoize 的 agent/task。
+        这些缓存是全局的且永不过期，长期运行的 worker 每个任务结束后都应调用。
+        """
+        try:
+            from crewai.project.utils import cache
+            marker = str(("__instance__", id(self)))
+            with cache._lock.w_locked():
+                for key in [k for k in cache._cache if marker in k]:
+                    del cache._cache[key]
+        except Exception as e:
+            logging.warning(f"清理crew缓存失败: {str(e)}")
 
     def _task_callback(self, task_output):
         """任务完成回调函数"""
+        # 阶段之间检查任务是否已被取消或超时
+        check_abort()
         task_name = getattr(task_output, 'description', 'Unknown Task')[:50]
         current_time = time.localtime()
         logging.info(f"✅ 任务完成: {task_name}")
         logging.info(f"⏰ 完成时间: {current_time}")
         logging.info(f"📝 输出长度: {len(str(task_output))} 字符")
         logging.info("-" * 50)
+        if getattr(task_output, 'name', None) == "itinerary_task" and use_per_day_itinerary(self.travel_input):
+            self._expand_itinerary(task_output)
+        self._publish_stage(task_output)
+        if getattr(task_output, 'name', None) == "destination_task" and DESTINATION_CACHE_ENABLED:
+            destination_store.put(*destination_key(self.travel_input), task_output.raw)
+        if getattr(task_output, 'name', None) in MEMOIZED_STAGES and STAGE_MEMO_ENABLED:
+            task = getattr(self, task_output.name)()
+            stage_store.put(task.name, self._stage_key(task), task_output.raw)
+        if getattr(task_output, 'name', None) in CHECKPOINT_STAGES and CHECKPOINT_ENABLED and self.checkpoint_key:
+            checkpoint_store.save(self.checkpoint_key, task_output.name, task_output.raw)
+        self._compact_context(task_output)
         return task_output
+
+    def _preload_task_output(self, task: Task, raw: str):
+        """直接注入任务输出，该任务不再交给 Crew 执行，下游任务通过 context 读取"""
+        task.output = TaskOutput(
+            description=task.description,
+            name=task.name,
+            expected_output=task.expected_output,
+            raw=raw,
+            agent=task.agent.role
+        )
+        self._preloaded_tasks.add(id(task))
+        self._publish_stage(task.output, cached=True)
+        self._compact_context(task.output)
+
+    def _compact_context(self, task_output):
+        """
+        下游任务的 context 读取的是 task.output.raw：完整输出写入缓存并推送后，
+        将其替换为压缩后的摘要，缩短行程规划和最终整合的 prompt
+        """
+        name = getattr(task_output, 'name', None)
+        if CONTEXT_COMPACTION_ENABLED and name in COMPACTED_STAGES:
+            task_output.raw = compact_stage_output(name, task_output.raw)
+
+    def _publish_stage(self, task_output, cached: bool = False):
+        if self.task_id:
+            publish_task_event(self.task_id, "stage", {
+                "stage": getattr(task_output, 'name', None),
+                "output": task_output.raw,
+                "cached": cached
+            })
+
+    def _on_section_item(self, section: str, index: int, item: Any):
+        """整合阶段每解析出一个完整元素，就写入任务记录并推送给前端"""
+        items = self._partial_sections.setdefault(section, [])
+        # 重试或对冲时会从头再解析一遍，同一序号直接覆盖
+        if index < len(items):
+            items[index] = item
+        else:
+            items.append(item)
+        redis_client.hset(f"travel:task:{self.task_id}", partial_field(section),
+                          json.dumps(items, ensure_ascii=False))
+        publish_task_event(self.task_id, "partial", {"section": section, "index": index, "item": item})
+
+    def _load_checkpoints(self):
+        """重试或重新提交时，已完成的阶段直接使用检查点中的输出"""
+        if not CHECKPOINT_ENABLED or not self.checkpoint_key:
+            return
+        outputs = checkpoint_store.load(self.checkpoint_key)
+        for name in CHECKPOINT_STAGES:
+            if name in outputs:
+                logging.info(f"⏩ 从检查点恢复阶段: {name}")
+                metrics.inc("travel_checkpoint_resumed_total", stage=name)
+                self._preload_task_output(getattr(self, name)(), outputs[name])
+
+    def _load_cached_destination_report(self):
+        """复用 (目的地, 月份) 的目的地报告；报告已过期时照常使用并触发后台刷新"""
+        if not DESTINATION_CACHE_ENABLED or id(self.destination_task()) in self._preloaded_tasks:
+            return
+        destination, month = destination_key(self.travel_input)
+        cached = destination_store.get(destination, month)
+        if cached is None:
+            metrics.inc("travel_destination_cache_total", result="miss")
+            return
+        report, fresh = cached
+        metrics.inc("travel_destination_cache_total", result="fresh" if fresh else "stale")
+        self._preload_task_output(self.destination_task(), report)
+        logging.info(f"🗂️ 使用缓存的目的地报告: {destination} {month}月 ({'新鲜' if fresh else '已过期'})")
+        if not fresh and destination_store.try_acquire_refresh(destination, month):
+            from task_queue.tasks import refresh_destination_report
+            refresh_destination_report(self.travel_input)
+
+    def _itinerary_day_task(self, skeleton: list, skeleton_day: Dict[str, Any]) -> Task:
+        travel_input = self.travel_input
+        return Task(
+            name=f"itinerary_day_{skeleton_day['day']}",
+            description=f"""根据行程骨架，制定第{skeleton_day['day']}天（{skeleton_day['date']}）的详细安排：
+            目的地：{travel_input['destination']}
+            当天骨架：{json.dumps(skeleton_day, ensure_ascii=False)}
+            全程骨架（避免与其他天重复）：{json.dumps(skeleton, ensure_ascii=False)}
+
+            安排当天的景点游览顺序、餐厅、交通，时间衔接要合理。
+            输出格式要求: JSON格式 包含:
+            - day: 第几天
+            - date: 日期
+            - schedule: 当天行程数组，包含：
+                - time: 时间
+                - activity: 活动
+            """,
+            agent=self.itinerary_planner(),
+            expected_output="单日行程的 JSON 对象"
+        )
+
+    def _expand_itinerary(self, task_output):
+        """
+        行程任务只生成了逐日骨架：按天并发生成详细安排（最多 ITINERARY_FANOUT_LIMIT 天同时进行），
+        合并为完整的每日行程，替换该任务的输出供最终整合使用
+        """
+        task = self.itinerary_task()
+        skeleton = parse_skeleton(task_output.raw, trip_dates(self.travel_input))
+        context = "\n\n".join(t.output.raw for t in (self.destination_task(), self.preference_task()) if t.output)
+
+        def generate_day(skeleton_day):
+            day_task = self._itinerary_day_task(skeleton, skeleton_day)
+            # 每天用独立的 agent 副本，避免并发执行时共用执行器状态
+            output = day_task.execute_sync(agent=self._new_itinerary_planner(), context=context)
+            return parse_day(output.raw, skeleton_day)
+
+        logging.info(f"🗓️ 按天生成行程: {len(skeleton)} 天，并发 {ITINERARY_FANOUT_LIMIT}")
+        with ThreadPoolExecutor(max_workers=ITINERARY_FANOUT_LIMIT) as pool:
+            # 复制上下文，各天的 LLM 调用同样受中止信号控制
+            futures = [pool.submit(contextvars.copy_context().run, generate_day, day) for day in skeleton]
+            days = [future.result() for future in futures]
+        task_output.raw = json.dumps({"itinerary": days}, ensure_ascii=False)
+        task.end_time = datetime.datetime.now()
+
+    def _stage_key(self, task: Task) -> str:
+        """任务及其全部上游任务的输入摘要，上游输入变化时下游也视为变化"""
+        context = task.context if isinstance(task.context, list) else []
+        return stage_input_key(task, [self._stage_key(t) for t in context])
+
+    def _load_memoized_stages(self):
+        """输入未变化的阶段直接复用上次的输出，只重跑输入变化的阶段"""
+        if not STAGE_MEMO_ENABLED:
+            return
+        for name in MEMOIZED_STAGES:
+            task = getattr(self, name)()
+            if id(task) in self._preloaded_tasks:
+                continue
+            output = stage_store.get(name, self._stage_key(task))
+            metrics.inc("travel_stage_memo_total", stage=name, result="hit" if output is not None else "miss")
+            if output is not None:
+                logging.info(f"♻️ 复用阶段输出: {name}")
+                self._preload_task_output(task, output)
+
+    def refresh_destination_report(self, travel_input: Dict[str, Any]):
+        """只执行目的地分析任务，结果由回调写入缓存"""
+        self.travel_input = travel_input
+        task = self.destination_task()
+        task.execute_sync(agent=task.agent)
     
     @agent    
     def destination_expert(self) -> Agent:
@@ -55,6 +262,9 @@ class TravelRecommendationCrew:
     @agent
     def itinerary_planner(self) -> Agent:
         """行程规划师 - 负责制定详细行程"""
+        return self._new_itinerary_planner()
+
+    def _new_itinerary_planner(self) -> Agent:
         return Agent(
             role="专业行程规划师",
             goal="根据旅行时间和偏好制定合理的日程安排",
@@ -87,7 +297,7 @@ class TravelRecommendationCrew:
             goal="整合所有专家的建议，生成最终的个性化旅行推荐",
             backstory="""你是团队的协调员，负责整合目的地专家、行程规划师和偏好分析师的建议，
             生成一份完整、个性化且实用的旅行推荐报告。""",
-            llm=self.llm,
+            llm=self.streaming_llm,
             verbose=True,
             allow_delegation=True
         )
@@ -104,7 +314,7 @@ class TravelRecommendationCrew:
             4. 交通方式和注意事项
             5. 最佳游览时间和季节特色
             
-            旅行时间：{travel_input['start_date']} 到 {travel_input['end_date']}
+            旅行月份：{travel_month(travel_input)}月
             """,
             agent=self.destination_expert(),
             expected_output="详细的目的地信息报告，包含景点、美食、文化、交通等信息",
@@ -130,6 +340,26 @@ class TravelRecommendationCrew:
     @task
     def itinerary_task(self) -> Task:
         travel_input = self.travel_input
+        if use_per_day_itinerary(travel_input):
+            # 长行程先只生成逐日骨架，详细安排在回调中按天并发生成
+            return Task(
+                description=f"""基于目的地信息和用户偏好，为整个行程制定逐日骨架：
+                目的地：{travel_input['destination']}
+                开始日期：{travel_input['start_date']}
+                结束日期：{travel_input['end_date']}
+
+                每天只需给出主题和游览区域，不要展开具体安排，相邻两天的区域尽量连贯。
+                输出格式要求: JSON数组，每天一项，包含:
+                - day: 第几天
+                - date: 日期
+                - theme: 当天主题
+                - areas: 游览区域/主要景点数组
+                """,
+                agent=self.itinerary_planner(),
+                expected_output="逐日行程骨架的 JSON 数组",
+                context=[self.destination_task(), self.preference_task()],
+                callback=self._task_callback
+            )
         return Task(
             description=f"""基于目的地信息和用户偏好，制定详细行程：
             目的地：{travel_input['destination']}
@@ -181,25 +411,43 @@ class TravelRecommendationCrew:
     @crew
     def crew(self) -> Crew:
         # 创建团队并执行，添加超时设置
+        # dag 模式下互不依赖的任务（目的地分析、偏好分析）会并发执行
         return Crew(
             agents=self.agents,
-            tasks=self.tasks,
+            tasks=plan_tasks(
+                [t for t in self.tasks if id(t) not in self._preloaded_tasks],
+                CREW_EXECUTION_MODE
+            ),
             process=Process.sequential,
-            verbose=True,
-            # 添加任务超时设置（单位：秒）
-            task_timeout=600  # 10分钟超时
+            verbose=True
         )
 
-    def generate_recommendations(self, travel_input: Dict[str, Any]):
-        """包装CrewAI执行，添加详细日志"""
+    def generate_recommendations(self, travel_input: Dict[str, Any], task_id: Optional[str] = None,
+                                 checkpoint_key: Optional[str] = None):
+        """包装CrewAI执行，添加详细日志；checkpoint_key 不为空时记录并从检查点恢复各阶段输出"""
         try:
             self.travel_input = travel_input  
+            self.task_id = task_id
+            self.checkpoint_key = checkpoint_key
+            self._load_checkpoints()
+            self._load_cached_destination_report()
+            self._load_memoized_stages()
             logging.info("🤖 创建Crew实例...")
             crew_instance = self.crew()
 
-            logging.info("🎯 开始执行kickoff()...")
-            result = crew_instance.kickoff()
+            logging.info(f"🎯 开始执行kickoff()... 执行模式: {CREW_EXECUTION_MODE}")
+            streaming = COORDINATION_STREAMING and self.task_id is not None
+            if streaming:
+                register_section_stream(self.coordination_task(), self._on_section_item)
+            try:
+                check_abort()
+                result = crew_instance.kickoff()
+            finally:
+                if streaming:
+                    unregister_section_stream(self.coordination_task())
             logging.info("✅ CrewAI执行完成!")
+            log_stage_timeline(crew_instance.tasks)
+            record_stage_durations(crew_instance.tasks)
             output = result.tasks_output[-1].to_dict()
             # if isinstance(result, dict):
             #     for key in ["itinerary", "restaurants", "attractions", "accommodations", "tips"]:
@@ -211,6 +459,8 @@ class TravelRecommendationCrew:
                 "analysis": "基于您的偏好和目的地特色，我们的AI团队为您精心制定了这份个性化旅行推荐。",
                 "status": "success"
             }
+        except TaskAborted:
+            raise
         except json.JSONDecodeError as e:
             logging.error(f"JSON解析错误: {str(e)}")
             summary = "无法解析AI生成的推荐内容"
@@ -0,0 +1,254 @@
+"""
+端到端离线基准：本地假 LLM 服务 + FastAPI（uvicorn）+ huey worker，全部在本机启动，不需要网络。
+
+统计吞吐量、提交到拿到结果的 p50/p95/p99 延迟、排队等待时间以及每个请求产生的 Redis 命令数。
+会清空 BENCH_REDIS_URL 指向的数据库，请使用独立的 db：
+    BENCH_REDIS_URL=redis://localhost:6379/15 python benchmark/bench_e2e.py --requests 50 --concurrency 10
+
+其余环境变量（HUEY_WORKERS、LLM_CACHE_ENABLED、CREW_EXECUTION_MODE 等）原样传给 API 和 worker，
+便于对比不同配置。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import asyncio
+import argparse
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+import redis
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def redis_command_count(client: redis.Redis) -> Optional[int]:
+    """服务端累计执行的命令数，优先用 commandstats"""
+    try:
+        stats = client.info("commandstats")
+        if stats:
+            return sum(int(v["calls"]) for v in stats.values())
+    except Exception:
+        pass
+    try:
+        return int(client.info("stats")["total_commands_processed"])
+    except Exception:
+        return None
+
+
+def wait_until_ready(url: str, timeout: float, process: subprocess.Popen, name: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} 启动失败，退出码 {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{name} 在 {timeout:.0f} 秒内未就绪")
+
+
+def travel_request(i: int, distinct: int) -> Dict[str, Any]:
+    n = i % distinct
+    return {
+        "destination": f"基准城市{n}",
+        "travel_dates": {"start": "2025-05-01", "end": "2025-05-03"},
+        "preferences": {"interests": ["美食", "文化"], "bench_input": n}
+    }
+
+
+async def wait_for_result(client: httpx.AsyncClient, task_id: str) -> str:
+    """读 SSE 直到 result 事件，返回任务状态"""
+    async with client.stream("GET", f"/api/stream/{task_id}") as stream:
+        event_type = None
+        async for line in stream.aiter_lines():
+            if line.startswith("event: "):
+                event_type = line[len("event: "):]
+            elif line.startswith("data: ") and event_type in ("result", "error"):
+                return json.loads(line[len("data: "):]).get("status", "ERROR")
+    return "ERROR"
+
+
+async def run_one(client: httpx.AsyncClient, i: int, distinct: int, timeout: float,
+                  semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    async with semaphore:
+        submitted = time.monotonic()
+        response = await client.post("/api/recommend", json=travel_request(i, distinct))
+        if response.status_code != 202:
+            return {"status": f"HTTP {response.status_code}", "latency": None}
+        task_id = response.json()["task_id"]
+        try:
+            status = await asyncio.wait_for(wait_for_result(client, task_id), timeout)
+        except asyncio.TimeoutError:
+            status = "TIMEOUT"
+        return {"task_id": task_id, "status": status, "latency": time.monotonic() - submitted}
+
+
+def queue_waits(client: redis.Redis, task_ids: List[str]) -> List[float]:
+    """排队等待 = worker 发布 started 事件的时间 - 任务创建时间"""
+    pipe = client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.hget(f"travel:task:{task_id}", "created_at")
+        pipe.lindex(f"travel:events:{task_id}:log", 0)
+    values = pipe.execute()
+    waits = []
+    for created_at, first_event in zip(values[::2], values[1::2]):
+        if not created_at or not first_event:
+            continue
+        event = json.loads(first_event)
+        if event["type"] == "started":
+            waits.append(max(event["time"] - float(created_at), 0))
+    return waits
+
+
+async def drive(api_url: str, args) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2 + 4)
+    async with httpx.AsyncClient(base_url=api_url, timeout=httpx.Timeout(30, read=None), limits=limits) as client:
+        return await asyncio.gather(*[
+            run_one(client, i, args.distinct or args.requests, args.timeout, semaphore)
+            for i in range(args.requests)
+        ])
+
+
+def _fmt(value: Optional[float], unit: str = "s") -> str:
+    return f"{value:.3f}{unit}" if value is not None else "n/a"
+
+
+def report(results: List[Dict[str, Any]], waits: List[float], elapsed: float,
+           redis_ops: Optional[int], args) -> Dict[str, Any]:
+    ok = [r for r in results if r["status"] == "SUCCESS"]
+    latencies = [r["latency"] for r in ok]
+    summary = {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": {s: sum(1 for r in results if r["status"] == s)
+                   for s in sorted({r["status"] for r in results}) if s != "SUCCESS"},
+        "elapsed": elapsed,
+        "throughput": len(ok) / elapsed if elapsed else 0,
+        "latency": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        "queue_wait": {f"p{p}": percentile(waits, p) for p in (50, 95, 99)},
+        "redis_ops_per_request": redis_ops / len(results) if redis_ops is not None and results else None,
+        "config": {
+            "concurrency": args.concurrency,
+            "distinct": args.distinct or args.requests,
+            "workers": os.getenv("HUEY_WORKERS", "4"),
+            "llm_latency_mean": args.latency_mean,
+            "llm_latency_sigma": args.latency_sigma,
+            "tokens_per_second": args.tokens_per_second
+        }
+    }
+    print(f"请求数: {summary['requests']}  成功: {summary['succeeded']}  失败: {summary['failed'] or 0}")
+    print(f"总耗时: {elapsed:.2f}s  吞吐量: {summary['throughput']:.3f} 个/秒")
+    print("提交到结果: " + "  ".join(f"{k}={_fmt(v)}" for k, v in summary["latency"].items()))
+    print("排队等待:   " + "  ".join(f"{k}={_fmt(v)}" for k, v in summary["queue_wait"].items()))
+    print(f"Redis 命令数/请求: {_fmt(summary['redis_ops_per_request'], '')}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端离线基准")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10, help="同时在途的客户端请求数")
+    parser.add_argument("--distinct", type=int, default=0, help="不同输入的个数，0 表示每个请求都不同")
+    parser.add_argument("--timeout", type=float, default=600, help="单个请求等待结果的上限（秒）")
+    parser.add_argument("--latency-mean", type=float, default=1.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="把统计结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    llm_port, api_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        REDIS_URL=BENCH_REDIS_URL,
+        DEEPSEEK_MODEL="openai/fake-llm",
+        DEEPSEEK_API_KEY="fake",
+        DEEPSEEK_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        CREWAI_DISABLE_TELEMETRY="true",
+        OTEL_SDK_DISABLED="true",
+        PYTHONUNBUFFERED="1"
+    )
+    env.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+
+    client = redis.Redis.from_url(BENCH_REDIS_URL)
+    client.flushdb()
+
+    # 各子进程的输出写到临时日志，出错时查看
+    log = tempfile.NamedTemporaryFile("w", prefix="bench_e2e_", suffix=".log", delete=False)
+    print(f"子进程日志: {log.name}")
+    processes = []
+    try:
+        llm = subprocess.Popen(
+            [sys.executable, "benchmark/fake_llm_server.py", "--port", str(llm_port),
+             "--latency-mean", str(args.latency_mean), "--latency-sigma", str(args.latency_sigma),
+             "--tokens-per-second", str(args.tokens_per_second),
+             "--completion-tokens", str(args.completion_tokens), "--seed", str(args.seed)],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(llm)
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(api)
+        worker = subprocess.Popen(
+            [sys.executable, "start_worker.py"], cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(worker)
+
+        wait_until_ready(f"http://127.0.0.1:{llm_port}/v1/models", 30, llm, "假 LLM 服务")
+        wait_until_ready(f"http://127.0.0.1:{api_port}/health", 120, api, "API")
+
+        try:
+            client.config_resetstat()
+        except redis.RedisError:
+            pass
+        ops_before = redis_command_count(client)
+        started = time.monotonic()
+        results = asyncio.run(drive(f"http://127.0.0.1:{api_port}", args))
+        elapsed = time.monotonic() - started
+        ops_after = redis_command_count(client)
+        redis_ops = ops_after - ops_before if ops_before is not None and ops_after is not None else None
+
+        waits = queue_waits(client, [r["task_id"] for r in results if r.get("task_id")])
+        summary = report(results, waits, elapsed, redis_ops, args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in reversed(processes):
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+公平调度模拟：一个集成客户端一次提交大量 batch 任务，交互用户陆续提交，
+比较单一 FIFO 队列与公平调度下交互任务的排队时间（以单个任务耗时为单位）。
+调度使用真实的派发脚本，时间和 worker 执行是模拟的。
+
+会清空 BENCH_REDIS_URL 指向的数据库，请使用独立的 db：
+    BENCH_REDIS_URL=redis://localhost:6379/15 python benchmark/bench_fair_share.py
+"""
+import os
+import sys
+import heapq
+import statistics
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+os.environ["REDIS_URL"] = BENCH_REDIS_URL
+
+from task_queue.queue_config import huey, redis_client
+from task_queue import tasks, scheduler
+
+BATCH_TASKS = int(os.getenv("BENCH_BATCH_TASKS", "500"))
+INTERACTIVE_TASKS = int(os.getenv("BENCH_INTERACTIVE_TASKS", "50"))
+# 交互任务的提交间隔（单个任务耗时的倍数）
+INTERACTIVE_INTERVAL = float(os.getenv("BENCH_INTERACTIVE_INTERVAL", "2"))
+WORKERS = scheduler.WORKER_CAPACITY
+
+
+def arrivals():
+    """(提交时间, 任务 id, 通道, 客户端)：batch 全部在 0 时刻提交"""
+    items = [(0.0, f"batch-{i:05d}", "batch", "key:integration") for i in range(BATCH_TASKS)]
+    items += [(1 + i * INTERACTIVE_INTERVAL, f"user-{i:05d}", "interactive", f"ip:user-{i}")
+              for i in range(INTERACTIVE_TASKS)]
+    return sorted(items)
+
+
+def simulate_fifo():
+    waits = []
+    free_at = [0.0] * WORKERS
+    for submitted, task_id, lane, _ in arrivals():
+        start = max(submitted, heapq.heappop(free_at))
+        heapq.heappush(free_at, start + 1)
+        if lane == "interactive":
+            waits.append(start - submitted)
+    return waits
+
+
+def simulate_scheduler():
+    redis_client.flushdb()
+    pending = deque(arrivals())
+    submitted_at = {task_id: t for t, task_id, _, _ in pending}
+    running = []  # (结束时间, 任务 id)
+    waits = []
+    now = 0.0
+    while pending or running or redis_client.llen(huey.storage.queue_key):
+        while pending and pending[0][0] <= now:
+            _, task_id, lane, client = pending.popleft()
+            tasks.enqueue_travel_recommendation(task_id, {"destination": "bench"}, lane, client)
+        # 空闲的 worker 从 huey 队列取任务
+        while len(running) < WORKERS:
+            raw = redis_client.rpop(huey.storage.queue_key)
+            if raw is None:
+                break
+            task_id = huey.deserialize_task(raw).args[0]
+            if task_id.startswith("user-"):
+                waits.append(now - submitted_at[task_id])
+            heapq.heappush(running, (now + 1, task_id))
+        next_events = [t for t in (pending[0][0] if pending else None, running[0][0] if running else None)
+                       if t is not None]
+        if not next_events:
+            break
+        now = min(next_events)
+        while running and running[0][0] <= now:
+            _, task_id = heapq.heappop(running)
+            redis_client.hset(f"{tasks.TASK_KEY_PREFIX}{task_id}", "status", "SUCCESS")
+            scheduler.release_slot(task_id, 0, tasks.TASK_KEY_PREFIX)
+    redis_client.flushdb()
+    return waits
+
+
+def report(name, waits):
+    waits = sorted(waits)
+    p99 = waits[min(int(len(waits) * 0.99), len(waits) - 1)]
+    print(f"{name:<8} p50 {statistics.median(waits):8.1f}  p99 {p99:8.1f}  max {waits[-1]:8.1f}")
+
+
+def main():
+    huey.immediate = False
+    print(f"{WORKERS} 个 worker，{BATCH_TASKS} 个 batch 任务同时提交，"
+          f"{INTERACTIVE_TASKS} 个交互任务每 {INTERACTIVE_INTERVAL} 个任务耗时提交一个")
+    print("交互任务排队时间（单个任务耗时的倍数）")
+    report("FIFO", simulate_fifo())
+    report("公平调度", simulate_scheduler())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+队列位置查询基准：公平调度下，按通道内加权轮转计算位置的耗时，随排队任务数和活跃客户端数的变化。
+旧版 LRANGE + pickle 全量扫描 huey 队列的耗时作为对照（任务数相同）。
+公平调度取消了票号/游标（O(1)），位置查询为 O(通道内活跃客户端数)，客户端数较多时会明显变慢，
+以此换取按客户端轮转的派发顺序。
+
+会清空 BENCH_REDIS_URL 指向的数据库，请使用独立的 db：
+    BENCH_REDIS_URL=redis://localhost:6379/15 python benchmark/bench_queue_position.py
+"""
+import os
+import sys
+import time
+import pickle
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+os.environ["REDIS_URL"] = BENCH_REDIS_URL
+
+from task_queue.queue_config import huey, redis_client
+from task_queue import tasks
+
+QUEUED = int(os.getenv("BENCH_QUEUED", "10000"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "20"))
+CLIENT_COUNTS = (1, 10, 100)
+
+
+def legacy_get_position(task_id: str):
+    """旧实现：读取整个队列并逐条反序列化"""
+    queue_items = redis_client.lrange(f"huey.redis.{huey.name}", 0, -1)
+    total = len(queue_items)
+    for idx, raw in enumerate(queue_items):
+        message = pickle.loads(raw)
+        if message.args[0] == task_id:
+            return total - idx + 1
+    return None
+
+
+def bench(name, fn, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:<16} {elapsed * 1000:10.3f} ms/次")
+    return elapsed
+
+
+def main():
+    # 只入队不执行
+    huey.immediate = False
+    print(f"排队任务数: {QUEUED}，查询位置的任务位于第一个客户端队列的中部")
+
+    redis_client.flushdb()
+    task_ids = [str(uuid.uuid4()) for _ in range(QUEUED)]
+    for task_id in task_ids:
+        huey.enqueue(tasks.process_travel_recommendation.s(task_id, {"destination": "bench"}))
+    legacy = bench("LRANGE扫描", lambda: legacy_get_position(task_ids[QUEUED // 2]))
+
+    for clients in CLIENT_COUNTS:
+        redis_client.flushdb()
+        task_ids = [str(uuid.uuid4()) for _ in range(QUEUED)]
+        for i, task_id in enumerate(task_ids):
+            tasks.enqueue_travel_recommendation(task_id, {"destination": "bench"}, client=f"ip:{i % clients}")
+        target = task_ids[(QUEUED // 2) - (QUEUED // 2) % clients]
+        elapsed = bench(f"调度({clients}个客户端)", lambda: tasks.get_queue_position_status(target),
+                        rounds=ROUNDS * 10)
+        print(f"{'':<16} 位置 {tasks.get_position(target)}，耗时为 LRANGE 扫描的 {elapsed / legacy:.2f} 倍")
+    redis_client.flushdb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+进程冷启动基准：在独立子进程中分别导入 API（main）和 worker（任务模块 + crew 依赖），
+记录导入耗时、常驻内存峰值、加载的模块数，以及是否加载了 crewai。
+
+只导入不连接 Redis，但需要设置 REDIS_URL：
+    REDIS_URL=redis://localhost:6379/0 python benchmark/bench_startup.py
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+
+TARGETS = {
+    "api": "import main",
+    "worker": "import task_queue.tasks; task_queue.tasks.load_crew_modules()",
+    # 拆分前 API 进程的导入内容，用于对比
+    "api+crew": "import main; import agents.travel_crew",
+}
+
+_PROBE = """
+import sys, time, json, resource
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# Linux 单位为 KB，macOS 为字节
+rss_mb = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb, "modules": len(sys.modules),
+                  "crewai": "crewai" in sys.modules}}))
+"""
+
+
+def probe(code: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(code=code)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    print(f"每个目标运行 {ROUNDS} 次，取中位数")
+    print(f"{'目标':<10} {'导入耗时(s)':>12} {'RSS峰值(MB)':>12} {'模块数':>8} {'crewai':>8}")
+    for name, code in TARGETS.items():
+        runs = [probe(code) for _ in range(ROUNDS)]
+        seconds = statistics.median(r["seconds"] for r in runs)
+        rss_mb = statistics.median(r["rss_mb"] for r in runs)
+        print(f"{name:<10} {seconds:>12.2f} {rss_mb:>12.1f} {runs[0]['modules']:>8} {str(runs[0]['crewai']):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+本地 OpenAI 兼容的假 LLM 服务，供离线基准测试使用，不需要网络和 API key。
+
+每次 /v1/chat/completions 请求的耗时 = 首 token 延迟（对数正态分布）+ 输出 token 数 / 生成速度，
+返回内容是一份合法的 TravelRecommendation JSON，所有阶段都能正常解析。
+
+    python benchmark/fake_llm_server.py --port 18080 --latency-mean 1.0 --tokens-per-second 50
+"""
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FAKE_RECOMMENDATION = {
+    "itinerary": [
+        {"day": 1, "date": "2025-01-01", "schedule": [
+            {"time": "09:00", "activity": "参观景点"},
+            {"time": "12:00", "activity": "午餐"},
+            {"time": "14:00", "activity": "城市漫步"}
+        ]}
+    ],
+    "restaurants": [{"name": "本地餐厅", "location": "市中心", "specialty": "当地菜", "cost": "100元"}],
+    "attractions": [{"name": "著名景点", "highlight": "历史建筑", "ticket": "50元"}],
+    "accommodations": [{"name": "舒适酒店", "location": "市中心", "feature": "交通便利", "price": "500元/晚"}],
+    "tips": ["提前预约热门景点"]
+}
+
+
+class LatencyModel:
+    """首 token 延迟服从对数正态分布（均值 latency_mean 秒），之后按 tokens_per_second 输出"""
+
+    def __init__(self, latency_mean: float, latency_sigma: float, tokens_per_second: float,
+                 completion_tokens: int, seed=None):
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        if self.latency_mean <= 0:
+            first_token = 0.0
+        else:
+            # 让分布的均值等于 latency_mean
+            mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+            with self._lock:
+                first_token = self._random.lognormvariate(mu, self.latency_sigma)
+        generation = self.completion_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return first_token + generation
+
+
+def _count_prompt_tokens(messages) -> int:
+    # 粗略估算：中英文混合时按 2 个字符 1 个 token
+    return sum(len(str(m.get("content") or "")) for m in messages) // 2 + 1
+
+
+def make_handler(model: LatencyModel):
+    content = "Thought: I now know the final answer\nFinal Answer: " + json.dumps(FAKE_RECOMMENDATION, ensure_ascii=False)
+
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            time.sleep(model.sample())
+            prompt_tokens = _count_prompt_tokens(body.get("messages") or [])
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": model.completion_tokens,
+                "total_tokens": prompt_tokens + model.completion_tokens
+            }
+            if body.get("stream"):
+                self._send_stream(body, usage)
+                return
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+        def _send_stream(self, body, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunks = [{"delta": {"role": "assistant", "content": content}, "finish_reason": None},
+                      {"delta": {}, "finish_reason": "stop"}]
+            for choice in chunks:
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model"), "choices": [dict(index=0, **choice)]}
+                if choice["finish_reason"]:
+                    chunk["usage"] = usage
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeLLMHandler
+
+
+def serve(host: str, port: int, model: LatencyModel) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(model))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的假 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-mean", type=float, default=1.0, help="首 token 平均延迟（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="对数正态分布的 sigma，0 表示固定延迟")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="输出速度，0 表示不计生成时间")
+    parser.add_argument("--completion-tokens", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    model = LatencyModel(args.latency_mean, args.latency_sigma, args.tokens_per_second,
+                         args.completion_tokens, args.seed)
+    server = serve(args.host, args.port, model)
+    print(f"Fake LLM server listening on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,29 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Literal
 import uvicorn
 import os
 from dotenv import load_dotenv
-import uuid
 from enum import Enum
 import hashlib
-import redis
 import json
 import asyncio
-import time
 import logging
 
 # 加载环境变量
 load_dotenv()
 
-from task_queue.tasks import process_travel_recommendation, get_queue_status, get_position
-from task_queue.queue_config import redis_client
-
-from agents.travel_crew import TravelRecommendationCrew
+from task_queue.events import task_channel, QUEUE_EVENTS_CHANNEL
+from task_queue import async_store, metrics, scheduler
+from task_queue.results import RESULT_SECTIONS, relabel_itinerary_dates
+from agents.canonical import canonical_destination, canonicalize_request, trip_shape
+from agents.itinerary import ITINERARY_MAX_DAYS, trip_too_long
+from task_queue.async_store import async_redis_client
+from task_queue.queue_config import TASK_TTL, TASK_DEADLINE_SECONDS
+from task_queue.memory_report import collect_memory_report
+from agents.llm_cache import LRUCache
 
 app = FastAPI(
     title="智能旅游推荐系统",
@@ -37,17 +40,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- Redis 缓存设置 ---
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# --- Redis 设置：所有访问走 task_queue.async_store 的异步连接池 ---
+STREAM_HEARTBEAT_SECONDS = 15
 
 # --- Task Management ---
 class TaskStatus(str, Enum):
     PENDING = "PENDING"
     SUCCESS = "SUCCESS"
     FAILURE = "FAILURE"
+    CANCELLED = "CANCELLED"
 
-tasks = {}
+# 进程内任务状态，仅在 Redis 不可用时兜底；按 LRU 限制条数，过期时间与 Redis 中的任务一致
+TASKS_CACHE_MAX_ENTRIES = int(os.getenv("TASKS_CACHE_MAX_ENTRIES", "1000"))
+tasks = LRUCache(TASKS_CACHE_MAX_ENTRIES, TASK_TTL)
 
 # --- Pydantic Models ---
 class TravelRequest(BaseModel):
@@ -55,6 +60,16 @@ class TravelRequest(BaseModel):
     travel_dates: Dict[str, str]
     xiaohongshu_account: Optional[str] = None
     preferences: Optional[Dict[str, Any]] = None
+    # 截止时间（秒，从提交起算），只能比 TASK_DEADLINE_SECONDS 更短
+    deadline_seconds: Optional[float] = None
+    # 调度通道：interactive（默认，用户在页面上等待）或 batch（批量/集成调用，让位于 interactive）
+    priority: Optional[Literal["interactive", "batch"]] = None
+
+class ReviseRequest(BaseModel):
+    # 只需给出要修改的部分
+    destination: Optional[str] = None
+    travel_dates: Optional[Dict[str, str]] = None
+    preferences: Optional[Dict[str, Any]] = None
 
 class TaskCreationResponse(BaseModel):
     task_id: str
@@ -64,70 +79,25 @@ class TaskResultResponse(BaseModel):
     status: TaskStatus
     result: Optional[Dict[str, Any]] = None
 
-class QueueStatusResponse(BaseModel):
-    total: int
-    position: int
+class BatchResultRequest(BaseModel):
+    task_ids: List[str]
+    status_only: bool = False
+    fields: Optional[List[str]] = None
 
-# --- Crew AI Setup ---
-travel_crew = TravelRecommendationCrew()
+# --- 单飞提交 ---
+# PENDING 超过该时长视为任务已丢失（worker 崩溃等），允许重新提交
+SINGLE_FLIGHT_STALE_SECONDS = int(os.getenv("SINGLE_FLIGHT_STALE_SECONDS", "900"))
 
-async def run_crew_in_background(task_id: str, travel_input: Dict[str, Any]):
-    try:
-        # 记录任务开始时间
-        start_time = time.monotonic()
-        logging.info(f"开始执行任务 {task_id}，目的地: {travel_input.get('destination')}")
-        
-        # 添加超时控制（10分钟）
-        try:
-            result = await asyncio.wait_for(
-                travel_crew.generate_recommendations(travel_input),
-                timeout=600.0  # 10分钟超时
-            )
-            
-            # 记录执行时间
-            elapsed = time.monotonic() - start_time
-            logging.info(f"任务 {task_id} 成功完成，耗时: {elapsed:.2f}秒")
-            if result and result.get("status") == "success":
-                tasks[task_id] = {"status": TaskStatus.SUCCESS, "result": result}
-                # 写入 Redis
-                redis_client.hset(f"travel:task:{task_id}", mapping={
-                    "status": TaskStatus.SUCCESS,
-                    "result": json.dumps(result, ensure_ascii=False)
-                })
-            else:
-                tasks[task_id] = {"status": TaskStatus.FAILURE, "result": result}
-                redis_client.hset(f"travel:task:{task_id}", mapping={
-                    "status": TaskStatus.FAILURE,
-                    "result": json.dumps(result, ensure_ascii=False)
-                })
-        except asyncio.TimeoutError:
-            # 处理超时情况
-            elapsed = time.monotonic() - start_time
-            logging.error(f"任务 {task_id} 执行超时，已耗时: {elapsed:.2f}秒")
-            
-            error_result = {"error": "任务执行超时，请稍后再试"}
-            tasks[task_id] = {"status": TaskStatus.FAILURE, "result": error_result}
-            
-            # 使用线程池执行同步Redis操作
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(
-                None,
-                lambda: redis_client.hset(f"travel:task:{task_id}", mapping={
-                    "status": TaskStatus.FAILURE,
-                    "result": json.dumps(error_result, ensure_ascii=False)
-                })
-            )
-    except Exception as e:
-        import traceback
-        elapsed = time.monotonic() - start_time if 'start_time' in locals() else 0
-        logging.error(f"任务 {task_id} 执行失败，耗时: {elapsed:.2f}秒，错误: {str(e)}")
-        logging.error(f"异常详情: {traceback.format_exc()}")
-        
-        tasks[task_id] = {"status": TaskStatus.FAILURE, "result": {"error": str(e)}}
-        redis_client.hset(f"travel:task:{task_id}", mapping={
-            "status": TaskStatus.FAILURE,
-            "result": json.dumps({"error": str(e)}, ensure_ascii=False)
-        })
+# --- 批量查询结果 ---
+RESULTS_BATCH_MAX = int(os.getenv("RESULTS_BATCH_MAX", "1000"))
+# 每次 Redis pipeline 往返读取的任务数，边读边向客户端输出
+RESULTS_BATCH_CHUNK = max(int(os.getenv("RESULTS_BATCH_CHUNK", "200")), 1)
+
+class QueueStatusResponse(BaseModel):
+    total: int
+    position: int  # 在所属调度通道内的位置
+    estimated_wait: Optional[float] = None  # 预计完成还需的秒数
+    lane: Optional[str] = None
 
 # --- API Endpoints ---
 @app.get("/")
@@ -138,9 +108,52 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "travel-recommendation-api"}
 
-@app.post("/api/recommend", response_model=TaskCreationResponse, status_code=202)
-async def get_travel_recommendations(request: TravelRequest):
+def _client_id(http_request: Request) -> str:
+    """公平调度按客户端分配份额：有 API key 时按 key，否则按来源 IP"""
+    host = http_request.client.host if http_request.client else None
+    return scheduler.client_id(http_request.headers.get("X-API-Key"), host)
+
+async def _submit_travel_input(travel_input: Dict[str, Any], http_request: Request,
+                               deadline_seconds: Optional[float] = None,
+                               lane: str = scheduler.DEFAULT_LANE) -> TaskCreationResponse:
+    # 行程天数决定 LLM 调用次数（按天生成时每天一次），超过上限直接拒绝
+    if trip_too_long(travel_input):
+        raise HTTPException(status_code=422, detail=f"行程天数不能超过 {ITINERARY_MAX_DAYS} 天")
     # 1. 生成请求参数的唯一哈希
+    input_str = json.dumps(travel_input, sort_keys=True, ensure_ascii=False)
+    raw_hash = hashlib.md5(input_str.encode("utf-8")).hexdigest()
+    # 规范化：目的地别名、偏好同义词、(月份, 天数) 相同的请求共用一个缓存键
+    canonical_input, input_hash = canonicalize_request(travel_input)
+    # 热度统计，供闲时预计算热门目的地；按缓存键中的目的地计数，大小写不同的写法算作同一个
+    month, _ = trip_shape(canonical_input["start_date"], canonical_input["end_date"])
+    await async_store.record_popularity(canonical_destination(travel_input.get("destination")), month)
+
+    # 2. 单飞提交：相同输入只会有一个进行中或已成功的任务，新任务在同一次往返中放入该客户端的调度队列
+    try:
+        task_id, created = await async_store.submit_or_attach(
+            input_hash, canonical_input, SINGLE_FLIGHT_STALE_SECONDS, raw_hash, deadline_seconds,
+            lane, _client_id(http_request)
+        )
+    except async_store.AdmissionRejected as e:
+        # 队列已满：拒绝新任务，告诉客户端多久后重试
+        logging.warning(f"拒绝提交，预计等待 {e.projected_wait:.0f} 秒")
+        raise HTTPException(
+            status_code=429,
+            detail={"message": "当前排队人数过多，请稍后重试", "estimated_wait": e.projected_wait},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if not created:
+        logging.info(f"相同请求复用任务 {task_id}")
+        return TaskCreationResponse(task_id=task_id)
+
+    # 3. 没有可复用的任务，已生成新任务
+    tasks.set(task_id, {"status": TaskStatus.PENDING, "result": None})
+    logging.info(f"任务 {task_id} 已提交到后台执行")
+    return TaskCreationResponse(task_id=task_id)
+
+
+@app.post("/api/recommend", response_model=TaskCreationResponse, status_code=202)
+async def get_travel_recommendations(request: TravelRequest, http_request: Request):
     travel_input = {
         "destination": request.destination,
         "start_date": request.travel_dates.get("start"),
@@ -148,97 +161,242 @@ async def get_travel_recommendations(request: TravelRequest):
         "xiaohongshu_account": request.xiaohongshu_account,
         "preferences": request.preferences or {}
     }
-    input_str = json.dumps(travel_input, sort_keys=True, ensure_ascii=False)
-    input_hash = hashlib.md5(input_str.encode("utf-8")).hexdigest()
+    deadline_seconds = None
+    if request.deadline_seconds is not None:
+        deadline_seconds = min(max(request.deadline_seconds, 1), TASK_DEADLINE_SECONDS)
+    return await _submit_travel_input(travel_input, http_request, deadline_seconds,
+                                      request.priority or scheduler.DEFAULT_LANE)
 
-    # 2. 查 Redis 缓存 - 使用线程池执行同步Redis操作
-    loop = asyncio.get_running_loop()
-    cached_task_id = await loop.run_in_executor(
-        None,
-        lambda: redis_client.get(f"travel:input:{input_hash}:task_id")
-    )
-    
-    if cached_task_id:
-        # 检查任务状态 - 同样使用线程池
-        task_data = await loop.run_in_executor(
-            None,
-            lambda: redis_client.hgetall(f"travel:task:{cached_task_id}")
-        )
-        
-        if task_data and task_data.get("status") == TaskStatus.SUCCESS:
-            return TaskCreationResponse(task_id=cached_task_id)
 
-    # 3. 没有缓存，正常生成
-    task_id = str(uuid.uuid4())
-    tasks[task_id] = {"status": TaskStatus.PENDING, "result": None}
+@app.post("/api/recommend/{task_id}/revise", response_model=TaskCreationResponse, status_code=202)
+async def revise_travel_recommendations(task_id: str, request: ReviseRequest, http_request: Request):
+    """
+    在已有任务的基础上修改部分输入后重新提交。preferences 按键合并（值为 null 表示删除该项），
+    输入未变化的阶段（目的地分析、偏好分析、行程规划）会直接复用之前的输出。
+    """
+    travel_input = await async_store.get_task_input(task_id)
+    if travel_input is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if request.destination is not None:
+        travel_input["destination"] = request.destination
+    if request.travel_dates is not None:
+        travel_input["start_date"] = request.travel_dates.get("start", travel_input.get("start_date"))
+        travel_input["end_date"] = request.travel_dates.get("end", travel_input.get("end_date"))
+    if request.preferences is not None:
+        preferences = {**(travel_input.get("preferences") or {}), **request.preferences}
+        travel_input["preferences"] = {k: v for k, v in preferences.items() if v is not None}
+    logging.info(f"修改任务 {task_id} 后重新提交")
+    return await _submit_travel_input(travel_input, http_request)
 
-    # 写入 Redis 映射
-    redis_client.set(f"travel:input:{input_hash}:task_id", task_id, ex=120*3600)  # 120小时过期
-    redis_client.hset(f"travel:task:{task_id}", mapping={"status": TaskStatus.PENDING, "result": ""})
-    
-    process_travel_recommendation(task_id, travel_input)
-    logging.info(f"任务 {task_id} 已提交到后台执行")
-    return TaskCreationResponse(task_id=task_id)
+
+@app.delete("/api/task/{task_id}")
+async def cancel_task(task_id: str):
+    """
+    取消提交。排队中的任务直接移出队列，执行中的任务由 worker 在阶段之间或等待 LLM 响应时中止，
+    worker 随即处理下一个任务。相同输入的其他提交仍在等待时只撤销本次提交（outcome 为 detached），任务继续执行。
+    """
+    actual_id, outcome = await async_store.cancel_task(task_id)
+    if outcome == "not_found":
+        raise HTTPException(status_code=404, detail="Task not found")
+    if outcome not in ("cancelled", "detached"):
+        raise HTTPException(status_code=409, detail=f"Task already finished: {outcome}")
+    if outcome == "cancelled":
+        tasks.set(actual_id, {"status": TaskStatus.CANCELLED, "result": None})
+    logging.info(f"取消任务 {task_id}: {outcome}")
+    return {"task_id": task_id, "outcome": outcome}
+
+
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "singleflight": await async_store.get_singleflight_stats(),
+        "admission": await async_store.get_admission_stats()
+    }
+
+
+@app.get("/api/admin/memory")
+async def get_memory_report():
+    """Redis 各前缀的 key 数和估算字节数，以及本进程的任务状态缓存"""
+    report = await collect_memory_report(async_redis_client)
+    report["process"] = {"tasks_cached": len(tasks), "tasks_max": TASKS_CACHE_MAX_ENTRIES}
+    return report
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 抓取入口，数据来自各 worker 写入 Redis 的汇总"""
+    snapshot = await async_store.get_metrics_snapshot()
+    return PlainTextResponse(metrics.render_metrics(snapshot), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/api/queue/position/{task_id}", response_model=QueueStatusResponse)
 async def get_queue_position(task_id: str):
     try:
-        queue_status = get_queue_status()
-        position = get_position(task_id)
-        # TODO: fix this work around
+        task_id, _ = await async_store.resolve_task(task_id)
+        queue_status = await async_store.get_queue_position_status(task_id)
+        position = queue_status["position"]
+        # 已结束或已过期的任务按正在处理返回
         if position is None:
             position = 1
         status = {
             "total": queue_status["total"],
-            "position": position 
+            "position": position,
+            "estimated_wait": queue_status["estimated_wait"],
+            "lane": queue_status["lane"]
         }
         return QueueStatusResponse(**status)
     except Exception as e:
         logging.error(f"获取队列状态错误: {str(e)}") 
 
+def _sse(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _queue_status(task_id: str) -> Dict[str, Any]:
+    """SSE queue 事件的内容：通道内位置和预计完成还需的秒数（按平均耗时估算）"""
+    status = await async_store.get_queue_position_status(task_id)
+    return {"position": status["position"] or 1, "estimated_wait": status["estimated_wait"]}
+
+def _relabel_event(event: Dict[str, Any], start_date: Optional[str]) -> Dict[str, Any]:
+    if start_date and event["type"] == "result":
+        relabel_itinerary_dates(event["data"].get("result"), start_date)
+    elif start_date and event["type"] == "partial" and event["data"].get("section") == "itinerary":
+        relabel_itinerary_dates({"recommendations": {"itinerary": [event["data"]["item"]]}}, start_date)
+    return event
+
+async def _task_event_stream(task_id: str, request: Request):
+    # 别名任务（规范化后复用了其他出发日期的任务）订阅实际任务的事件，结果日期按本次出发日期重标
+    task_id, start_date = await async_store.resolve_task(task_id)
+    # 先订阅再读取历史，避免两者之间发布的事件丢失
+    async with async_store.task_event_hub.subscribe(task_channel(task_id), QUEUE_EVENTS_CHANNEL) as events:
+        history = await async_store.get_task_events(task_id)
+        for raw in history:
+            event = _relabel_event(json.loads(raw), start_date)
+            yield _sse(event["type"], event["data"])
+            if event["type"] == "result":
+                return
+        seen = set(history)
+
+        task_data = await async_store.get_task(task_id)
+        if not task_data:
+            yield _sse("error", {"detail": "Task not found"})
+            return
+        if task_data.get("status") in (TaskStatus.SUCCESS, TaskStatus.FAILURE, TaskStatus.CANCELLED):
+            # 任务在本次连接前已结束（例如命中缓存），直接返回结果
+            status, result = await async_store.get_task_result(task_id)
+            if start_date:
+                result = relabel_itinerary_dates(result, start_date)
+            yield _sse("result", {"status": status, "result": result})
+            return
+
+        queue_status = await _queue_status(task_id)
+        position = queue_status["position"]
+        yield _sse("queue", queue_status)
+
+        while not await request.is_disconnected():
+            try:
+                channel, data = await asyncio.wait_for(events.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if channel == QUEUE_EVENTS_CHANNEL:
+                # 派发或开始执行时重新计算本通道内的位置，开始执行后不再计算
+                if position == 1:
+                    continue
+                queue_status = await _queue_status(task_id)
+                if queue_status["position"] != position:
+                    position = queue_status["position"]
+                    yield _sse("queue", queue_status)
+                continue
+            if data in seen:
+                continue
+            event = _relabel_event(json.loads(data), start_date)
+            yield _sse(event["type"], event["data"])
+            if event["type"] == "result":
+                return
+
+@app.get("/api/stream/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    """
+    SSE 推送任务进度：queue（排队位置变化）、started、stage（每个阶段完成）、
+    partial（整合阶段每解析出一个板块元素）、retry（执行失败，稍后从检查点重试）、result（最终结果）
+    """
+    return StreamingResponse(
+        _task_event_stream(task_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/result/{task_id}", response_model=TaskResultResponse)
-async def get_task_result(task_id: str):
-    # 获取事件循环
-    loop = asyncio.get_running_loop()
-    
-    # 优先查 Redis - 使用线程池执行同步Redis操作
+async def get_task_result(task_id: str, fields: Optional[str] = None, day: Optional[int] = None):
+    """
+    fields: 逗号分隔的板块名（itinerary,restaurants,attractions,accommodations,tips），只返回这些板块；
+    day: 只返回行程中的第几天，未指定 fields 时只返回 itinerary
+    """
+    sections = None
+    if fields:
+        sections = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in sections if f not in RESULT_SECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    elif day is not None:
+        sections = ["itinerary"]
+
+    # 优先查 Redis
     try:
-        # 将同步Redis操作移到线程池中执行
-        task_data = await loop.run_in_executor(
-            None, 
-            lambda: redis_client.hgetall(f"travel:task:{task_id}")
-        )
+        task_data = await async_store.get_task_result(task_id, sections, day)
         
         if task_data:
-            status = task_data.get("status", TaskStatus.PENDING)
-            result = None
-            if status == TaskStatus.SUCCESS:
-                try:
-                    # 将JSON解析也移到线程池中执行
-                    result_str = task_data["result"]
-                    if result_str:
-                        result = await loop.run_in_executor(
-                            None,
-                            lambda: json.loads(result_str)
-                        )
-                except Exception as e:
-                    logging.error(f"JSON解析错误: {str(e)}")
-                    result = task_data["result"]
+            status, result = task_data
+            # 进行中的任务返回已生成的部分板块（result.partial 为 true），失败或取消的任务不返回结果
+            if status in (TaskStatus.FAILURE, TaskStatus.CANCELLED):
+                result = None
             return TaskResultResponse(task_id=task_id, status=status, result=result)
     except Exception as e:
         logging.error(f"Redis查询错误: {str(e)}")
     
-    # 回退到内存 - 同样使用线程池
-    try:
-        task = await loop.run_in_executor(None, lambda: tasks.get(task_id))
-        if task:
-            return TaskResultResponse(task_id=task_id, status=task["status"], result=task["result"])
-    except Exception as e:
-        logging.error(f"内存查询错误: {str(e)}")
+    # 回退到内存
+    task = tasks.get(task_id)
+    if task:
+        return TaskResultResponse(task_id=task_id, status=task["status"], result=task["result"])
     
     raise HTTPException(status_code=404, detail="Task not found")
 
+async def _batch_result_stream(task_ids, status_only: bool, sections):
+    async for task_id, status, result in async_store.iter_task_results(
+        task_ids, status_only, sections, RESULTS_BATCH_CHUNK
+    ):
+        if status is None:
+            task = tasks.get(task_id)
+            if task:
+                status, result = task["status"], task["result"]
+        if status is None:
+            line = {"task_id": task_id, "status": None, "error": "not_found"}
+        elif status_only:
+            line = {"task_id": task_id, "status": status}
+        else:
+            line = {"task_id": task_id, "status": status,
+                    "result": result if status not in (TaskStatus.FAILURE, TaskStatus.CANCELLED) else None}
+        yield json.dumps(line, ensure_ascii=False) + "\n"
+
+@app.post("/api/results")
+async def get_task_results(request: BatchResultRequest):
+    """
+    批量查询任务状态/结果，按 NDJSON 逐行返回（每个任务一行，顺序与请求一致）。
+    status_only: 只返回状态，不读取结果；fields: 只返回这些板块
+    """
+    if len(request.task_ids) > RESULTS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many task_ids (max {RESULTS_BATCH_MAX})")
+    sections = None
+    if request.fields and not request.status_only:
+        unknown = [f for f in request.fields if f not in RESULT_SECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        sections = request.fields
+    return StreamingResponse(
+        _batch_result_stream(request.task_ids, request.status_only, sections),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/api/analyze-xiaohongshu")
 async def analyze_xiaohongshu_account(account: str):
     """
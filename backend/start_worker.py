@@ -1,7 +1,32 @@
+import os
+
+# worker 配置：数量、类型（thread / process / greenlet）以及触发优雅退出的信号
+HUEY_WORKERS = int(os.getenv("HUEY_WORKERS", "4"))
+HUEY_WORKER_TYPE = os.getenv("HUEY_WORKER_TYPE", "thread")
+# TERM：收到 SIGTERM（docker stop / k8s）时不再取新任务，等正在执行的任务完成后退出
+HUEY_GRACEFUL_SIGNAL = os.getenv("HUEY_GRACEFUL_SIGNAL", "TERM")
+
+# gevent 是 greenlet 的别名，huey 只接受 thread / greenlet / process
+if HUEY_WORKER_TYPE == "gevent":
+    HUEY_WORKER_TYPE = "greenlet"
+
+if HUEY_WORKER_TYPE == "greenlet":
+    # greenlet 模式必须在导入其他模块前打补丁；需要另行安装 gevent（pip install gevent）
+    from gevent import monkey
+    monkey.patch_all()
+
 from huey.consumer import Consumer
 from task_queue.queue_config import huey
 import task_queue.tasks
 
+# crew 依赖只在 worker 中加载，启动时一次性导入，避免第一个任务承担导入耗时
+task_queue.tasks.load_crew_modules()
+
 if __name__ == "__main__":
-    consumer = Consumer(huey)
-    consumer.run()
\ No newline at end of file
+    consumer = Consumer(
+        huey,
+        workers=HUEY_WORKERS,
+        worker_type=HUEY_WORKER_TYPE,
+        graceful_signal=HUEY_GRACEFUL_SIGNAL
+    )
+    consumer.run()
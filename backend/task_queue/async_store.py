@@ -0,0 +1,515 @@
+import os
+import json
+import math
+import time
+import uuid
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import redis.asyncio as aioredis
+from redis.client import NEVER_DECODE
+
+from task_queue.queue_config import (
+    huey, REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT,
+    REDIS_CONNECT_TIMEOUT, REDIS_POOL_TIMEOUT, TASK_TTL, TASK_DEADLINE_SECONDS
+)
+from task_queue.events import (
+    EVENTS_CHANNEL_PREFIX, EVENTS_LOG_SUFFIX, EVENTS_LOG_TTL, QUEUE_EVENTS_CHANNEL, task_events_log
+)
+from task_queue import metrics, scheduler
+from task_queue.results import (
+    result_fields, result_mapping, decode_result, partial_fields, decode_partial, relabel_itinerary_dates
+)
+from task_queue.popularity import POPULARITY_ENABLED, POPULARITY_WINDOW_DAYS, popularity_key, popularity_member
+from agents.llm_cache import CACHE_STATS_KEY
+from task_queue.tasks import (
+    process_travel_recommendation, TASK_KEY_PREFIX, SERVICE_TIME_KEY, DEFAULT_SERVICE_TIME
+)
+from task_queue.scheduler import (
+    WORKER_CAPACITY, SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, SCHED_DEFICIT_PREFIX, SCHED_INFLIGHT_KEY,
+    LUA_HELPERS, DISPATCH_SCRIPT, QUEUE_STATUS_SCRIPT
+)
+
+# API 进程统一使用的异步 Redis 访问层：有界连接池，池满时最多等待 REDIS_POOL_TIMEOUT 秒
+_pool = aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    health_check_interval=30
+)
+async_redis_client = aioredis.Redis(connection_pool=_pool)
+
+INPUT_KEY_PREFIX = "travel:input:"
+INPUT_MAPPING_TTL = TASK_TTL  # 默认 120 小时过期，任务 hash 同样过期
+SINGLE_FLIGHT_STATS_KEY = "travel:stats:singleflight"
+ADMISSION_STATS_KEY = "travel:stats:admission"
+
+# --- 准入控制 ---
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+# 新任务预计完成时间超过该值（秒）时拒绝提交
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "600"))
+
+
+class AdmissionRejected(Exception):
+    """队列过长，新任务的预计等待时间超过 SLO"""
+
+    def __init__(self, projected_wait: float):
+        self.projected_wait = projected_wait
+        # 预计超出 SLO 的部分排空后再重试
+        self.retry_after = max(math.ceil(projected_wait - ADMISSION_MAX_WAIT_SECONDS), 1)
+        super().__init__(f"projected wait {projected_wait:.0f}s exceeds {ADMISSION_MAX_WAIT_SECONDS:.0f}s")
+
+
+def estimate_wait(ahead: int, service_time: Optional[str]) -> float:
+    """前面还有 ahead 个任务未开始时，本任务预计完成所需的秒数"""
+    avg = float(service_time) if service_time else DEFAULT_SERVICE_TIME
+    return (ahead / WORKER_CAPACITY + 1) * avg
+
+
+def task_key(task_id: str) -> str:
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+
+def input_key(input_hash: str) -> str:
+    return f"{INPUT_KEY_PREFIX}{input_hash}:task_id"
+
+
+# 单飞提交 + 准入判断 + 放入调度子队列，一次往返原子完成。复用已有任务的请求总是放行。
+# 已有任务的 key 只能在脚本内拼出，因此仅适用于单节点 Redis（非 cluster）。
+# KEYS: 输入映射, huey 队列, 单飞统计, 平均耗时, 准入统计
+# ARGV: 新任务id, 当前时间, PENDING 过期秒数, 映射/任务TTL, 调度通道, huey消息, 任务key前缀, 客户端,
+#       最大等待秒数(<=0 不限制), 默认耗时, worker 并发数, 出发日期, 原始输入哈希, 规范化输入 JSON, 截止时间,
+#       子队列前缀, 轮转前缀, 客户端权重 JSON, 高优先级通道
+# 复用出发日期不同的任务时，新建一个只含 alias_of/start_date 的别名任务，读取结果时重标日期。
+# waiters 为等待该任务的提交数，全部取消后才真正中止任务。
+# 准入按本次提交在所属通道中的预计位置估算等待时间：单个客户端的积压不会导致其他客户端被拒绝。
+_SUBMIT_SCRIPT = LUA_HELPERS + """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    local state = redis.call('HMGET', ARGV[7] .. existing, 'status', 'created_at', 'start_date', 'input_hash')
+    local status = state[1]
+    if status == 'SUCCESS' or (status == 'PENDING' and
+            tonumber(ARGV[2]) - tonumber(state[2] or '0') < tonumber(ARGV[3])) then
+        redis.call('HINCRBY', KEYS[3], 'saved_runs', 1)
+        if status == 'PENDING' then
+            redis.call('HINCRBY', ARGV[7] .. existing, 'waiters', 1)
+        end
+        if state[4] and state[4] ~= ARGV[13] then
+            -- 原始输入不同，仅因规范化而命中
+            redis.call('HINCRBY', KEYS[3], 'canonical_hits', 1)
+        end
+        if state[3] and state[3] ~= ARGV[12] then
+            redis.call('HSET', ARGV[7] .. ARGV[1], 'alias_of', existing, 'start_date', ARGV[12], 'created_at', ARGV[2],
+                'input', ARGV[14])
+            redis.call('EXPIRE', ARGV[7] .. ARGV[1], ARGV[4])
+            return {ARGV[1], 0, '0'}
+        end
+        return {existing, 0, '0'}
+    end
+end
+local lane, client = ARGV[5], ARGV[8]
+local queue = ARGV[16] .. lane .. ':' .. client
+local max_wait = tonumber(ARGV[9])
+if max_wait > 0 then
+    local ahead = redis.call('LLEN', KEYS[2]) +
+        lane_ahead(ARGV[17], ARGV[16], lane, client, redis.call('LLEN', queue), cjson.decode(ARGV[18]))
+    if lane ~= ARGV[19] then
+        ahead = ahead + lane_pending(ARGV[17], ARGV[16], ARGV[19])
+    end
+    local service = tonumber(redis.call('GET', KEYS[4]) or '') or tonumber(ARGV[10])
+    local wait = (ahead / tonumber(ARGV[11]) + 1) * service
+    if wait > max_wait then
+        redis.call('HINCRBY', KEYS[5], 'rejected', 1)
+        return {'', -1, tostring(wait)}
+    end
+end
+redis.call('HSET', ARGV[7] .. ARGV[1], 'status', 'PENDING', 'result', '', 'created_at', ARGV[2],
+    'start_date', ARGV[12], 'input_hash', ARGV[13], 'input', ARGV[14], 'deadline', ARGV[15], 'waiters', 1,
+    'lane', lane, 'client', client, 'message', ARGV[6])
+redis.call('EXPIRE', ARGV[7] .. ARGV[1], ARGV[4])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+if redis.call('RPUSH', queue, ARGV[1]) == 1 then
+    redis.call('RPUSH', ARGV[17] .. lane, client)
+end
+redis.call('HINCRBY', KEYS[3], 'submitted', 1)
+return {ARGV[1], 1, '0'}
+"""
+_submit = async_redis_client.register_script(_SUBMIT_SCRIPT)
+
+
+async def submit_or_attach(input_hash: str, travel_input: Dict[str, Any], stale_seconds: int,
+                           raw_hash: str = "", deadline_seconds: Optional[float] = None,
+                           lane: str = scheduler.DEFAULT_LANE, client: str = "") -> Tuple[str, bool]:
+    """
+    相同输入（input_hash 为规范化后的缓存键）已有进行中（未超过 stale_seconds）或成功的任务时直接复用，
+    否则新建任务放入 (lane, client) 的调度子队列并尝试派发。返回 (task_id, 是否新建)。
+    raw_hash 为原始输入的哈希，仅用于统计规范化带来的命中。
+    deadline_seconds 为新任务从现在起的截止时间，默认 TASK_DEADLINE_SECONDS；复用已有任务时沿用其截止时间。
+    开启准入控制且预计等待超过 SLO 时抛出 AdmissionRejected。
+    """
+    task_id = str(uuid.uuid4())
+    now = time.time()
+    deadline = now + (deadline_seconds or TASK_DEADLINE_SECONDS)
+    # 直接序列化 huey 消息存入任务 hash，派发时原样 LPUSH，与 huey.enqueue 写入的内容一致
+    message = huey.serialize_task(process_travel_recommendation.s(task_id, travel_input, deadline))
+    max_wait = ADMISSION_MAX_WAIT_SECONDS if ADMISSION_CONTROL_ENABLED else 0
+    result_id, created, projected_wait = await _submit(
+        keys=[input_key(input_hash), huey.storage.queue_key, SINGLE_FLIGHT_STATS_KEY,
+              SERVICE_TIME_KEY, ADMISSION_STATS_KEY],
+        args=[task_id, now, stale_seconds, INPUT_MAPPING_TTL, scheduler.normalize_lane(lane),
+              message, TASK_KEY_PREFIX, client or "unknown",
+              max_wait, DEFAULT_SERVICE_TIME, WORKER_CAPACITY,
+              travel_input.get("start_date") or "", raw_hash,
+              json.dumps(travel_input, ensure_ascii=False), deadline,
+              SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, scheduler.CLIENT_WEIGHTS_JSON, scheduler.SCHEDULER_LANES[0]]
+    )
+    if int(created) < 0:
+        raise AdmissionRejected(float(projected_wait))
+    if int(created):
+        await dispatch()
+    return result_id, bool(int(created))
+
+
+_dispatch = async_redis_client.register_script(DISPATCH_SCRIPT)
+_queue_status = async_redis_client.register_script(QUEUE_STATUS_SCRIPT)
+
+
+async def dispatch() -> List[str]:
+    """派发调度子队列中的任务（见 task_queue.scheduler），失败时由 worker 结束任务或周期任务时补上"""
+    try:
+        dispatched = await _dispatch(keys=scheduler.dispatch_keys(),
+                                     args=scheduler.dispatch_args(time.time(), TASK_KEY_PREFIX))
+    except Exception as e:
+        logging.error(f"调度派发失败: {str(e)}")
+        return []
+    if dispatched:
+        await async_redis_client.publish(QUEUE_EVENTS_CHANNEL, time.time())
+    return dispatched
+
+
+# 取消提交：等待该任务的提交数减一，减到 0 时将任务标记为 CANCELLED 并推送结果事件；
+# 任务还在调度子队列中时直接移除。已派发的任务返回 dispatched，由调用方从 huey 队列中移除。
+# 执行中的任务由 worker 轮询状态后中止。
+# KEYS: 任务key（可为别名）
+# ARGV: 任务key前缀, 当前时间, 事件JSON, 事件频道前缀, 事件历史TTL, 事件历史后缀, 子队列前缀, 轮转前缀, 额度前缀
+# 返回 {实际任务id, 结果}，结果为 cancelled / dispatched（已取消，但已派发到 huey 队列）/
+# detached（仍有其他提交在等待）/ 任务当前状态 / not_found
+_CANCEL_SCRIPT = """
+local key = KEYS[1]
+local task_id = string.sub(key, string.len(ARGV[1]) + 1)
+local alias = redis.call('HGET', key, 'alias_of')
+if alias then
+    task_id = alias
+    key = ARGV[1] .. alias
+end
+local status = redis.call('HGET', key, 'status')
+if not status then
+    return {task_id, 'not_found'}
+end
+if status ~= 'PENDING' then
+    return {task_id, status}
+end
+if redis.call('HINCRBY', key, 'waiters', -1) > 0 then
+    return {task_id, 'detached'}
+end
+redis.call('HSET', key, 'status', 'CANCELLED', 'completed_at', ARGV[2])
+local sched = redis.call('HMGET', key, 'lane', 'client')
+redis.call('HDEL', key, 'message')
+local outcome = 'dispatched'
+if sched[1] and sched[2] and redis.call('LREM', ARGV[7] .. sched[1] .. ':' .. sched[2], 1, task_id) > 0 then
+    outcome = 'cancelled'
+    if redis.call('LLEN', ARGV[7] .. sched[1] .. ':' .. sched[2]) == 0 then
+        redis.call('LREM', ARGV[8] .. sched[1], 0, sched[2])
+        redis.call('HDEL', ARGV[9] .. sched[1], sched[2])
+    end
+end
+local log_key = ARGV[4] .. task_id .. ARGV[6]
+redis.call('RPUSH', log_key, ARGV[3])
+redis.call('EXPIRE', log_key, ARGV[5])
+redis.call('PUBLISH', ARGV[4] .. task_id, ARGV[3])
+return {task_id, outcome}
+"""
+_cancel = async_redis_client.register_script(_CANCEL_SCRIPT)
+
+
+async def _remove_dispatched(task_id: str) -> bool:
+    """
+    从 huey 队列中移除已派发、还没有 worker 取走的任务并释放调度名额。
+    按反序列化出的任务 id 匹配消息（子串匹配可能命中输入中含有该 id 的其他任务）；
+    派发缓冲区只有 worker 并发数 + 预取数条消息。已被取走的任务由 worker 轮询状态后中止。
+    """
+    messages = await async_redis_client.execute_command("LRANGE", huey.storage.queue_key, 0, -1,
+                                                        NEVER_DECODE=True)
+    for raw in messages:
+        try:
+            message = huey.deserialize_task(raw)
+        except Exception as e:
+            logging.warning(f"无法解析huey消息: {str(e)}")
+            continue
+        if message.args and message.args[0] == task_id:
+            if await async_redis_client.lrem(huey.storage.queue_key, 1, raw):
+                await async_redis_client.zrem(SCHED_INFLIGHT_KEY, task_id)
+                return True
+            return False
+    return False
+
+
+async def cancel_task(task_id: str) -> Tuple[str, str]:
+    """取消一次提交，返回 (实际任务 id, 结果)，结果含义见 _CANCEL_SCRIPT（dispatched 归为 cancelled）"""
+    event = json.dumps({"type": "result", "time": time.time(),
+                        "data": {"status": "CANCELLED", "result": None}}, ensure_ascii=False)
+    actual_id, outcome = await _cancel(
+        keys=[task_key(task_id)],
+        args=[TASK_KEY_PREFIX, time.time(), event, EVENTS_CHANNEL_PREFIX, EVENTS_LOG_TTL, EVENTS_LOG_SUFFIX,
+              SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, SCHED_DEFICIT_PREFIX]
+    )
+    if outcome == "dispatched":
+        outcome = "cancelled"
+        await _remove_dispatched(actual_id)
+    if outcome == "cancelled":
+        # 已派发的任务被移除后空出名额；排队中的任务被移除后其他任务位置前移
+        if not await dispatch():
+            await async_redis_client.publish(QUEUE_EVENTS_CHANNEL, time.time())
+    return actual_id, outcome
+
+
+async def record_popularity(destination: str, month: int):
+    """提交计数，按天分桶；统计失败不影响提交"""
+    if not POPULARITY_ENABLED or not destination or not month:
+        return
+    key = popularity_key(datetime.utcnow().date())
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.zincrby(key, 1, popularity_member(destination, month))
+        pipe.expire(key, (POPULARITY_WINDOW_DAYS + 1) * 24 * 3600)
+        await pipe.execute()
+    except Exception as e:
+        logging.warning(f"记录目的地热度失败: {str(e)}")
+
+
+# 任务 hash 中的文本字段；结果字段是压缩后的二进制，只能通过 get_task_result 读取
+TASK_STATE_FIELDS = ("status", "created_at", "completed_at", "encoding")
+
+
+async def get_task_input(task_id: str) -> Optional[Dict[str, Any]]:
+    """任务提交时的规范化输入，供修改后重新提交使用"""
+    raw = await async_redis_client.hget(task_key(task_id), "input")
+    return json.loads(raw) if raw else None
+
+
+async def resolve_task(task_id: str) -> Tuple[str, Optional[str]]:
+    """别名任务返回 (实际执行的任务 id, 本次出发日期)，普通任务返回 (task_id, None)"""
+    alias_of, start_date = await async_redis_client.hmget(task_key(task_id), "alias_of", "start_date")
+    if alias_of:
+        return alias_of, start_date
+    return task_id, None
+
+
+async def get_task(task_id: str) -> Dict[str, str]:
+    """任务状态字段；别名任务返回其实际任务的状态"""
+    fields = ("alias_of",) + TASK_STATE_FIELDS
+    values = await async_redis_client.hmget(task_key(task_id), fields)
+    if values[0]:
+        values = await async_redis_client.hmget(task_key(values[0]), fields)
+    return {k: v for k, v in zip(fields[1:], values[1:]) if v is not None}
+
+
+# 读取结果时固定在前面的字段：别名信息、状态、编码
+_RESULT_HEAD_FIELDS = ["alias_of", "start_date", "status", "encoding"]
+
+
+async def _hmget_raw(keys: List[str], fields: List[str]) -> List[List[Optional[bytes]]]:
+    """多个 hash 的 HMGET 放进一个 pipeline；连接池默认解码为 str，这里用 NEVER_DECODE 读取原始字节"""
+    pipe = async_redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.execute_command("HMGET", key, *fields, NEVER_DECODE=True)
+    return await pipe.execute()
+
+
+async def _read_task_rows(task_ids: List[str], fields: List[str]) -> List[List[Optional[bytes]]]:
+    """读取任务的 fields（需以 _RESULT_HEAD_FIELDS 开头），别名任务再用一次往返读取实际任务"""
+    rows = await _hmget_raw([task_key(t) for t in task_ids], fields)
+    aliases = {i: row[0].decode() for i, row in enumerate(rows) if row[0] is not None}
+    if aliases:
+        resolved = await _hmget_raw([task_key(t) for t in aliases.values()], fields)
+        for i, row in zip(aliases, resolved):
+            # 保留别名自己的 alias_of/start_date，状态和结果取实际任务的
+            rows[i] = rows[i][:2] + row[2:]
+    return rows
+
+
+def _decode_row(row: List[Optional[bytes]], fields: List[str], sections: Optional[List[str]] = None,
+                day: Optional[int] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    status = row[2].decode() if row[2] is not None else None
+    if status is None or len(fields) == len(_RESULT_HEAD_FIELDS):
+        return status, None
+    encoding = row[3].decode() if row[3] is not None else None
+    values = dict(zip(fields[4:], row[4:]))
+    if status == "PENDING":
+        # 进行中的任务返回整合阶段已流式解析出的部分板块
+        result = decode_partial(values, sections, day)
+    else:
+        result = decode_result(encoding, values, sections, day)
+    if row[0] is not None and row[1]:
+        result = relabel_itinerary_dates(result, row[1].decode())
+    return status, result
+
+
+async def get_task_result(task_id: str, sections: Optional[List[str]] = None,
+                          day: Optional[int] = None) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+    """一次 HMGET 读出状态和所需板块，返回 (status, result)；任务不存在时返回 None"""
+    fields = _RESULT_HEAD_FIELDS + result_fields(sections) + partial_fields(sections)
+    rows = await _read_task_rows([task_id], fields)
+    status, result = _decode_row(rows[0], fields, sections, day)
+    if status is None:
+        return None
+    return status, result
+
+
+async def iter_task_results(task_ids: List[str], status_only: bool = False,
+                            sections: Optional[List[str]] = None, chunk_size: int = 500):
+    """
+    批量读取任务状态/结果：每 chunk_size 个 id 一次 pipeline 往返，逐个产出 (task_id, status, result)。
+    任务不存在时 status 为 None；status_only 时不读取结果字段。
+    """
+    fields = list(_RESULT_HEAD_FIELDS) if status_only else \
+        _RESULT_HEAD_FIELDS + result_fields(sections) + partial_fields(sections)
+    for i in range(0, len(task_ids), chunk_size):
+        chunk = task_ids[i:i + chunk_size]
+        rows = await _read_task_rows(chunk, fields)
+        for task_id, row in zip(chunk, rows):
+            status, result = _decode_row(row, fields, sections)
+            yield task_id, status, result
+
+
+async def set_task_result(task_id: str, status: str, result: Any):
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.hset(task_key(task_id), mapping=result_mapping(status, result))
+    pipe.expire(task_key(task_id), TASK_TTL)
+    await pipe.execute()
+
+
+async def get_queue_position_status(task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    与 tasks.get_queue_position_status 相同的计算，一次脚本调用完成：有 task_id 时位置在该任务的通道内计算，
+    另外给出预计等待秒数（有 task_id 时针对该任务，否则针对新提交的任务）
+    """
+    values, service_time = await asyncio.gather(
+        _queue_status(keys=[task_key(task_id) if task_id else "", huey.storage.queue_key],
+                      args=scheduler.queue_status_args(TASK_KEY_PREFIX)),
+        async_redis_client.get(SERVICE_TIME_KEY)
+    )
+    status = scheduler.parse_queue_status(values)
+    return {
+        "pending": status["pending"],
+        "total": status["pending"] + 1,
+        "position": status["position"],
+        "lane": status["lane"],
+        "estimated_wait": estimate_wait(status["ahead"], service_time)
+    }
+
+
+async def get_singleflight_stats() -> Dict[str, Any]:
+    stats = {k: int(v) for k, v in (await async_redis_client.hgetall(SINGLE_FLIGHT_STATS_KEY)).items()}
+    lookups = stats.get("submitted", 0) + stats.get("saved_runs", 0)
+    # 命中率：复用已有任务的提交占比；canonical_hits 为原始输入不同、规范化后才命中的部分
+    stats["hit_rate"] = stats.get("saved_runs", 0) / lookups if lookups else 0.0
+    stats["canonical_hit_rate"] = stats.get("canonical_hits", 0) / lookups if lookups else 0.0
+    return stats
+
+
+async def get_admission_stats() -> Dict[str, Any]:
+    rejected, service_time = await asyncio.gather(
+        async_redis_client.hget(ADMISSION_STATS_KEY, "rejected"),
+        async_redis_client.get(SERVICE_TIME_KEY)
+    )
+    return {
+        "rejected": int(rejected or 0),
+        "service_time": float(service_time) if service_time else None,
+        "max_wait": ADMISSION_MAX_WAIT_SECONDS if ADMISSION_CONTROL_ENABLED else None,
+        "worker_capacity": WORKER_CAPACITY
+    }
+
+
+async def get_metrics_snapshot() -> Dict[str, Any]:
+    """一次 pipeline 读出 /metrics 需要的全部统计，交给 metrics.render_metrics 输出"""
+    names = list(metrics.HISTOGRAMS) + list(metrics.COUNTERS)
+    pipe = async_redis_client.pipeline(transaction=False)
+    for name in names:
+        pipe.hgetall(metrics.metric_key(name))
+    pipe.hgetall(CACHE_STATS_KEY)
+    pipe.hgetall(SINGLE_FLIGHT_STATS_KEY)
+    pipe.hgetall(ADMISSION_STATS_KEY)
+    pipe.get(SERVICE_TIME_KEY)
+    values = await pipe.execute()
+    snapshot: Dict[str, Any] = dict(zip(names, values))
+    snapshot["llm_cache"], snapshot["singleflight"], snapshot["admission"] = values[len(names):len(names) + 3]
+    snapshot["service_time"] = values[-1]
+    queue = scheduler.parse_queue_status(
+        await _queue_status(keys=["", huey.storage.queue_key], args=scheduler.queue_status_args(TASK_KEY_PREFIX))
+    )
+    snapshot["queue_pending"] = queue["pending"]
+    return snapshot
+
+
+class TaskEventHub:
+    """
+    进程内共享一个 pattern 订阅连接，把任务事件分发给各个 SSE 连接，
+    避免每个长连接各占用一个 Redis 连接。
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    async def _listen(self):
+        while True:
+            pubsub = async_redis_client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{EVENTS_CHANNEL_PREFIX}*")
+                self._ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    for queue in list(self._subscribers.get(message["channel"], ())):
+                        queue.put_nowait((message["channel"], message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"任务事件订阅断开，1秒后重连: {str(e)}")
+                self._ready.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    @asynccontextmanager
+    async def subscribe(self, *channels: str):
+        """订阅若干 channel，产出 (channel, data) 的队列；订阅生效后才返回"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for channel in channels:
+            self._subscribers[channel].add(queue)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await self._ready.wait()
+            yield queue
+        finally:
+            for channel in channels:
+                self._subscribers[channel].discard(queue)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+task_event_hub = TaskEventHub()
+
+
+async def get_task_events(task_id: str):
+    return await async_redis_client.lrange(task_events_log(task_id), 0, -1)
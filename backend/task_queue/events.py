@@ -0,0 +1,40 @@
+import json
+import time
+import logging
+from typing import Any, Dict
+from task_queue.queue_config import redis_client
+
+# 任务进度事件：worker 通过 Redis pub/sub 推送，同时保留一份历史，供晚连接的客户端补发
+EVENTS_CHANNEL_PREFIX = "travel:events:"
+EVENTS_LOG_SUFFIX = ":log"
+EVENTS_LOG_TTL = 3600
+# 任务派发或开始执行时广播，订阅者据此重新计算排队位置
+QUEUE_EVENTS_CHANNEL = "travel:events:queue"
+
+
+def task_channel(task_id: str) -> str:
+    return f"{EVENTS_CHANNEL_PREFIX}{task_id}"
+
+
+def task_events_log(task_id: str) -> str:
+    return f"{EVENTS_CHANNEL_PREFIX}{task_id}{EVENTS_LOG_SUFFIX}"
+
+
+def publish_task_event(task_id: str, event_type: str, data: Dict[str, Any] = None):
+    """发布任务事件，失败只记录日志，不影响任务执行"""
+    event = json.dumps({"type": event_type, "time": time.time(), "data": data or {}}, ensure_ascii=False)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.rpush(task_events_log(task_id), event)
+        pipe.expire(task_events_log(task_id), EVENTS_LOG_TTL)
+        pipe.publish(task_channel(task_id), event)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"Failed to publish task event {event_type} for {task_id}: {str(e)}")
+
+
+def publish_queue_update():
+    try:
+        redis_client.publish(QUEUE_EVENTS_CHANNEL, time.time())
+    except Exception as e:
+        logging.warning(f"Failed to publish queue update: {str(e)}")
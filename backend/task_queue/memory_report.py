@@ -0,0 +1,83 @@
+import os
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List
+
+# Redis 内存占用报告：按 key 前缀统计数量，抽样 MEMORY USAGE 估算字节数。
+# SCAN 不阻塞 Redis，但 key 很多时仍会较慢，因此扫描数量有上限。
+MEMORY_REPORT_SCAN_LIMIT = int(os.getenv("MEMORY_REPORT_SCAN_LIMIT", "200000"))
+MEMORY_REPORT_SAMPLES = int(os.getenv("MEMORY_REPORT_SAMPLES", "50"))
+
+# 已知前缀按最长匹配归类；其余 key 取前两段（或 huey 的整个 key 名）
+KNOWN_PREFIXES = (
+    "travel:task:",
+    "travel:input:",
+    "travel:events:",
+    "travel:sched:queue:",
+    "travel:llm:cache:",
+    "travel:llm:bucket:",
+    "travel:destination:",
+    "travel:stage:",
+    "travel:checkpoint:",
+    "travel:metrics:",
+    "travel:popularity:",
+    "travel:precompute:",
+    "travel:stats:",
+)
+
+
+def key_group(key: str) -> str:
+    for prefix in sorted(KNOWN_PREFIXES, key=len, reverse=True):
+        if key.startswith(prefix):
+            return prefix
+    parts = key.split(":")
+    if len(parts) <= 2:
+        return key
+    return ":".join(parts[:2]) + ":"
+
+
+async def collect_memory_report(redis) -> Dict[str, Any]:
+    """
+    redis 为 decode_responses 的异步客户端。
+    bytes 为按抽样平均值估算的总字节数；no_ttl 为抽样中没有过期时间的 key 数。
+    """
+    groups: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"keys": 0, "samples": []})
+    scanned = 0
+    truncated = False
+    async for key in redis.scan_iter(count=1000):
+        group = groups[key_group(key)]
+        group["keys"] += 1
+        if len(group["samples"]) < MEMORY_REPORT_SAMPLES:
+            group["samples"].append(key)
+        scanned += 1
+        if scanned >= MEMORY_REPORT_SCAN_LIMIT:
+            truncated = True
+            break
+
+    sampled: List[str] = [key for group in groups.values() for key in group["samples"]]
+    pipe = redis.pipeline(transaction=False)
+    for key in sampled:
+        pipe.memory_usage(key)
+        pipe.ttl(key)
+    values = await pipe.execute(raise_on_error=False)
+    usage = {key: (values[2 * i], values[2 * i + 1]) for i, key in enumerate(sampled)}
+
+    prefixes = {}
+    for name, group in sorted(groups.items(), key=lambda item: -item[1]["keys"]):
+        sizes = [usage[key][0] for key in group["samples"] if isinstance(usage[key][0], int)]
+        ttls = [usage[key][1] for key in group["samples"] if isinstance(usage[key][1], int)]
+        prefixes[name] = {
+            "keys": group["keys"],
+            "bytes": int(sum(sizes) / len(sizes) * group["keys"]) if sizes else None,
+            "sampled": len(group["samples"]),
+            "no_ttl": sum(1 for ttl in ttls if ttl == -1)
+        }
+
+    report: Dict[str, Any] = {"scanned_keys": scanned, "truncated": truncated, "prefixes": prefixes}
+    try:
+        info = await redis.info("memory")
+        report["used_memory"] = info.get("used_memory")
+        report["maxmemory"] = info.get("maxmemory")
+    except Exception as e:
+        logging.warning(f"读取 Redis INFO 失败: {str(e)}")
+    return report
@@ -0,0 +1,165 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from task_queue.queue_config import redis_client
+
+# 指标在各 worker 中采集，写入 Redis 汇总，由 API 的 /metrics 以 Prometheus 文本格式输出。
+# 每个指标一个 hash：travel:metrics:{name}，field 为 "{标签}\t{类型}[\t{桶上界}]"
+METRICS_PREFIX = "travel:metrics:"
+
+SECONDS_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+HISTOGRAMS: Dict[str, Tuple[str, Tuple[float, ...]]] = {
+    "travel_queue_wait_seconds": ("Time between submission and a worker starting the task", SECONDS_BUCKETS),
+    "travel_end_to_end_seconds": ("Time between submission and the result being stored", SECONDS_BUCKETS),
+    "travel_stage_duration_seconds": ("Wall time of each crew stage", SECONDS_BUCKETS),
+    "travel_llm_call_seconds": ("Latency of individual LLM calls by stage", SECONDS_BUCKETS),
+    "travel_llm_prompt_tokens": ("Prompt tokens per LLM call by stage", TOKEN_BUCKETS),
+    "travel_llm_completion_tokens": ("Completion tokens per LLM call by stage", TOKEN_BUCKETS),
+    "travel_llm_rate_limit_wait_seconds": ("Time spent waiting for LLM rate limit quota by endpoint", SECONDS_BUCKETS),
+    "travel_context_tokens": ("Tokens of upstream stage output passed as context, before and after compaction",
+                              TOKEN_BUCKETS),
+}
+
+COUNTERS: Dict[str, str] = {
+    "travel_tasks_total": "Finished recommendation tasks by status",
+    "travel_task_retries_total": "Huey task retries",
+    "travel_llm_call_failures_total": "Failed LLM calls by stage",
+    "travel_destination_cache_total": "Destination report lookups by result",
+    "travel_stage_memo_total": "Stage output memo lookups by stage and result",
+    "travel_llm_gateway_calls_total": "LLM gateway calls by endpoint and outcome",
+    "travel_precompute_total": "Popular destination precompute attempts by outcome",
+    "travel_checkpoint_resumed_total": "Stages restored from a run checkpoint instead of re-executed",
+}
+
+
+def metric_key(name: str) -> str:
+    return f"{METRICS_PREFIX}{name}"
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+    """记录一次直方图观测值；Redis 不可用时只记日志"""
+    _, buckets = HISTOGRAMS[name]
+    label_str = _labels(labels)
+    bucket = next((b for b in buckets if value <= b), "+Inf")
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(metric_key(name), f"{label_str}\tbucket\t{bucket}", 1)
+        pipe.hincrbyfloat(metric_key(name), f"{label_str}\tsum", value)
+        pipe.hincrby(metric_key(name), f"{label_str}\tcount", 1)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"Failed to record metric {name}: {str(e)}")
+
+
+def inc(name: str, amount: int = 1, **labels):
+    try:
+        redis_client.hincrby(metric_key(name), f"{_labels(labels)}\tcount", amount)
+    except Exception as e:
+        logging.warning(f"Failed to record metric {name}: {str(e)}")
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _format_labels(label_str: str, extra: str = "") -> str:
+    parts = [p for p in (label_str, extra) if p]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(float(value)))
+
+
+def render_histogram(name: str, data: Dict[str, str]) -> List[str]:
+    help_text, buckets = HISTOGRAMS[name]
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    series: Dict[str, Dict[str, float]] = {}
+    for field, value in data.items():
+        parts = _decode(field).split("\t")
+        entry = series.setdefault(parts[0], {})
+        entry["\t".join(parts[1:])] = float(_decode(value))
+    for label_str, entry in sorted(series.items()):
+        cumulative = 0.0
+        for bucket in list(buckets) + ["+Inf"]:
+            cumulative += entry.get(f"bucket\t{bucket}", 0)
+            le = f'le="{bucket}"'
+            lines.append(f"{name}_bucket{_format_labels(label_str, le)} {_fmt(cumulative)}")
+        lines.append(f"{name}_sum{_format_labels(label_str)} {_fmt(entry.get('sum', 0))}")
+        lines.append(f"{name}_count{_format_labels(label_str)} {_fmt(entry.get('count', 0))}")
+    return lines
+
+
+def render_counter(name: str, help_text: str, data: Dict[str, str]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for field, value in sorted(data.items()):
+        label_str = _decode(field).split("\t")[0]
+        lines.append(f"{name}{_format_labels(label_str)} {_fmt(_decode(value))}")
+    return lines
+
+
+def render_labeled(name: str, metric_type: str, help_text: str, label: str,
+                   values: Iterable[Tuple[str, Optional[float]]]) -> List[str]:
+    """把已有的统计 hash（缓存命中、单飞等）按一个标签输出"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for label_value, value in values:
+        if value is None:
+            continue
+        label_str = f'{label}="{label_value}"' if label else ""
+        lines.append(f"{name}{_format_labels(label_str)} {_fmt(value)}")
+    return lines
+
+
+def render_metrics(snapshot: Dict[str, Any]) -> str:
+    """
+    snapshot: 各指标名 -> 对应 Redis hash 的内容，另含 llm_cache / singleflight / admission
+    统计 hash、service_time 与 queue_pending（见 async_store.get_metrics_snapshot）
+    """
+    lines: List[str] = []
+    for name in HISTOGRAMS:
+        lines.extend(render_histogram(name, snapshot.get(name) or {}))
+    for name, help_text in COUNTERS.items():
+        lines.extend(render_counter(name, help_text, snapshot.get(name) or {}))
+
+    llm_cache = {k: float(_decode(v)) for k, v in (snapshot.get("llm_cache") or {}).items()}
+    lines.extend(render_labeled(
+        "travel_llm_cache_lookups_total", "counter", "LLM response cache lookups by result", "result",
+        [(result, llm_cache.get(field, 0)) for result, field in
+         (("local_hit", "local_hits"), ("redis_hit", "redis_hits"), ("miss", "misses"), ("bypassed", "bypassed"))]
+    ))
+    hits = llm_cache.get("local_hits", 0) + llm_cache.get("redis_hits", 0)
+    lookups = hits + llm_cache.get("misses", 0)
+    lines.extend(render_labeled(
+        "travel_llm_cache_hit_ratio", "gauge", "LLM response cache hit ratio since the stats were reset", "",
+        [("", hits / lookups if lookups else 0)]
+    ))
+
+    singleflight = {k: float(_decode(v)) for k, v in (snapshot.get("singleflight") or {}).items()}
+    lines.extend(render_labeled(
+        "travel_submissions_total", "counter", "Recommendation submissions by outcome", "outcome",
+        [("enqueued", singleflight.get("submitted", 0)), ("attached", singleflight.get("saved_runs", 0)),
+         ("rejected", float(_decode((snapshot.get("admission") or {}).get("rejected", 0))))]
+    ))
+
+    lines.extend(render_labeled(
+        "travel_canonical_hits_total", "counter",
+        "Submissions that reused a task only after request canonicalization", "",
+        [("", singleflight.get("canonical_hits", 0))]
+    ))
+
+    service_time = snapshot.get("service_time")
+    lines.extend(render_labeled(
+        "travel_service_time_seconds", "gauge", "Moving average of task processing time", "",
+        [("", float(_decode(service_time)) if service_time else None)]
+    ))
+    lines.extend(render_labeled(
+        "travel_queue_pending", "gauge", "Recommendation tasks waiting for a worker", "",
+        [("", snapshot.get("queue_pending"))]
+    ))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from task_queue.queue_config import redis_client, TASK_TTL
+
+# --- 热门目的地统计与闲时预计算 ---
+# 每次提交按 (规范化目的地, 出发月份) 计数，按天分桶；闲时由 worker 为最近窗口内的热门组合
+# 预先生成默认偏好的推荐（目的地报告随之写入缓存），首个用户不必再等完整的 crew 执行。
+POPULARITY_ENABLED = os.getenv("POPULARITY_ENABLED", "true").lower() == "true"
+POPULARITY_WINDOW_DAYS = max(int(os.getenv("POPULARITY_WINDOW_DAYS", "7")), 1)
+
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "false").lower() == "true"
+# 闲时时段（crontab 小时表达式，huey 按 UTC 计时），默认对应北京时间 2-5 点
+PRECOMPUTE_HOURS = os.getenv("PRECOMPUTE_HOURS", "18-21")
+# 时段内每隔多少分钟运行一次，每次最多运行一个间隔，下次接着处理
+PRECOMPUTE_INTERVAL_MINUTES = max(int(os.getenv("PRECOMPUTE_INTERVAL_MINUTES", "30")), 1)
+PRECOMPUTE_TOP_N = int(os.getenv("PRECOMPUTE_TOP_N", "20"))
+# 每天预计算可消耗的 LLM token 上限（超出前开始的那次执行会跑完）
+PRECOMPUTE_DAILY_TOKEN_BUDGET = int(os.getenv("PRECOMPUTE_DAILY_TOKEN_BUDGET", "200000"))
+PRECOMPUTE_TRIP_DAYS = max(int(os.getenv("PRECOMPUTE_TRIP_DAYS", "3")), 1)
+# 默认偏好，与前端表单默认值一致
+PRECOMPUTE_PREFERENCES: Dict[str, Any] = json.loads(
+    os.getenv("PRECOMPUTE_PREFERENCES", '{"budget": "medium", "travel_style": "cultural"}')
+)
+# 已有结果的输入映射剩余有效期低于该值（秒）时提前重新生成
+PRECOMPUTE_REFRESH_BEFORE = int(os.getenv("PRECOMPUTE_REFRESH_BEFORE", str(24 * 3600)))
+
+POPULARITY_KEY_PREFIX = "travel:popularity:"
+PRECOMPUTE_TOKENS_PREFIX = "travel:precompute:tokens:"
+PRECOMPUTE_LOCK_KEY = "travel:precompute:lock"
+
+# 与 async_store 中的 key 格式一致
+_TASK_KEY_PREFIX = "travel:task:"
+_STALE_SECONDS = int(os.getenv("SINGLE_FLIGHT_STALE_SECONDS", "900"))
+
+
+def popularity_key(day: date) -> str:
+    return f"{POPULARITY_KEY_PREFIX}{day.isoformat()}"
+
+
+def popularity_member(destination: str, month: int) -> str:
+    return f"{destination}|{month}"
+
+
+def parse_member(member) -> Tuple[str, int]:
+    if isinstance(member, bytes):
+        member = member.decode("utf-8")
+    destination, _, month = member.rpartition("|")
+    return destination, int(month)
+
+
+def top_destinations(limit: int, today: Optional[date] = None) -> List[Tuple[str, int, float]]:
+    """最近 POPULARITY_WINDOW_DAYS 天提交次数最多的 (目的地, 月份, 次数)"""
+    today = today or datetime.utcnow().date()
+    keys = [popularity_key(today - timedelta(days=i)) for i in range(POPULARITY_WINDOW_DAYS)]
+    union_key = f"{POPULARITY_KEY_PREFIX}top"
+    pipe = redis_client.pipeline()
+    pipe.zunionstore(union_key, keys)
+    pipe.zrevrange(union_key, 0, limit - 1, withscores=True)
+    pipe.delete(union_key)
+    _, top, _ = pipe.execute()
+    return [(*parse_member(member), score) for member, score in top]
+
+
+def default_trip_input(destination: str, month: int, today: Optional[date] = None) -> Dict[str, Any]:
+    """某月出发、默认天数和偏好的请求；缓存键只含月份和天数，出发日期取该月 1 日"""
+    today = today or datetime.utcnow().date()
+    year = today.year if month >= today.month else today.year + 1
+    start = date(year, month, 1)
+    end = start + timedelta(days=PRECOMPUTE_TRIP_DAYS - 1)
+    return {
+        "destination": destination,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "preferences": dict(PRECOMPUTE_PREFERENCES)
+    }
+
+
+# 没有可复用的任务（或已有结果即将过期）时创建 PENDING 任务并占住输入映射，
+# 期间相同请求的用户会直接复用这个任务。
+# KEYS: 输入映射  ARGV: 任务id, 当前时间, PENDING 过期秒数, 映射TTL, 任务key前缀, 出发日期, 输入哈希,
+#       规范化输入 JSON, 提前刷新秒数（映射与任务 hash 使用同一 TTL）
+_claim_script = redis_client.register_script("""
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    local state = redis.call('HMGET', ARGV[5] .. existing, 'status', 'created_at')
+    if state[1] == 'PENDING' and tonumber(ARGV[2]) - tonumber(state[2] or '0') < tonumber(ARGV[3]) then
+        return 0
+    end
+    if state[1] == 'SUCCESS' and redis.call('TTL', KEYS[1]) > tonumber(ARGV[9]) then
+        return 0
+    end
+end
+redis.call('HSET', ARGV[5] .. ARGV[1], 'status', 'PENDING', 'result', '', 'created_at', ARGV[2],
+    'start_date', ARGV[6], 'input_hash', ARGV[7], 'input', ARGV[8], 'precomputed', '1')
+redis.call('EXPIRE', ARGV[5] .. ARGV[1], ARGV[4])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+return 1
+""")
+
+
+def claim_precompute(task_id: str, input_hash: str, travel_input: Dict[str, Any]) -> bool:
+    return bool(_claim_script(
+        keys=[f"travel:input:{input_hash}:task_id"],
+        args=[task_id, time.time(), _STALE_SECONDS, TASK_TTL, _TASK_KEY_PREFIX,
+              travel_input.get("start_date") or "", input_hash,
+              json.dumps(travel_input, ensure_ascii=False), PRECOMPUTE_REFRESH_BEFORE]
+    ))
+
+
+def _tokens_key(today: Optional[date] = None) -> str:
+    return f"{PRECOMPUTE_TOKENS_PREFIX}{(today or datetime.utcnow().date()).isoformat()}"
+
+
+def precompute_tokens_used() -> int:
+    value = redis_client.get(_tokens_key())
+    return int(value) if value else 0
+
+
+def charge_precompute_tokens(tokens: int):
+    if tokens <= 0:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incrby(_tokens_key(), tokens)
+        pipe.expire(_tokens_key(), 2 * 24 * 3600)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"记录预计算 token 消耗失败: {str(e)}")
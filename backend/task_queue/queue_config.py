@@ -5,7 +5,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL")
+# 连接池上限与超时（同步、异步客户端共用同一组配置）
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+# 连接池耗尽时等待空闲连接的最长时间
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "2"))
+# 任务 hash（状态、输入、结果）与相同输入到任务的映射的有效期，两者保持一致
+TASK_TTL = int(os.getenv("TASK_TTL", str(120 * 3600)))
+# 任务从提交起的截止时间（秒），随任务传给 worker：超时未开始的任务直接失败，执行中的 crew 被中止。
+# 应小于 SINGLE_FLIGHT_STALE_SECONDS，否则超时前的 PENDING 任务可能已被视为丢失
+TASK_DEADLINE_SECONDS = int(os.getenv("TASK_DEADLINE_SECONDS", "600"))
 
-huey = RedisHuey("trip", url=REDIS_URL)
+# 任务结果写在 travel:task:{id} 中，不使用 huey 的结果存储（没人读取的返回值会一直留在 Redis）
+huey = RedisHuey("trip", url=REDIS_URL, results=False)
 
-redis_client = Redis.from_url(REDIS_URL, decode_responses=False)
+redis_client = Redis.from_url(
+    REDIS_URL,
+    decode_responses=False,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT
+)
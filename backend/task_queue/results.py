@@ -0,0 +1,144 @@
+import os
+import json
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import zstandard
+
+# 推荐结果按板块拆成多个 hash field 存储（travel:task:{id}），每个 field 是 zstd 压缩的紧凑 JSON，
+# 读取时只取客户端需要的板块。没有 encoding 字段的旧任务仍是 result 字段里的明文 JSON。
+RESULT_SECTIONS = ("itinerary", "restaurants", "attractions", "accommodations", "tips")
+RESULT_ENCODING = "zstd-json"
+RESULT_META_FIELD = "result:meta"
+RESULT_ZSTD_LEVEL = int(os.getenv("RESULT_ZSTD_LEVEL", "6"))
+
+
+def section_field(section: str) -> str:
+    return f"result:{section}"
+
+
+def result_fields(sections: Optional[Iterable[str]] = None) -> List[str]:
+    """读取结果需要的 hash field（不含 status 等状态字段）"""
+    return ["result", RESULT_META_FIELD] + [section_field(s) for s in (sections or RESULT_SECTIONS)]
+
+
+def partial_field(section: str) -> str:
+    """任务进行中已流式解析出的板块元素（明文 JSON 数组），任务结束时删除"""
+    return f"partial:{section}"
+
+
+def partial_fields(sections: Optional[Iterable[str]] = None) -> List[str]:
+    return [partial_field(s) for s in (sections or RESULT_SECTIONS)]
+
+
+def _pack(value: Any) -> bytes:
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zstandard.compress(data, RESULT_ZSTD_LEVEL)
+
+
+def _unpack(data: bytes) -> Any:
+    return json.loads(zstandard.decompress(data))
+
+
+def encode_result(result: Dict[str, Any]) -> Dict[str, bytes]:
+    """
+    拆分结果：recommendations 中的各板块单独存放，其余内容（analysis、status、
+    recommendations 的其他字段、失败时的 error 等）放在 result:meta
+    """
+    meta = dict(result)
+    fields = {}
+    recommendations = meta.get("recommendations")
+    if isinstance(recommendations, dict):
+        recommendations = dict(recommendations)
+        for section in RESULT_SECTIONS:
+            if section in recommendations:
+                fields[section_field(section)] = _pack(recommendations.pop(section))
+        meta["recommendations"] = recommendations
+    fields[RESULT_META_FIELD] = _pack(meta)
+    return fields
+
+
+def result_mapping(status: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """任务结束时写入 travel:task:{id} 的全部字段"""
+    return {
+        "status": status,
+        "encoding": RESULT_ENCODING,
+        "result": "",
+        "completed_at": time.time(),
+        **encode_result(result)
+    }
+
+
+def _select_day(itinerary: List[Dict[str, Any]], day: int) -> List[Dict[str, Any]]:
+    return [d for d in itinerary if isinstance(d, dict) and d.get("day") == day]
+
+
+def project_result(result: Dict[str, Any], sections: Optional[Iterable[str]] = None,
+                   day: Optional[int] = None) -> Dict[str, Any]:
+    """只保留指定板块；day 只保留行程中的某一天"""
+    recommendations = result.get("recommendations")
+    if not isinstance(recommendations, dict):
+        return result
+    keep = set(sections or RESULT_SECTIONS)
+    recommendations = {k: v for k, v in recommendations.items() if k not in RESULT_SECTIONS or k in keep}
+    if day is not None and isinstance(recommendations.get("itinerary"), list):
+        recommendations["itinerary"] = _select_day(recommendations["itinerary"], day)
+    return {**result, "recommendations": recommendations}
+
+
+def decode_result(encoding: Optional[str], fields: Dict[str, Optional[bytes]],
+                  sections: Optional[Iterable[str]] = None, day: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    fields: result_fields(sections) 读出的内容（bytes）。
+    没有任何结果数据时返回 None。
+    """
+    if encoding != RESULT_ENCODING:
+        raw = fields.get("result")
+        if not raw:
+            return None
+        return project_result(json.loads(raw), sections, day)
+
+    meta_raw = fields.get(RESULT_META_FIELD)
+    if not meta_raw:
+        return None
+    result = _unpack(meta_raw)
+    if isinstance(result.get("recommendations"), dict):
+        recommendations = result["recommendations"]
+        for section in sections or RESULT_SECTIONS:
+            raw = fields.get(section_field(section))
+            if raw:
+                recommendations[section] = _unpack(raw)
+        if day is not None and isinstance(recommendations.get("itinerary"), list):
+            recommendations["itinerary"] = _select_day(recommendations["itinerary"], day)
+    return result
+
+
+def decode_partial(fields: Dict[str, Optional[bytes]], sections: Optional[Iterable[str]] = None,
+                   day: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """进行中任务的部分结果；还没有任何板块元素时返回 None"""
+    recommendations = {}
+    for section in sections or RESULT_SECTIONS:
+        raw = fields.get(partial_field(section))
+        if raw:
+            recommendations[section] = json.loads(raw)
+    if not recommendations:
+        return None
+    if day is not None and isinstance(recommendations.get("itinerary"), list):
+        recommendations["itinerary"] = _select_day(recommendations["itinerary"], day)
+    return {"recommendations": recommendations, "partial": True}
+
+
+def relabel_itinerary_dates(result: Optional[Dict[str, Any]], start_date: str) -> Optional[Dict[str, Any]]:
+    """复用其他出发日期的结果时，按本次出发日期重写行程中每一天的 date"""
+    try:
+        start = date.fromisoformat(str(start_date)[:10])
+    except (TypeError, ValueError):
+        return result
+    recommendations = (result or {}).get("recommendations")
+    if not isinstance(recommendations, dict) or not isinstance(recommendations.get("itinerary"), list):
+        return result
+    for entry in recommendations["itinerary"]:
+        if isinstance(entry, dict) and isinstance(entry.get("day"), int) and entry["day"] > 0:
+            entry["date"] = (start + timedelta(days=entry["day"] - 1)).isoformat()
+    return result
@@ -0,0 +1,303 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from task_queue.queue_config import huey, redis_client
+from task_queue.events import publish_queue_update
+
+# --- 公平调度 ---
+# 新任务不直接进入 huey 队列，而是按 (通道, 客户端) 放入各自的子队列，由调度脚本派发到 huey 队列：
+# - 通道：interactive（页面提交，默认）优先于 batch（批量/集成调用）；interactive 连续派发
+#   SCHEDULER_INTERACTIVE_BURST 个任务后，若 batch 有积压则派发一个 batch 任务，batch 不会完全饿死
+# - 同一通道内按客户端（API key，没有时为 IP）加权轮转（deficit round robin），
+#   单个客户端提交再多也只占自己的份额，其他客户端的等待时间只取决于活跃客户端数
+# 已派发未结束的任务数不超过 worker 并发数 + SCHEDULER_PREFETCH，排队的任务留在子队列中，
+# 因此调度顺序对后来的 interactive 任务始终生效。任务提交、结束、取消时各触发一次派发，
+# 另有周期任务回收 worker 崩溃后未释放的名额，不需要常驻进程。
+# 脚本在 Lua 中拼接 key，仅适用于单节点 Redis（与单飞提交相同）；查询位置用到 LPOS，需要 Redis 6.0.6+。
+SCHEDULER_LANES = ("interactive", "batch")
+DEFAULT_LANE = "interactive"
+# 所有 worker 加起来能同时处理的任务数
+WORKER_CAPACITY = max(int(os.getenv("WORKER_CAPACITY", os.getenv("HUEY_WORKERS", "4"))), 1)
+# worker 全忙时在 huey 队列中预先放入的任务数，越小后来的 interactive 任务越不容易排在 batch 后面
+SCHEDULER_PREFETCH = max(int(os.getenv("SCHEDULER_PREFETCH", "1")), 0)
+SCHEDULER_INTERACTIVE_BURST = max(int(os.getenv("SCHEDULER_INTERACTIVE_BURST", "4")), 1)
+# 客户端权重，如 {"ip:10.0.0.8": 2}；未列出的客户端为 1，最小 0.1
+SCHEDULER_CLIENT_WEIGHTS = json.loads(os.getenv("SCHEDULER_CLIENT_WEIGHTS") or "{}")
+# 派发出去的任务在截止时间之后再过该秒数仍未结束（worker 崩溃），回收其名额
+SCHEDULER_SLOT_GRACE = int(os.getenv("SCHEDULER_SLOT_GRACE", "120"))
+
+SCHED_QUEUE_PREFIX = "travel:sched:queue:"        # {lane}:{client} -> 任务 id 列表
+SCHED_RING_PREFIX = "travel:sched:ring:"          # {lane} -> 有积压的客户端（轮转顺序）
+SCHED_DEFICIT_PREFIX = "travel:sched:deficit:"    # {lane} -> 客户端的剩余额度
+SCHED_INFLIGHT_KEY = "travel:sched:inflight"      # 已派发未结束的任务 -> 名额回收时间
+SCHED_STATE_KEY = "travel:sched:state"
+
+CLIENT_WEIGHTS_JSON = json.dumps(SCHEDULER_CLIENT_WEIGHTS)
+
+
+def client_id(api_key: Optional[str], host: Optional[str]) -> str:
+    """调度用的客户端标识；API key 只保存哈希"""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"ip:{host or 'unknown'}"
+
+
+def normalize_lane(lane: Optional[str]) -> str:
+    return lane if lane in SCHEDULER_LANES else DEFAULT_LANE
+
+
+# 各脚本共用的 Lua 函数：客户端权重、通道积压数、同一通道内排在某个位置之前的任务数
+LUA_HELPERS = """
+local function client_weight(weights, client)
+    local w = tonumber(weights[client] or '') or 1
+    if w < 0.1 then w = 0.1 end
+    return w
+end
+local function lane_pending(ring_prefix, queue_prefix, lane)
+    local total = 0
+    for _, client in ipairs(redis.call('LRANGE', ring_prefix .. lane, 0, -1)) do
+        total = total + redis.call('LLEN', queue_prefix .. lane .. ':' .. client)
+    end
+    return total
+end
+-- 按加权轮转估算：client 子队列中第 index 个（从 0 起）任务之前，本通道要先派发的任务数。
+-- client 不在轮转中（新客户端）时视为排在末尾
+local function lane_ahead(ring_prefix, queue_prefix, lane, client, index, weights)
+    local rounds = math.floor(index / client_weight(weights, client))
+    local ahead = index
+    local before = true
+    for _, other in ipairs(redis.call('LRANGE', ring_prefix .. lane, 0, -1)) do
+        if other == client then
+            before = false
+        else
+            local quota = rounds * client_weight(weights, other)
+            if before then
+                quota = quota + client_weight(weights, other)
+            end
+            ahead = ahead + math.min(redis.call('LLEN', queue_prefix .. lane .. ':' .. other), math.floor(quota))
+        end
+    end
+    return ahead
+end
+"""
+
+# 派发：回收过期名额后，按通道优先级和客户端加权轮转把任务消息移入 huey 队列，直到名额用完。
+# 消息在提交时序列化后存于任务 hash 的 message 字段，派发时取出。
+# KEYS: 已派发集合, huey 队列, 调度状态
+# ARGV: 当前时间, 名额数, interactive 连续派发上限, 任务key前缀, 子队列前缀, 轮转前缀, 额度前缀,
+#       客户端权重 JSON, 名额回收宽限秒数, 高优先级通道, 低优先级通道
+# 返回派发的任务 id 列表
+DISPATCH_SCRIPT = LUA_HELPERS + """
+local weights = cjson.decode(ARGV[8])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local free = tonumber(ARGV[2]) - redis.call('ZCARD', KEYS[1])
+
+local function pick(lane)
+    local ring = ARGV[6] .. lane
+    local deficit_key = ARGV[7] .. lane
+    -- 权重小于 1 的客户端要轮到多次才攒够一个任务的额度
+    for _ = 1, redis.call('LLEN', ring) * 10 + 1 do
+        local client = redis.call('LINDEX', ring, 0)
+        if not client then
+            return nil
+        end
+        local queue = ARGV[5] .. lane .. ':' .. client
+        local deficit = tonumber(redis.call('HGET', deficit_key, client) or '0')
+        if deficit < 1 then
+            deficit = deficit + client_weight(weights, client)
+        end
+        local task_id = nil
+        if deficit >= 1 then
+            task_id = redis.call('LPOP', queue)
+            if task_id then
+                deficit = deficit - 1
+            end
+        end
+        if redis.call('LLEN', queue) == 0 then
+            -- 子队列空了：移出轮转，额度清零
+            redis.call('LPOP', ring)
+            redis.call('HDEL', deficit_key, client)
+        else
+            redis.call('HSET', deficit_key, client, tostring(deficit))
+            if deficit < 1 then
+                redis.call('RPUSH', ring, redis.call('LPOP', ring))
+            end
+        end
+        if task_id then
+            return task_id
+        end
+    end
+    return nil
+end
+
+local dispatched = {}
+local burst = tonumber(redis.call('HGET', KEYS[3], 'burst') or '0')
+local attempts = 0
+while free > 0 and attempts < 1000 do
+    attempts = attempts + 1
+    local has_high = redis.call('LLEN', ARGV[6] .. ARGV[10]) > 0
+    local has_low = redis.call('LLEN', ARGV[6] .. ARGV[11]) > 0
+    if not has_high and not has_low then
+        break
+    end
+    local lane = ARGV[11]
+    if has_high and (not has_low or burst < tonumber(ARGV[3])) then
+        lane = ARGV[10]
+    end
+    if lane == ARGV[10] then
+        if has_low then
+            burst = burst + 1
+        end
+    else
+        burst = 0
+    end
+    local task_id = pick(lane)
+    if task_id then
+        local key = ARGV[4] .. task_id
+        local state = redis.call('HMGET', key, 'status', 'message', 'deadline')
+        -- 任务 hash 已过期或状态已变化的跳过
+        if state[1] == 'PENDING' and state[2] then
+            redis.call('LPUSH', KEYS[2], state[2])
+            redis.call('HDEL', key, 'message')
+            local expires = (tonumber(state[3] or '') or tonumber(ARGV[1])) + tonumber(ARGV[9])
+            redis.call('ZADD', KEYS[1], expires, task_id)
+            free = free - 1
+            table.insert(dispatched, task_id)
+        end
+    end
+end
+redis.call('HSET', KEYS[3], 'burst', burst)
+return dispatched
+"""
+
+# 排队状态。KEYS: 任务key（可为别名，为空字符串时只统计积压）, huey 队列
+# ARGV: 任务key前缀, 子队列前缀, 轮转前缀, 客户端权重 JSON, 高优先级通道, 低优先级通道
+# 返回 {通道, 位置, 通道积压数, huey 队列中待取的任务数, 高优先级通道积压数}；
+# 位置为 0 表示任务不存在或已结束，1 表示正在执行，排在 huey 队列或子队列中的从 2 起。
+# 公平调度下不存在全局的入队顺序，无法再用票号 - 游标 O(1) 得出位置：
+# 需要对通道轮转里的每个客户端各做一次 LPOS，耗时随通道内活跃客户端数线性增长
+QUEUE_STATUS_SCRIPT = LUA_HELPERS + """
+local weights = cjson.decode(ARGV[4])
+local buffered = redis.call('LLEN', KEYS[2])
+local high = lane_pending(ARGV[3], ARGV[2], ARGV[5])
+if KEYS[1] == '' then
+    return {'', 0, high + lane_pending(ARGV[3], ARGV[2], ARGV[6]), buffered, high}
+end
+local key = KEYS[1]
+local alias = redis.call('HGET', key, 'alias_of')
+if alias then
+    key = ARGV[1] .. alias
+end
+local task_id = string.sub(key, string.len(ARGV[1]) + 1)
+local state = redis.call('HMGET', key, 'status', 'lane', 'client')
+local lane = state[2] or ARGV[5]
+local pending = lane_pending(ARGV[3], ARGV[2], lane)
+if state[1] ~= 'PENDING' then
+    return {lane, 0, pending, buffered, high}
+end
+if state[3] then
+    local index = redis.call('LPOS', ARGV[2] .. lane .. ':' .. state[3], task_id)
+    if index then
+        local ahead = lane_ahead(ARGV[3], ARGV[2], lane, state[3], index, weights)
+        return {lane, buffered + ahead + 2, pending, buffered, high}
+    end
+end
+-- 已派发：huey 从队尾取消息，排在后面的先执行
+local messages = redis.call('LRANGE', KEYS[2], 0, -1)
+for index, message in ipairs(messages) do
+    if string.find(message, task_id, 1, true) then
+        return {lane, #messages - index + 2, pending, buffered, high}
+    end
+end
+return {lane, 1, pending, buffered, high}
+"""
+
+# 放入子队列（API 提交在单飞脚本中完成同样的操作，这里供同步入队使用）
+# KEYS: 任务key；ARGV: 任务id, 通道, 客户端, huey消息, 截止时间, 子队列前缀, 轮转前缀, 任务TTL
+_ENQUEUE_SCRIPT = """
+redis.call('HSET', KEYS[1], 'status', 'PENDING', 'message', ARGV[4], 'lane', ARGV[2], 'client', ARGV[3],
+    'deadline', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[8])
+local queue = ARGV[6] .. ARGV[2] .. ':' .. ARGV[3]
+if redis.call('RPUSH', queue, ARGV[1]) == 1 then
+    redis.call('RPUSH', ARGV[7] .. ARGV[2], ARGV[3])
+end
+return 1
+"""
+
+_dispatch = redis_client.register_script(DISPATCH_SCRIPT)
+_queue_status = redis_client.register_script(QUEUE_STATUS_SCRIPT)
+_enqueue = redis_client.register_script(_ENQUEUE_SCRIPT)
+
+
+def dispatch_keys() -> List[str]:
+    return [SCHED_INFLIGHT_KEY, huey.storage.queue_key, SCHED_STATE_KEY]
+
+
+def dispatch_args(now: float, task_key_prefix: str) -> List[Any]:
+    return [now, WORKER_CAPACITY + SCHEDULER_PREFETCH, SCHEDULER_INTERACTIVE_BURST, task_key_prefix,
+            SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, SCHED_DEFICIT_PREFIX, CLIENT_WEIGHTS_JSON, SCHEDULER_SLOT_GRACE,
+            SCHEDULER_LANES[0], SCHEDULER_LANES[1]]
+
+
+def queue_status_args(task_key_prefix: str) -> List[Any]:
+    return [task_key_prefix, SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, CLIENT_WEIGHTS_JSON,
+            SCHEDULER_LANES[0], SCHEDULER_LANES[1]]
+
+
+def parse_queue_status(values: List[Any]) -> Dict[str, Any]:
+    """
+    QUEUE_STATUS_SCRIPT 的返回值转为字典。ahead 为预计先于该任务（或新提交的任务）开始的任务数：
+    batch 通道还要算上 interactive 通道的积压
+    """
+    lane, position, pending, buffered, high = values
+    lane = lane.decode() if isinstance(lane, bytes) else lane
+    position, pending, buffered, high = int(position), int(pending), int(buffered), int(high)
+    if position >= 2:
+        ahead = position - 2
+    elif position == 0 and not lane:
+        ahead = pending + buffered
+    else:
+        ahead = 0
+    if lane and lane != SCHEDULER_LANES[0] and position != 1:
+        ahead += high
+    return {
+        "lane": lane or None,
+        "position": position or None,
+        "pending": pending + buffered,
+        "ahead": ahead
+    }
+
+
+def dispatch(now: float, task_key_prefix: str) -> List[str]:
+    """派发子队列中的任务，派发了任务时广播排队位置变化"""
+    try:
+        dispatched = _dispatch(keys=dispatch_keys(), args=dispatch_args(now, task_key_prefix))
+    except Exception as e:
+        logging.error(f"调度派发失败: {str(e)}")
+        return []
+    if dispatched:
+        publish_queue_update()
+    return [t.decode() if isinstance(t, bytes) else t for t in dispatched]
+
+
+def release_slot(task_id: str, now: float, task_key_prefix: str) -> List[str]:
+    """任务结束，释放名额并派发下一个任务"""
+    try:
+        redis_client.zrem(SCHED_INFLIGHT_KEY, task_id)
+    except Exception as e:
+        logging.error(f"释放调度名额失败: {str(e)}")
+    return dispatch(now, task_key_prefix)
+
+
+def enqueue(task_key: str, task_id: str, message: bytes, lane: str, client: str, deadline: float, ttl: int):
+    _enqueue(keys=[task_key],
+             args=[task_id, lane, client, message, deadline, SCHED_QUEUE_PREFIX, SCHED_RING_PREFIX, ttl])
+
+
+def queue_status(task_key: str, task_key_prefix: str) -> Dict[str, Any]:
+    return parse_queue_status(_queue_status(keys=[task_key, huey.storage.queue_key],
+                                            args=queue_status_args(task_key_prefix)))
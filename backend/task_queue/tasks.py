@@ -1,59 +1,292 @@
+import os
 import json
 import time
 import logging
-import pickle
-from typing import Dict, Any
-from task_queue.queue_config import huey, redis_client
-from agents.travel_crew import TravelRecommendationCrew
+import uuid
+import threading
+from typing import Dict, Any, Optional, Tuple
+from huey import crontab
+from huey.signals import SIGNAL_RETRYING
+from task_queue.queue_config import huey, redis_client, TASK_TTL, TASK_DEADLINE_SECONDS
+from task_queue.events import publish_task_event, publish_queue_update
+from task_queue import metrics, scheduler
+from task_queue.results import result_mapping, partial_fields
+from task_queue.popularity import (
+    PRECOMPUTE_ENABLED, PRECOMPUTE_HOURS, PRECOMPUTE_INTERVAL_MINUTES, PRECOMPUTE_TOP_N,
+    PRECOMPUTE_DAILY_TOKEN_BUDGET, PRECOMPUTE_LOCK_KEY, top_destinations, default_trip_input,
+    claim_precompute, precompute_tokens_used, charge_precompute_tokens
+)
+from agents.cancellation import AbortSignal, TaskAborted, abort_scope
+from agents.canonical import canonicalize_request
+from agents.stage_store import CHECKPOINT_ENABLED, checkpoint_store, checkpoint_run_key
 
-@huey.task()
-def process_travel_recommendation(task_id: str, travel_input: Dict[str, Any]):
+# API 进程导入本模块只为任务签名和队列常量：crew 相关依赖（crewai、litellm 等）在 worker 中
+# 由 load_crew_modules 导入（start_worker 启动时预先调用），不在模块顶层导入。
+
+# 推荐任务失败后的重试：间隔 TASK_RETRY_DELAY 秒，每次乘以 TASK_RETRY_BACKOFF；
+# 重试从检查点中最后完成的阶段继续，且不会超过任务的截止时间
+TASK_RETRIES = int(os.getenv("TASK_RETRIES", "2"))
+TASK_RETRY_DELAY = int(os.getenv("TASK_RETRY_DELAY", "10"))
+TASK_RETRY_BACKOFF = float(os.getenv("TASK_RETRY_BACKOFF", "2"))
+
+# 推荐任务经 task_queue.scheduler 按通道和客户端公平派发，排队位置在各自通道内计算
+TASK_KEY_PREFIX = "travel:task:"
+
+# 每个 worker（线程/进程/greenlet）各自持有一个预热的 LLM 客户端
+_worker_state = threading.local()
+
+def load_crew_modules():
+    """导入 crew 相关模块；重复调用只是读取已导入的模块"""
+    import agents.travel_crew
+    import agents.instrumentation
+    import agents.streaming
+    return agents.travel_crew, agents.instrumentation, agents.streaming
+
+@huey.on_startup()
+def warm_worker():
+    """worker 启动时创建 LLM 客户端，之后的任务复用同一个客户端和连接"""
+    travel_crew, instrumentation, streaming = load_crew_modules()
+    _worker_state.llm = travel_crew.create_travel_llm()
+    if streaming.COORDINATION_STREAMING:
+        _worker_state.streaming_llm = travel_crew.create_travel_llm(stream=True)
+    instrumentation.register_llm_metrics()
+    logging.info("Worker LLM client ready")
+
+@huey.signal(SIGNAL_RETRYING)
+def count_retry(signal, task, *args, **kwargs):
+    metrics.inc("travel_task_retries_total", task=task.name)
+
+def _task_meta(task_id: str) -> Tuple[Optional[float], Optional[str], str]:
+    """任务的 (提交时间, 输入哈希, 调度通道)"""
+    try:
+        created_at, input_hash, lane = redis_client.hmget(
+            f"{TASK_KEY_PREFIX}{task_id}", "created_at", "input_hash", "lane"
+        )
+        return (float(created_at) if created_at else None,
+                input_hash.decode("utf-8") if input_hash else None,
+                scheduler.normalize_lane(lane.decode("utf-8") if lane else None))
+    except Exception as e:
+        logging.warning(f"Failed to read task metadata: {str(e)}")
+        return None, None, scheduler.DEFAULT_LANE
+
+def _store_result(task_id: str, status: str, result: Dict[str, Any]):
+    # 完成时续期，任务 hash 不早于输入映射过期
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(f"travel:task:{task_id}", mapping=result_mapping(status, result))
+    pipe.hdel(f"travel:task:{task_id}", *partial_fields())
+    pipe.expire(f"travel:task:{task_id}", TASK_TTL)
+    pipe.execute()
+
+def _is_cancelled(task_id: str) -> bool:
+    return redis_client.hget(f"travel:task:{task_id}", "status") == b"CANCELLED"
+
+def _abort_task(task_id: str, reason: str):
+    """取消时 API 已写入状态并推送结果，这里只清理部分结果；超时按失败记录"""
+    if reason == "cancelled":
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hdel(f"travel:task:{task_id}", *partial_fields())
+        pipe.expire(f"travel:task:{task_id}", TASK_TTL)
+        pipe.execute()
+        logging.info(f"Task cancelled: {task_id}")
+        metrics.inc("travel_tasks_total", status="CANCELLED")
+        return
+    error = {"error": "任务超过截止时间"}
+    _store_result(task_id, "FAILURE", error)
+    publish_task_event(task_id, "result", {"status": "FAILURE", "result": error})
+    logging.warning(f"Task deadline exceeded: {task_id}")
+    metrics.inc("travel_tasks_total", status="TIMEOUT")
+
+def _worker_crew():
+    # crewai 按实例 memoize 任务定义，crew 必须每个任务新建，只复用 LLM 客户端
+    travel_crew, _, streaming = load_crew_modules()
+    llm = getattr(_worker_state, "llm", None)
+    if llm is None:
+        llm = _worker_state.llm = travel_crew.create_travel_llm()
+    streaming_llm = getattr(_worker_state, "streaming_llm", None)
+    if streaming_llm is None and streaming.COORDINATION_STREAMING:
+        streaming_llm = _worker_state.streaming_llm = travel_crew.create_travel_llm(stream=True)
+    return travel_crew.TravelRecommendationCrew(llm=llm, streaming_llm=streaming_llm)
+
+def _will_retry(task, signal: AbortSignal) -> bool:
+    """huey 还会重试该任务，且下次重试开始时仍在截止时间内（call_local 执行时 task 为 None）"""
+    if task is None or not task.retries:
+        return False
+    remaining = signal.remaining()
+    return remaining is None or remaining > (task.retry_delay or 0)
+
+@huey.task(retries=TASK_RETRIES, retry_delay=TASK_RETRY_DELAY, retry_backoff=TASK_RETRY_BACKOFF, context=True)
+def process_travel_recommendation(task_id: str, travel_input: Dict[str, Any], deadline: Optional[float] = None,
+                                  task=None):
+    """deadline 为提交时确定的截止时间戳；未提供时（预计算、旧消息）从开始执行时算起"""
+    travel_crew = None
+    signal = AbortSignal(deadline or time.time() + TASK_DEADLINE_SECONDS, lambda: _is_cancelled(task_id))
+    retrying = task is not None and task.retries < TASK_RETRIES
+    # 交给 huey 重试时保留调度名额，任务最终结束时才释放
+    will_retry = False
     try:
         # redis_client.hset(f"travel:task:{task_id}", mapping={"status":"PROCESSING", "started_at": time.time()})
 
-        logging.info(f"Task starting:  {task_id}")
+        logging.info(f"Task {'retrying' if retrying else 'starting'}:  {task_id}")
+        started_at = time.time()
+        created_at, input_hash, lane = _task_meta(task_id)
+        if created_at and not retrying:
+            metrics.observe("travel_queue_wait_seconds", max(started_at - created_at, 0), lane=lane)
+        # 排在后面的任务位置前移
+        publish_queue_update()
+        # 排队期间已被取消或超过截止时间的任务不再执行
+        signal.check()
+        publish_task_event(task_id, "started")
 
-        travel_crew = TravelRecommendationCrew()
+        travel_crew = _worker_crew()
 
-        result = travel_crew.generate_recommendations(travel_input)
+        # 检查点按输入哈希和出发日期记录：worker 崩溃后相同请求重新提交（新的任务 id）也能接着执行
+        checkpoint_key = checkpoint_run_key(input_hash, travel_input, task_id)
+        with abort_scope(signal):
+            result = travel_crew.generate_recommendations(travel_input, task_id=task_id,
+                                                          checkpoint_key=checkpoint_key)
 
-        redis_client.hset(f"travel:task:{task_id}", mapping={"status": "SUCCESS", "result": json.dumps(result, ensure_ascii=False, indent=2), "completed_at": time.time()})
+        _store_result(task_id, "SUCCESS", result)
+        if CHECKPOINT_ENABLED:
+            checkpoint_store.clear(checkpoint_key)
+        publish_task_event(task_id, "result", {"status": "SUCCESS", "result": result})
+        _record_service_time(time.time() - started_at)
+        metrics.inc("travel_tasks_total", status="SUCCESS")
+        if created_at:
+            metrics.observe("travel_end_to_end_seconds", time.time() - created_at)
 
         logging.info(f"Task completed: {task_id}")
         return result
+    except TaskAborted as e:
+        _abort_task(task_id, e.reason)
     except Exception as e:
-        redis_client.hset(f"travel:task{task_id}", mapping={"status":"FAILURE", "result": json.dumps({"error": str(e)}, ensure_ascii=False), "completed_at": time.time()})
+        if _will_retry(task, signal):
+            # 保持 PENDING，由 huey 延迟后重新执行，已完成的阶段从检查点恢复
+            logging.warning(f"Task failed, will retry ({task.retries} left): {task_id}, error: {str(e)}")
+            publish_task_event(task_id, "retry", {"error": str(e), "delay": task.retry_delay})
+            will_retry = True
+            raise
+        _store_result(task_id, "FAILURE", {"error": str(e)})
+        publish_task_event(task_id, "result", {"status": "FAILURE", "result": {"error": str(e)}})
         logging.error(f"Task failed: {task_id}, error: {str(e)}")
+        metrics.inc("travel_tasks_total", status="FAILURE")
         raise e
+    finally:
+        if travel_crew is not None:
+            travel_crew.release()
+        if not will_retry:
+            scheduler.release_slot(task_id, time.time(), TASK_KEY_PREFIX)
 
-def get_queue_status():
+@huey.periodic_task(crontab(minute="*"))
+def dispatch_scheduled_tasks():
+    """回收 worker 崩溃后未释放的调度名额，并派发因此积压的任务"""
+    dispatched = scheduler.dispatch(time.time(), TASK_KEY_PREFIX)
+    if dispatched:
+        logging.info(f"Dispatched {len(dispatched)} queued tasks")
+
+@huey.task()
+def refresh_destination_report(travel_input: Dict[str, Any]):
+    """后台刷新已过期的目的地报告"""
+    travel_crew = _worker_crew()
+    try:
+        logging.info(f"Refreshing destination report: {travel_input.get('destination')}")
+        travel_crew.refresh_destination_report(travel_input)
+    except Exception as e:
+        logging.error(f"Destination report refresh failed: {str(e)}")
+        raise e
+    finally:
+        travel_crew.release()
+
+@huey.periodic_task(crontab(minute=f"*/{PRECOMPUTE_INTERVAL_MINUTES}", hour=PRECOMPUTE_HOURS))
+def precompute_popular_recommendations():
+    """
+    闲时为热门 (目的地, 月份) 生成默认偏好的推荐，走与用户任务相同的处理流程，
+    结果登记到单飞映射中供同类请求复用。每次最多运行一个间隔，且不超过当天的 token 预算。
+    """
+    if not PRECOMPUTE_ENABLED:
+        return
+    # 多个 consumer 都会调度周期任务，同一时间只允许一个在执行
+    if not redis_client.set(PRECOMPUTE_LOCK_KEY, 1, nx=True, ex=2 * PRECOMPUTE_INTERVAL_MINUTES * 60):
+        return
+    deadline = time.time() + PRECOMPUTE_INTERVAL_MINUTES * 60
+    try:
+        for destination, month, count in top_destinations(PRECOMPUTE_TOP_N):
+            if time.time() >= deadline:
+                break
+            if precompute_tokens_used() >= PRECOMPUTE_DAILY_TOKEN_BUDGET:
+                logging.info("Precompute token budget exhausted for today")
+                break
+            travel_input, input_hash = canonicalize_request(default_trip_input(destination, month))
+            task_id = str(uuid.uuid4())
+            if not claim_precompute(task_id, input_hash, travel_input):
+                metrics.inc("travel_precompute_total", outcome="fresh")
+                continue
+            logging.info(f"Precomputing {destination} (month {month}, {count:.0f} requests): {task_id}")
+            _, instrumentation, _ = load_crew_modules()
+            before = instrumentation.llm_tokens_used()
+            try:
+                process_travel_recommendation.call_local(task_id, travel_input)
+                metrics.inc("travel_precompute_total", outcome="computed")
+            except Exception:
+                metrics.inc("travel_precompute_total", outcome="failed")
+            finally:
+                charge_precompute_tokens(instrumentation.llm_tokens_used() - before)
+    finally:
+        redis_client.delete(PRECOMPUTE_LOCK_KEY)
+
+# 单个推荐任务处理耗时的指数滑动平均，供准入控制估算排队时间
+SERVICE_TIME_KEY = "travel:stats:service_time"
+SERVICE_TIME_ALPHA = 0.2
+# 还没有统计数据时假设的单任务耗时（秒）
+DEFAULT_SERVICE_TIME = float(os.getenv("DEFAULT_SERVICE_TIME", "300"))
+
+_record_service_time_script = redis_client.register_script("""
+local current = tonumber(redis.call('GET', KEYS[1]) or '')
+local sample = tonumber(ARGV[1])
+if current then
+    sample = current + tonumber(ARGV[2]) * (sample - current)
+end
+redis.call('SET', KEYS[1], tostring(sample))
+return tostring(sample)
+""")
+
+def _record_service_time(seconds: float):
     try:
-        pending_count = len(huey.pending())
+        _record_service_time_script(keys=[SERVICE_TIME_KEY], args=[seconds, SERVICE_TIME_ALPHA])
+    except Exception as e:
+        logging.error(f"Failed to record service time: {str(e)}")
 
+def enqueue_travel_recommendation(task_id: str, travel_input: Dict[str, Any],
+                                  lane: str = scheduler.DEFAULT_LANE, client: str = "local"):
+    """不经过单飞提交，直接把推荐任务放入调度队列"""
+    deadline = time.time() + TASK_DEADLINE_SECONDS
+    message = huey.serialize_task(process_travel_recommendation.s(task_id, travel_input, deadline))
+    scheduler.enqueue(f"{TASK_KEY_PREFIX}{task_id}", task_id, message, scheduler.normalize_lane(lane), client,
+                      deadline, TASK_TTL)
+    return scheduler.dispatch(time.time(), TASK_KEY_PREFIX)
 
-        total_count = pending_count + 1
+def get_queue_position_status(task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    一次脚本调用读出任务所在通道、位置和积压数。
+    position 为 1 表示正在处理（或已完成），total 为积压任务数加上正在处理的任务。
+    """
+    status = scheduler.queue_status(f"{TASK_KEY_PREFIX}{task_id}" if task_id else "", TASK_KEY_PREFIX)
+    return {"pending": status["pending"], "total": status["pending"] + 1, "position": status["position"],
+            "lane": status["lane"]}
+
+def get_queue_status():
+    try:
+        status = get_queue_position_status()
         return {
-            "pending": pending_count,
-            "total": total_count
+            "pending": status["pending"],
+            "total": status["total"]
         }
     except Exception as e:
         logging.error(f"Failed to get queue status: {str(e)}")
         raise e
     
 def get_position(task_id: str):
-    queue_key = f"huey.redis.{huey.name}"
     try:
-        # TODO: 读取所有key然后反序列化去匹配id， 性能比较差
-        queue_items = redis_client.lrange(queue_key, 0, -1)
-        total = len(queue_items)
-        position = None
-        for idx, raw in enumerate(queue_items):
-            message = pickle.loads(raw)
-            if message.args[0] == task_id:
-                position = total - idx + 1
-                break
-        return position
-
+        return get_queue_position_status(task_id)["position"]
     except Exception as e:
         logging.error(f"Failed to get position: {str(e)}")
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,107 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+RECOMMENDATION = {
+    "itinerary": [{"day": 1, "date": "2025-04-01", "schedule": [{"time": "09:00", "activity": "清水寺"}]}],
+    "restaurants": [], "attractions": [], "accommodations": [], "tips": ["提前预约"]
+}
+
+
+@pytest.fixture
+def crew_env(monkeypatch):
+    """crew 读写的 Redis 存储都换成同一个 fakeredis；默认只开启检查点，其余缓存由各测试按需开启"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from agents import travel_crew, stage_store, destination_store
+    from task_queue import metrics
+
+    redis = fakeredis.FakeRedis()
+    for store in (stage_store.stage_store, stage_store.checkpoint_store, destination_store.destination_store):
+        monkeypatch.setattr(store, "redis", redis)
+    monkeypatch.setattr(metrics, "redis_client", redis)
+    monkeypatch.setattr(travel_crew, "CHECKPOINT_ENABLED", True)
+    monkeypatch.setattr(travel_crew, "STAGE_MEMO_ENABLED", False)
+    monkeypatch.setattr(travel_crew, "DESTINATION_CACHE_ENABLED", False)
+    monkeypatch.setattr(travel_crew, "CONTEXT_COMPACTION_ENABLED", False)
+    monkeypatch.setattr(travel_crew, "COORDINATION_STREAMING", False)
+    try:
+        # 设置了 REDIS_URL 时 crewai 用 Redis 做进程锁，测试中改用文件锁
+        from crewai_core import lock_store
+        monkeypatch.setattr(lock_store, "_REDIS_URL", None)
+    except ImportError:
+        pass
+    return redis
+
+
+@pytest.fixture
+def scripted_llm():
+    """按任务名返回固定输出的 LLM 类，记录每次调用的任务和 prompt；fail_on 中的任务调用时抛出异常"""
+    from crewai.llms.base_llm import BaseLLM
+
+    class ScriptedLLM(BaseLLM):
+        calls: list = []
+        fail_on: set = set()
+
+        def call(self, messages, tools=None, callbacks=None, available_functions=None, from_task=None,
+                 from_agent=None, response_model=None):
+            name = getattr(from_task, "name", None)
+            prompt = messages if isinstance(messages, str) else "\n".join(str(m.get("content")) for m in messages)
+            self.calls.append((name, prompt))
+            if name in self.fail_on:
+                raise RuntimeError(f"模拟 {name} 失败")
+            if name == "coordination_task":
+                answer = json.dumps(RECOMMENDATION, ensure_ascii=False)
+            else:
+                answer = f"{name} 的输出"
+            return f"Thought: I now can give a great answer\nFinal Answer: {answer}"
+
+    return ScriptedLLM
+
+
+@pytest.fixture
+def run_crew(crew_env, scripted_llm):
+    """用 ScriptedLLM 执行一次推荐，返回 (结果, [(任务名, prompt)])"""
+    from agents import travel_crew
+
+    def run(travel_input, checkpoint_key=None, fail_on=()):
+        llm = scripted_llm(model="scripted", calls=[], fail_on=set(fail_on))
+        crew = travel_crew.TravelRecommendationCrew(llm=llm, streaming_llm=llm)
+        try:
+            return crew.generate_recommendations(dict(travel_input), checkpoint_key=checkpoint_key), llm.calls
+        finally:
+            crew.release()
+    return run
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """在 fakeredis 上调用 FastAPI 应用：api(scenario) 执行 scenario(client, redis)，client 为 httpx 客户端"""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    httpx = pytest.importorskip("httpx")
+    import main
+    from task_queue import async_store, scheduler, events
+
+    def run(scenario):
+        async def main_loop():
+            # worker 侧用同步客户端发布任务事件，与 API 共用同一个 fakeredis 服务端
+            server = fakeredis.FakeServer()
+            redis = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+            monkeypatch.setattr(async_store, "async_redis_client", redis)
+            monkeypatch.setattr(main, "async_redis_client", redis)
+            monkeypatch.setattr(events, "redis_client", fakeredis.FakeRedis(server=server))
+            # 事件订阅绑定在当前事件循环上，每次调用换一个新的
+            monkeypatch.setattr(async_store, "task_event_hub", async_store.TaskEventHub())
+            for name, script in (("_submit", async_store._SUBMIT_SCRIPT), ("_cancel", async_store._CANCEL_SCRIPT),
+                                 ("_dispatch", scheduler.DISPATCH_SCRIPT),
+                                 ("_queue_status", scheduler.QUEUE_STATUS_SCRIPT)):
+                monkeypatch.setattr(async_store, name, redis.register_script(script))
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await scenario(client, redis)
+        return asyncio.run(main_loop())
+    return run
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+pytest.importorskip("fakeredis")
+
+import main
+from task_queue import async_store
+from task_queue.results import partial_field
+
+TRAVEL_INPUT = {"destination": "京都", "start_date": "2025-04-01", "end_date": "2025-04-02", "preferences": {}}
+
+RECOMMENDATIONS = {
+    "itinerary": [{"day": 1, "date": "2025-04-01", "schedule": []}, {"day": 2, "date": "2025-04-02", "schedule": []}],
+    "restaurants": [{"name": "菊乃井"}], "attractions": [{"name": "清水寺"}], "accommodations": [], "tips": ["提前预约"]
+}
+
+
+async def seed(redis):
+    """成功、失败、进行中（已有部分板块）的任务各一个，外加成功任务的别名"""
+    done, _ = await async_store.submit_or_attach("hash-done", TRAVEL_INPUT, 600)
+    await async_store.set_task_result(done, "SUCCESS", {
+        "recommendations": RECOMMENDATIONS, "analysis": "分析", "status": "success"
+    })
+    failed, _ = await async_store.submit_or_attach("hash-failed", TRAVEL_INPUT, 600)
+    await async_store.set_task_result(failed, "FAILURE", {"error": "LLM 超时"})
+    pending, _ = await async_store.submit_or_attach("hash-pending", TRAVEL_INPUT, 600)
+    await redis.hset(async_store.task_key(pending), partial_field("tips"), json.dumps(["带伞"], ensure_ascii=False))
+    later = dict(TRAVEL_INPUT, start_date="2025-05-10", end_date="2025-05-11")
+    alias, _ = await async_store.submit_or_attach("hash-done", later, 600)
+    return done, failed, pending, alias
+
+
+async def post_results(client, body):
+    resp = await client.post("/api/results", json=body)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in resp.text.splitlines()]
+
+
+def test_mixed_ids_in_request_order(api, monkeypatch):
+    # 每 2 个 id 一次往返，覆盖跨 chunk 的情况
+    monkeypatch.setattr(main, "RESULTS_BATCH_CHUNK", 2)
+
+    async def scenario(client, redis):
+        done, failed, pending, alias = await seed(redis)
+        lines = await post_results(client, {"task_ids": ["missing", done, failed, pending, alias]})
+        assert [line["task_id"] for line in lines] == ["missing", done, failed, pending, alias]
+        assert lines[0] == {"task_id": "missing", "status": None, "error": "not_found"}
+        assert lines[1]["status"] == "SUCCESS"
+        assert lines[1]["result"]["recommendations"] == RECOMMENDATIONS
+        assert lines[1]["result"]["analysis"] == "分析"
+        # 失败任务不返回结果
+        assert lines[2] == {"task_id": failed, "status": "FAILURE", "result": None}
+        assert lines[3] == {"task_id": pending, "status": "PENDING",
+                            "result": {"recommendations": {"tips": ["带伞"]}, "partial": True}}
+        # 别名返回实际任务的状态和结果，行程日期按别名的出发日期改写
+        assert lines[4]["status"] == "SUCCESS"
+        assert [d["date"] for d in lines[4]["result"]["recommendations"]["itinerary"]] == \
+            ["2025-05-10", "2025-05-11"]
+        assert lines[4]["result"]["recommendations"]["tips"] == ["提前预约"]
+    api(scenario)
+
+
+def test_field_projection(api):
+    async def scenario(client, redis):
+        done, _, pending, alias = await seed(redis)
+        lines = await post_results(client, {"task_ids": [done, pending, alias], "fields": ["itinerary", "tips"]})
+        assert set(lines[0]["result"]["recommendations"]) == {"itinerary", "tips"}
+        assert lines[0]["result"]["analysis"] == "分析"
+        assert lines[1]["result"]["recommendations"] == {"tips": ["带伞"]}
+        assert lines[2]["result"]["recommendations"]["itinerary"][0]["date"] == "2025-05-10"
+
+        lines = await post_results(client, {"task_ids": [pending], "fields": ["restaurants"]})
+        assert lines == [{"task_id": pending, "status": "PENDING", "result": None}]
+    api(scenario)
+
+
+def test_status_only(api):
+    async def scenario(client, redis):
+        done, failed, pending, alias = await seed(redis)
+        lines = await post_results(client, {"task_ids": [done, failed, pending, alias, "missing"],
+                                            "status_only": True, "fields": ["not-a-section"]})
+        assert [line.get("status") for line in lines] == ["SUCCESS", "FAILURE", "PENDING", "SUCCESS", None]
+        assert all("result" not in line for line in lines)
+    api(scenario)
+
+
+def test_rejects_bad_requests(api, monkeypatch):
+    monkeypatch.setattr(main, "RESULTS_BATCH_MAX", 2)
+
+    async def scenario(client, _):
+        resp = await client.post("/api/results", json={"task_ids": ["a", "b", "c"]})
+        assert resp.status_code == 400
+        resp = await client.post("/api/results", json={"task_ids": ["a"], "fields": ["itinerary", "weather"]})
+        assert resp.status_code == 400
+        assert "weather" in resp.json()["detail"]
+    api(scenario)
@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from agents import cancellation
+from agents.cancellation import AbortSignal, TaskAborted, abort_scope, run_abortable
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(cancellation, "CANCEL_POLL_SECONDS", 0.05)
+
+
+def test_runs_directly_without_signal():
+    assert run_abortable(lambda x: x + 1, 1) == 2
+
+
+def test_cancel_interrupts_waiting_call():
+    state = {"cancelled": False}
+    signal = AbortSignal(None, lambda: state["cancelled"])
+
+    def slow():
+        state["cancelled"] = True
+        time.sleep(2)
+
+    started = time.monotonic()
+    with abort_scope(signal), pytest.raises(TaskAborted) as e:
+        run_abortable(slow)
+    assert e.value.reason == "cancelled"
+    assert time.monotonic() - started < 1
+
+
+def test_deadline_interrupts_waiting_call():
+    signal = AbortSignal(time.time() + 0.2, lambda: False)
+    with abort_scope(signal), pytest.raises(TaskAborted) as e:
+        run_abortable(time.sleep, 2)
+    assert e.value.reason == "deadline"
+
+
+def test_abandoned_calls_do_not_block_new_calls():
+    # 大量被放弃的慢调用之后，新的调用仍然立即执行
+    for _ in range(40):
+        signal = AbortSignal(time.time() + 0.01, lambda: False)
+        with abort_scope(signal), pytest.raises(TaskAborted):
+            run_abortable(time.sleep, 2)
+    started = time.monotonic()
+    with abort_scope(AbortSignal(None, lambda: False)):
+        assert run_abortable(lambda: "ok") == "ok"
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,62 @@
+from agents.canonical import (
+    canonical_destination, canonical_preferences, canonicalize_request, display_destination, trip_shape
+)
+from task_queue.results import relabel_itinerary_dates
+
+
+def _input(**overrides):
+    travel_input = {
+        "destination": "东京",
+        "start_date": "2025-04-01",
+        "end_date": "2025-04-03",
+        "xiaohongshu_account": None,
+        "preferences": {"budget": "medium", "travel_style": "cultural"}
+    }
+    travel_input.update(overrides)
+    return travel_input
+
+
+def test_destination_aliases():
+    assert canonical_destination(" Tokyo ") == "东京"
+    assert canonical_destination("東京") == "东京"
+    assert canonical_destination("北京市") == "北京"
+    assert canonical_destination("Lisbon") == "lisbon"
+
+
+def test_unknown_destination_keeps_display_name():
+    assert display_destination(" Tokyo ") == "东京"
+    assert display_destination("北京市") == "北京"
+    assert display_destination("  San   Sebastián ") == "San Sebastián"
+    canonical_input, key = canonicalize_request(_input(destination="Lisbon"))
+    # 只有缓存键按小写归一，交给 crew 的输入保留用户的写法
+    assert canonical_input["destination"] == "Lisbon"
+    assert canonicalize_request(_input(destination="LISBON"))[1] == key
+
+
+def test_preference_synonyms():
+    assert canonical_preferences({"Budget": "中等", "travel_style": "文化体验", "notes": ""}) == \
+        {"budget": "medium", "travel_style": "cultural"}
+    assert canonical_preferences({"interests": ["美食", "Photo ", "美食"]}) == \
+        canonical_preferences({"interests": ["photo", "美食"]})
+
+
+def test_equivalent_requests_share_key():
+    _, key = canonicalize_request(_input())
+    assert canonicalize_request(_input(destination="tokyo"))[1] == key
+    assert canonicalize_request(_input(xiaohongshu_account="someone"))[1] == key
+    assert canonicalize_request(_input(preferences={"budget": "中等", "travel_style": "文化"}))[1] == key
+    # 同月同天数
+    assert canonicalize_request(_input(start_date="2025-04-10", end_date="2025-04-12"))[1] == key
+    assert canonicalize_request(_input(start_date="2025-04-10", end_date="2025-04-13"))[1] != key
+    assert canonicalize_request(_input(start_date="2025-05-01", end_date="2025-05-03"))[1] != key
+
+
+def test_trip_shape():
+    assert trip_shape("2025-04-30", "2025-05-02") == (4, 3)
+    assert trip_shape(None, None) == (0, 0)
+
+
+def test_relabel_dates():
+    result = {"recommendations": {"itinerary": [{"day": 1, "date": "2025-04-01"}, {"day": 2, "date": "2025-04-02"}]}}
+    relabel_itinerary_dates(result, "2025-04-10")
+    assert [d["date"] for d in result["recommendations"]["itinerary"]] == ["2025-04-10", "2025-04-11"]
@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("fakeredis")
+
+from agents import stage_store
+from task_queue import metrics
+
+TRAVEL_INPUT = {"destination": "京都", "start_date": "2025-04-01", "end_date": "2025-04-02", "preferences": {}}
+
+
+def test_retry_resumes_from_checkpoint(crew_env, run_crew):
+    with pytest.raises(RuntimeError):
+        run_crew(TRAVEL_INPUT, "run-1", fail_on={"coordination_task"})
+    saved = stage_store.checkpoint_store.load("run-1")
+    assert set(saved) == set(stage_store.CHECKPOINT_STAGES)
+
+    result, calls = run_crew(TRAVEL_INPUT, "run-1")
+    # 已完成的阶段不再调用 LLM，检查点中的输出作为整合阶段的 context
+    assert {name for name, _ in calls} == {"coordination_task"}
+    prompt = calls[0][1]
+    assert all(output in prompt for output in saved.values())
+    resumed = crew_env.hgetall(metrics.metric_key("travel_checkpoint_resumed_total"))
+    assert resumed == {f'stage="{name}"\tcount'.encode(): b"1" for name in stage_store.CHECKPOINT_STAGES}
+
+    uninterrupted, calls = run_crew(TRAVEL_INPUT, "run-2")
+    assert {name for name, _ in calls} == set(stage_store.CHECKPOINT_STAGES) | {"coordination_task"}
+    assert result == uninterrupted
+    assert result["recommendations"]["tips"] == ["提前预约"]
+
+
+def test_checkpoint_not_shared_across_start_dates(crew_env, run_crew):
+    # 同月同天数的请求规范化后输入哈希相同，出发日期不同
+    later = dict(TRAVEL_INPUT, start_date="2025-04-10", end_date="2025-04-11")
+    first_key = stage_store.checkpoint_run_key("hash", TRAVEL_INPUT, "task-1")
+    later_key = stage_store.checkpoint_run_key("hash", later, "task-2")
+    assert first_key != later_key
+    assert stage_store.checkpoint_run_key("hash", dict(TRAVEL_INPUT), "task-3") == first_key
+    assert stage_store.checkpoint_run_key(None, TRAVEL_INPUT, "task-1") == "task-1"
+
+    with pytest.raises(RuntimeError):
+        run_crew(TRAVEL_INPUT, first_key, fail_on={"coordination_task"})
+    # 另一个出发日期的请求不会用到失败执行的检查点，行程按自己的日期重新规划
+    _, calls = run_crew(later, later_key)
+    assert {name for name, _ in calls} == set(stage_store.CHECKPOINT_STAGES) | {"coordination_task"}
+    itinerary_prompt = next(prompt for name, prompt in calls if name == "itinerary_task")
+    assert "2025-04-10" in itinerary_prompt
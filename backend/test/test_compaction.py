@@ -0,0 +1,54 @@
+import json
+
+from agents.compaction import compact_stage_output, compact_text, count_tokens, parse_sections
+
+REPORT = """# 京都目的地报告
+
+## 主要景点:
+1. **清水寺**：京都最古老的寺院之一
+2. **伏见稻荷大社**：千本鸟居
+3. 金阁寺
+
+---
+
+## 当地美食
+- 汤豆腐
+- 抹茶甜品
+- 汤豆腐
+
+交通方式：
+- 地铁与巴士一日券
+"""
+
+
+def test_sections_strip_markdown_and_duplicates():
+    assert parse_sections(REPORT) == [
+        ("京都目的地报告", []),
+        ("主要景点", ["清水寺：京都最古老的寺院之一", "伏见稻荷大社：千本鸟居", "金阁寺"]),
+        ("当地美食", ["汤豆腐", "抹茶甜品"]),
+        ("交通方式", ["地铁与巴士一日券"]),
+    ]
+
+
+def test_budget_keeps_every_section():
+    long_report = REPORT + "\n".join(f"- 补充景点说明第{i}条，附带较长的介绍文字" for i in range(200))
+    digest = compact_text(long_report, budget=120)
+    assert count_tokens(digest) <= 120
+    for title in ("## 主要景点", "## 当地美食", "## 交通方式"):
+        assert title in digest
+    # 各小节轮流保留条目，前面的小节不会占满预算
+    assert "- 汤豆腐" in digest and "- 地铁与巴士一日券" in digest
+
+
+def test_json_is_compacted_losslessly():
+    value = {"itinerary": [{"day": 1, "schedule": [{"time": "09:00", "activity": "清水寺"}]}]}
+    raw = "```json\n" + json.dumps(value, ensure_ascii=False, indent=2) + "\n```"
+    assert json.loads(compact_text(raw, budget=1)) == value
+    assert compact_text("第一天\n\n  去清水寺  \n", budget=None) == "第一天\n  去清水寺"
+
+
+def test_stage_compaction_is_lossless_by_default():
+    long_report = REPORT + "\n".join(f"- 补充景点说明第{i}条，附带较长的介绍文字" for i in range(200))
+    digest = compact_stage_output("destination_task", long_report)
+    assert "补充景点说明第199条" in digest
+    assert "**清水寺**" in digest
@@ -0,0 +1,118 @@
+import time
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from agents import travel_crew, destination_store as store_module
+from agents.destination_store import DestinationReportStore, destination_key
+from task_queue import metrics
+
+TRAVEL_INPUT = {"destination": "Tokyo", "start_date": "2025-04-01", "end_date": "2025-04-02", "preferences": {}}
+
+
+@pytest.fixture
+def store():
+    return DestinationReportStore(redis=fakeredis.FakeRedis())
+
+
+def age_report(store, destination, month, seconds):
+    """把报告的生成时间往前拨"""
+    key = store._key(destination, month)
+    store.redis.hset(key, "created_at", time.time() - seconds)
+
+
+def test_fresh_and_stale_lookup(store):
+    assert store.get("东京", 4) is None
+    store.put("东京", 4, "东京四月报告")
+    assert store.get("东京", 4) == ("东京四月报告", True)
+    age_report(store, "东京", 4, store_module.DESTINATION_REPORT_TTL + 1)
+    # 过期的报告仍可使用
+    assert store.get("东京", 4) == ("东京四月报告", False)
+    assert 0 < store.redis.ttl(store._key("东京", 4)) <= store_module.DESTINATION_REPORT_MAX_STALE
+
+
+def test_keyed_by_canonical_destination_and_month(store):
+    assert destination_key(TRAVEL_INPUT) == ("东京", 4)
+    assert destination_key(dict(TRAVEL_INPUT, destination="東京")) == ("东京", 4)
+    assert destination_key(dict(TRAVEL_INPUT, start_date="2025-10-01")) == ("东京", 10)
+    store.put(*destination_key(TRAVEL_INPUT), "东京四月报告")
+    assert store.get(*destination_key(dict(TRAVEL_INPUT, destination="tokyo", start_date="2025-04-20"))) == \
+        ("东京四月报告", True)
+    assert store.get(*destination_key(dict(TRAVEL_INPUT, start_date="2025-10-01"))) is None
+    assert store.get("京都", 4) is None
+
+
+def test_refresh_lock_released_by_put(store):
+    assert store.try_acquire_refresh("东京", 4)
+    assert not store.try_acquire_refresh("东京", 4)
+    # 其他 (目的地, 月份) 不受影响
+    assert store.try_acquire_refresh("东京", 5)
+    assert 0 < store.redis.ttl(f"{store._key('东京', 4)}:refreshing") <= store_module.DESTINATION_REFRESH_LOCK_TTL
+    store.put("东京", 4, "新报告")
+    assert store.try_acquire_refresh("东京", 4)
+
+
+@pytest.fixture
+def refreshes(crew_env, monkeypatch):
+    """开启目的地缓存，记录派发的后台刷新任务"""
+    from task_queue import tasks
+    monkeypatch.setattr(travel_crew, "DESTINATION_CACHE_ENABLED", True)
+    scheduled = []
+    monkeypatch.setattr(tasks, "refresh_destination_report", scheduled.append)
+    return scheduled
+
+
+def test_stale_report_served_while_one_refresh_scheduled(crew_env, run_crew, refreshes):
+    destination, month = destination_key(TRAVEL_INPUT)
+    store_module.destination_store.put(destination, month, "缓存的东京报告")
+    age_report(store_module.destination_store, destination, month, store_module.DESTINATION_REPORT_TTL + 1)
+
+    _, calls = run_crew(TRAVEL_INPUT)
+    # 过期报告直接作为目的地阶段的输出，不再调用 LLM
+    assert "destination_task" not in {name for name, _ in calls}
+    assert any("缓存的东京报告" in prompt for _, prompt in calls)
+    assert refreshes == [TRAVEL_INPUT]
+
+    # 刷新完成前的后续请求继续使用过期报告，不重复派发刷新
+    _, calls = run_crew(dict(TRAVEL_INPUT, destination="東京"))
+    assert "destination_task" not in {name for name, _ in calls}
+    assert len(refreshes) == 1
+    stale = crew_env.hget(metrics.metric_key("travel_destination_cache_total"), 'result="stale"\tcount')
+    assert stale == b"2"
+
+
+def test_fresh_report_does_not_refresh(crew_env, run_crew, refreshes):
+    store_module.destination_store.put(*destination_key(TRAVEL_INPUT), "缓存的东京报告")
+    _, calls = run_crew(TRAVEL_INPUT)
+    assert "destination_task" not in {name for name, _ in calls}
+    assert refreshes == []
+
+
+def test_concurrent_stale_readers_schedule_one_refresh(crew_env, scripted_llm, refreshes):
+    destination, month = destination_key(TRAVEL_INPUT)
+    store_module.destination_store.put(destination, month, "缓存的东京报告")
+    age_report(store_module.destination_store, destination, month, store_module.DESTINATION_REPORT_TTL + 1)
+
+    crews = []
+    for _ in range(8):
+        llm = scripted_llm(model="scripted", calls=[])
+        crew = travel_crew.TravelRecommendationCrew(llm=llm, streaming_llm=llm)
+        crew.travel_input = dict(TRAVEL_INPUT)
+        crews.append(crew)
+    barrier = threading.Barrier(len(crews))
+
+    def load(crew):
+        barrier.wait()
+        crew._load_cached_destination_report()
+
+    threads = [threading.Thread(target=load, args=(crew,)) for crew in crews]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for crew in crews:
+        assert id(crew.destination_task()) in crew._preloaded_tasks
+        crew.release()
+    assert len(refreshes) == 1
@@ -0,0 +1,121 @@
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("fakeredis")
+
+import main
+from task_queue import async_store
+from task_queue.events import publish_task_event, task_channel, QUEUE_EVENTS_CHANNEL
+
+TRAVEL_INPUT = {"destination": "京都", "start_date": "2025-04-01", "end_date": "2025-04-02", "preferences": {}}
+
+RESULT = {"status": "SUCCESS", "result": {"recommendations": {"itinerary": [{"day": 1, "date": "2025-04-01"}]}}}
+
+
+def parse_sse(text):
+    """把 SSE 响应拆成 [(event, data)]，心跳注释记为 ("heartbeat", None)"""
+    events = []
+    for block in text.split("\n\n"):
+        if block == ": heartbeat":
+            events.append(("heartbeat", None))
+        elif block:
+            fields = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_late_subscriber_replays_event_log(api):
+    async def scenario(client, _):
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600)
+        publish_task_event(task_id, "started")
+        publish_task_event(task_id, "stage", {"stage": "destination_task", "output": "报告", "cached": False})
+        publish_task_event(task_id, "result", RESULT)
+        # 连接时任务已结束：从事件日志补发全部事件后关闭
+        resp = await client.get(f"/api/stream/{task_id}")
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        assert [event for event, _ in parse_sse(resp.text)] == ["started", "stage", "result"]
+        assert parse_sse(resp.text)[-1][1] == RESULT
+
+        # 别名任务补发实际任务的事件，结果中的日期按别名的出发日期改写
+        later = dict(TRAVEL_INPUT, start_date="2025-06-10", end_date="2025-06-11")
+        alias, _ = await async_store.submit_or_attach("hash", later, 600)
+        resp = await client.get(f"/api/stream/{alias}")
+        result = parse_sse(resp.text)[-1][1]
+        assert result["result"]["recommendations"]["itinerary"][0]["date"] == "2025-06-10"
+    api(scenario)
+
+
+def test_live_events_follow_replay_with_heartbeats(api, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_HEARTBEAT_SECONDS", 0.05)
+
+    async def scenario(client, _):
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600)
+        publish_task_event(task_id, "started")
+
+        async def worker():
+            await asyncio.sleep(0.3)
+            publish_task_event(task_id, "stage", {"stage": "destination_task", "output": "报告", "cached": False})
+            await asyncio.sleep(0.2)
+            publish_task_event(task_id, "result", RESULT)
+
+        resp, _ = await asyncio.gather(client.get(f"/api/stream/{task_id}"), worker())
+        events = [event for event, _ in parse_sse(resp.text)]
+        # 历史事件只发送一次；等待期间按间隔发送心跳
+        assert events[:2] == ["started", "queue"]
+        assert events.count("started") == 1
+        assert [e for e in events if e != "heartbeat"] == ["started", "queue", "stage", "result"]
+        assert events.index("stage") > events.index("heartbeat")
+        assert events.count("heartbeat") >= 3
+    api(scenario)
+
+
+def test_client_disconnect_unsubscribes(api):
+    async def scenario(_, __):
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600)
+        hub = async_store.task_event_hub
+        first_chunk = asyncio.Event()
+        requested, subscribed = [], []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # 收到第一个事件后客户端断开
+            await first_chunk.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                subscribed.append(set(hub._subscribers))
+                first_chunk.set()
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": f"/api/stream/{task_id}", "raw_path": b"", "root_path": "",
+                 "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80)}
+        await asyncio.wait_for(main.app(scope, receive, send), timeout=5)
+        assert subscribed[0] == {task_channel(task_id), QUEUE_EVENTS_CHANNEL}
+        assert dict(hub._subscribers) == {}
+    api(scenario)
+
+
+def test_hub_fans_out_and_cleans_up(api):
+    async def scenario(_, redis):
+        hub = async_store.task_event_hub
+        async with hub.subscribe(task_channel("a"), QUEUE_EVENTS_CHANNEL) as first:
+            async with hub.subscribe(task_channel("a")) as second:
+                await redis.publish(task_channel("a"), "e1")
+                await redis.publish(task_channel("b"), "ignored")
+                await redis.publish(QUEUE_EVENTS_CHANNEL, "q1")
+                assert await asyncio.wait_for(first.get(), 1) == (task_channel("a"), "e1")
+                assert await asyncio.wait_for(first.get(), 1) == (QUEUE_EVENTS_CHANNEL, "q1")
+                assert await asyncio.wait_for(second.get(), 1) == (task_channel("a"), "e1")
+                assert second.empty()
+            assert hub._subscribers[task_channel("a")] == {first}
+            await redis.publish(task_channel("a"), "e2")
+            assert await asyncio.wait_for(first.get(), 1) == (task_channel("a"), "e2")
+        assert dict(hub._subscribers) == {}
+        # 所有连接共用一个订阅连接
+        assert await redis.pubsub_numpat() == 1
+    api(scenario)
@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+
+from agents.instrumentation import _stage, stage_label
+
+
+def test_day_tasks_share_one_label():
+    assert stage_label("itinerary_day_1") == stage_label("itinerary_day_30") == "itinerary_day"
+    assert stage_label("itinerary_task") == "itinerary_task"
+
+
+def test_stage_from_event():
+    event = SimpleNamespace(from_task=SimpleNamespace(name="itinerary_day_12"))
+    assert _stage(event) == "itinerary_day"
+    assert _stage(SimpleNamespace(task_name="coordination_task")) == "coordination_task"
+    assert _stage(SimpleNamespace()) == "unknown"
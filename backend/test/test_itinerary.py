@@ -0,0 +1,49 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from agents import itinerary
+from agents.itinerary import parse_day, parse_skeleton, trip_dates, trip_too_long, use_per_day_itinerary
+
+
+def test_trip_dates():
+    dates = trip_dates({"start_date": "2025-04-30", "end_date": "2025-05-02"})
+    assert dates == [date(2025, 4, 30), date(2025, 5, 1), date(2025, 5, 2)]
+    assert trip_dates({"start_date": None, "end_date": None}) == []
+
+
+def test_parse_skeleton_fills_missing_days():
+    dates = trip_dates({"start_date": "2025-04-01", "end_date": "2025-04-03"})
+    raw = '好的，骨架如下：[{"day": 1, "theme": "古寺"}, {"day": 2, "theme": "岚山"}]'
+    skeleton = parse_skeleton(raw, dates)
+    assert [d["date"] for d in skeleton] == ["2025-04-01", "2025-04-02", "2025-04-03"]
+    assert skeleton[1]["theme"] == "岚山"
+    assert skeleton[2] == {"day": 3, "date": "2025-04-03"}
+
+
+def test_parse_day():
+    skeleton_day = {"day": 2, "date": "2025-04-02"}
+    raw = '{"day": 5, "date": "x", "schedule": [{"time": "09:00", "activity": "清水寺"}]}'
+    assert parse_day(raw, skeleton_day) == {
+        "day": 2, "date": "2025-04-02", "schedule": [{"time": "09:00", "activity": "清水寺"}]
+    }
+    assert parse_day("无法解析", skeleton_day)["schedule"] == []
+
+
+def test_trip_length_cap(monkeypatch):
+    monkeypatch.setattr(itinerary, "ITINERARY_MAX_DAYS", 30)
+    month = {"start_date": "2025-04-01", "end_date": "2025-04-30"}
+    year = {"start_date": "2025-01-01", "end_date": "2025-12-31"}
+    assert not trip_too_long(month) and use_per_day_itinerary(month)
+    # 超长行程即使绕过 API 也不会按天拆分
+    assert trip_too_long(year) and not use_per_day_itinerary(year)
+
+
+def test_submit_rejects_long_trip():
+    import main
+    travel_input = {"destination": "京都", "start_date": "2025-01-01", "end_date": "2025-12-31", "preferences": {}}
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main._submit_travel_input(travel_input, http_request=None))
+    assert e.value.status_code == 422
@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_api_does_not_import_crew():
+    # API 进程只负责入队，不应加载 crewai 等 worker 依赖
+    code = "import sys, main; print(sorted(m for m in ('crewai', 'litellm', 'agents.travel_crew') if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,174 @@
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from agents import llm_cache
+from agents.llm_cache import (
+    CACHE_KEY_PREFIX, CACHE_STATS_KEY, CachedLLMMixin, LLMResponseCache, LRUCache, bypass_llm_cache, with_llm_cache
+)
+
+MESSAGES = [{"role": "user", "content": "京都三日游"}]
+
+
+class _FakeLLM:
+    """记录调用次数的 LLM；crewai 的 LLM 是 pydantic 模型，这里用 __slots__ 以便挂载 mixin"""
+    __slots__ = ("model", "temperature", "calls")
+
+    def __init__(self, model="deepseek-chat", temperature=0.7):
+        self.model = model
+        self.temperature = temperature
+        self.calls = 0
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.calls += 1
+        return f"回答 {self.calls}"
+
+
+class _CachedFakeLLM(CachedLLMMixin, _FakeLLM):
+    __slots__ = ()
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def cache(redis, monkeypatch):
+    cache = LLMResponseCache(redis=redis, max_entries=16, ttl=60)
+    monkeypatch.setattr(llm_cache, "llm_response_cache", cache)
+    return cache
+
+
+def test_two_tier_hit_and_miss(cache, redis):
+    key = cache.make_key("deepseek-chat", MESSAGES, {})
+    assert cache.get(key) is None
+    cache.set(key, "结果")
+    assert cache.get(key) == "结果"
+    assert redis.get(CACHE_KEY_PREFIX + key) == "结果".encode("utf-8")
+    assert 0 < redis.ttl(CACHE_KEY_PREFIX + key) <= 60
+
+    # 另一个 worker：进程内未命中，从 Redis 读到后回填本地
+    other = LLMResponseCache(redis=redis, max_entries=16, ttl=60)
+    assert other.get(key) == "结果"
+    assert other.get(key) == "结果"
+    assert other.stats()["redis_hits"] == 1 and other.stats()["local_hits"] == 1
+
+
+def test_key_covers_model_messages_and_params(cache):
+    key = cache.make_key("deepseek-chat", MESSAGES, {"temperature": 0.7})
+    assert cache.make_key("deepseek-chat", [dict(MESSAGES[0])], {"temperature": 0.7}) == key
+    assert cache.make_key("deepseek-reasoner", MESSAGES, {"temperature": 0.7}) != key
+    assert cache.make_key("deepseek-chat", [{"role": "user", "content": "京都四日游"}], {"temperature": 0.7}) != key
+    assert cache.make_key("deepseek-chat", MESSAGES, {"temperature": 0.2}) != key
+    assert cache.make_key("deepseek-chat", MESSAGES, {"temperature": 0.7, "max_tokens": 100}) != key
+
+
+def test_mixin_caches_by_generation_params(cache):
+    llm = _CachedFakeLLM()
+    assert llm.call(MESSAGES) == "回答 1"
+    assert llm.call(MESSAGES) == "回答 1"
+    assert llm.calls == 1
+    llm.temperature = 0.1
+    assert llm.call(MESSAGES) == "回答 2"
+    # 带工具的调用不走缓存
+    assert llm.call(MESSAGES, tools=[{"name": "search"}]) == "回答 3"
+    assert llm.call(MESSAGES, tools=[{"name": "search"}]) == "回答 4"
+
+
+def test_oversized_values_are_not_stored(cache, redis):
+    cache.max_value_bytes = 10
+    key = cache.make_key("deepseek-chat", MESSAGES, {})
+    cache.set(key, "很长的回答" * 10)
+    assert cache.get(key) is None
+    assert not redis.exists(CACHE_KEY_PREFIX + key)
+
+
+def test_bypass_skips_reads_and_writes(cache, redis):
+    llm = _CachedFakeLLM()
+    llm.call(MESSAGES)
+    with bypass_llm_cache():
+        assert llm.call(MESSAGES) == "回答 2"
+        assert llm.call([{"role": "user", "content": "新问题"}]) == "回答 3"
+    assert len(redis.keys(CACHE_KEY_PREFIX + "*")) == 1
+    # 上下文外恢复读取，旁路期间的结果没有写入
+    assert llm.call(MESSAGES) == "回答 1"
+    assert llm.call([{"role": "user", "content": "新问题"}]) == "回答 4"
+    assert cache.stats()["bypassed"] == 2
+
+
+def test_bypass_env_var_disables_cache_layer(cache, redis, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_BYPASS", "true")
+    llm = with_llm_cache(_FakeLLM())
+    assert type(llm) is _FakeLLM
+    llm.call(MESSAGES)
+    llm.call(MESSAGES)
+    assert llm.calls == 2
+    assert redis.keys(CACHE_KEY_PREFIX + "*") == []
+
+    monkeypatch.setenv("LLM_CACHE_BYPASS", "false")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    assert isinstance(with_llm_cache(_FakeLLM()), CachedLLMMixin)
+
+
+def test_stats_counters(cache, redis):
+    key = cache.make_key("deepseek-chat", MESSAGES, {})
+    cache.get(key)
+    cache.set(key, "结果")
+    cache.get(key)
+    with bypass_llm_cache():
+        cache.get(key)
+    stats = cache.stats()
+    assert {k: stats[k] for k in ("local_hits", "redis_hits", "misses", "bypassed", "stores")} == \
+        {"local_hits": 1, "redis_hits": 0, "misses": 1, "bypassed": 1, "stores": 1}
+    assert stats["hit_ratio"] == 0.5
+    assert stats["local_entries"] == 1
+    # 各 worker 的计数汇总在 Redis 中
+    assert redis.hgetall(CACHE_STATS_KEY) == {b"local_hits": b"1", b"misses": b"1", b"bypassed": b"1",
+                                              b"stores": b"1"}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_entries=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    # b 最久未使用，被淘汰
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert len(lru) == 2
+    # 覆盖已有 key 不增加条目，并刷新其位置
+    lru.set("a", 10)
+    lru.set("d", 4)
+    assert (lru.get("a"), lru.get("c"), lru.get("d")) == (10, None, 4)
+
+
+def test_lru_entries_expire(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_cache, "time", clock)
+    lru = LRUCache(max_entries=10, ttl=60)
+    lru.set("a", 1)
+    clock.now += 30
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    # 读取不会延长过期时间
+    clock.now += 31
+    assert lru.get("a") is None
+    assert lru.get("b") == 2
+    assert len(lru) == 1
+    clock.now += 30
+    assert lru.get("b") is None
+    assert len(lru) == 0
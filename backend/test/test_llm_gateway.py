@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from agents.llm_gateway import BUCKET_KEY_PREFIX, LLM_COMPLETION_TOKENS_ESTIMATE, LLM_RETRY_MAX_DELAY, LLMEndpoint, \
+    LLMGateway, UsageRecordingMixin, backoff_delay, estimate_tokens, parse_endpoints
+
+
+def test_parse_endpoints(monkeypatch):
+    monkeypatch.setenv("BACKUP_KEY", "secret")
+    endpoints = parse_endpoints(json.dumps([
+        {"name": "primary", "model": "deepseek-chat", "api_key": "k", "rpm": 60, "tpm": "100000"},
+        {"model": "openrouter/deepseek/deepseek-r1:free", "api_key_env": "BACKUP_KEY"}
+    ]))
+    assert [ep.name for ep in endpoints] == ["primary", "endpoint1"]
+    assert (endpoints[0].rpm, endpoints[0].tpm) == (60, 100000)
+    assert endpoints[1].api_key == "secret"
+    assert (endpoints[1].rpm, endpoints[1].tpm) == (0, 0)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == LLM_COMPLETION_TOKENS_ESTIMATE
+    messages = [{"role": "system", "content": "a" * 300}, {"role": "user", "content": "b" * 300}]
+    assert estimate_tokens(messages) == 200 + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def test_backoff_delay_is_capped():
+    assert all(0 <= backoff_delay(attempt) <= LLM_RETRY_MAX_DELAY for attempt in range(20))
+
+
+class _Client:
+    def _track_token_usage_internal(self, usage_data):
+        pass
+
+
+class _UsageClient(UsageRecordingMixin, _Client):
+    """模拟端点客户端：返回前按 crewai 的方式上报 usage"""
+
+    def call(self, messages, *args, **kwargs):
+        self._track_token_usage_internal({"prompt_tokens": 300, "completion_tokens": 100, "total_tokens": 400})
+        return "ok"
+
+
+def test_token_bucket_settles_actual_usage():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    redis = fakeredis.FakeRedis()
+    endpoint = LLMEndpoint("primary", "deepseek-chat", tpm=6000)
+    endpoint._clients[False] = _UsageClient()
+    gateway = LLMGateway([endpoint], redis=redis)
+
+    def level():
+        return float(redis.hget(BUCKET_KEY_PREFIX + "primary", "tokens"))
+
+    reserved = estimate_tokens("a" * 300)
+    assert gateway.try_acquire(endpoint, reserved) == 0
+    assert level() == pytest.approx(6000 - reserved, abs=1)
+    # 实际只用了 400 个 token，多预留的部分退回
+    assert gateway._call_endpoint(endpoint, reserved, "a" * 300, (), {}) == "ok"
+    assert level() == pytest.approx(6000 - 400, abs=1)
+    # 实际用量超过预留时补扣差额
+    gateway.settle(endpoint, 100, 2000)
+    assert level() == pytest.approx(6000 - 400 - 1900, abs=1)
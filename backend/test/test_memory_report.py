@@ -0,0 +1,12 @@
+from task_queue.memory_report import key_group
+
+
+def test_key_group():
+    assert key_group("travel:task:123") == "travel:task:"
+    assert key_group("travel:input:abc:task_id") == "travel:input:"
+    assert key_group("travel:llm:cache:abc") == "travel:llm:cache:"
+    assert key_group("travel:llm:stats") == "travel:llm:"
+    assert key_group("travel:sched:inflight") == "travel:sched:"
+    assert key_group("travel:sched:queue:batch:ip:10.0.0.8") == "travel:sched:queue:"
+    assert key_group("other:thing:x:y") == "other:thing:"
+    assert key_group("huey.redis.trip") == "huey.redis.trip"
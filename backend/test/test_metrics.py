@@ -0,0 +1,28 @@
+from task_queue.metrics import SECONDS_BUCKETS, render_histogram, render_metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    data = {
+        'stage="itinerary_task"\tbucket\t1': "2",
+        'stage="itinerary_task"\tbucket\t10': "1",
+        'stage="itinerary_task"\tbucket\t+Inf': "1",
+        'stage="itinerary_task"\tsum': "2015.5",
+        'stage="itinerary_task"\tcount': "4",
+    }
+    lines = render_histogram("travel_stage_duration_seconds", data)
+    buckets = [l for l in lines if l.startswith("travel_stage_duration_seconds_bucket")]
+    assert len(buckets) == len(SECONDS_BUCKETS) + 1
+    assert 'travel_stage_duration_seconds_bucket{stage="itinerary_task",le="0.5"} 0' in lines
+    assert 'travel_stage_duration_seconds_bucket{stage="itinerary_task",le="10"} 3' in lines
+    assert 'travel_stage_duration_seconds_bucket{stage="itinerary_task",le="+Inf"} 4' in lines
+    assert 'travel_stage_duration_seconds_sum{stage="itinerary_task"} 2015.5' in lines
+
+
+def test_render_cache_hit_ratio():
+    text = render_metrics({
+        "llm_cache": {"local_hits": "1", "redis_hits": "2", "misses": "1"},
+        "queue_pending": 3,
+    })
+    assert "travel_llm_cache_hit_ratio 0.75" in text
+    assert "travel_queue_pending 3" in text
+    assert 'travel_tasks_total' in text
@@ -0,0 +1,28 @@
+from datetime import date
+
+from agents.canonical import canonicalize_request
+from task_queue.popularity import PRECOMPUTE_TRIP_DAYS, default_trip_input, parse_member, popularity_member
+
+
+def test_member_round_trip():
+    assert parse_member(popularity_member("chiang mai", 11)) == ("chiang mai", 11)
+    assert parse_member(popularity_member("a|b", 3).encode("utf-8")) == ("a|b", 3)
+
+
+def test_default_trip_input_next_occurrence():
+    today = date(2025, 6, 15)
+    assert default_trip_input("东京", 6, today)["start_date"] == "2025-06-01"
+    assert default_trip_input("东京", 3, today)["start_date"] == "2026-03-01"
+
+
+def test_default_trip_matches_user_requests():
+    # 预计算的缓存键与同月、默认天数和偏好的用户请求一致
+    travel_input = default_trip_input("东京", 4, date(2025, 1, 1))
+    end_day = 10 + PRECOMPUTE_TRIP_DAYS - 1
+    user_input = {
+        "destination": "Tokyo",
+        "start_date": "2025-04-10",
+        "end_date": f"2025-04-{end_day}",
+        "preferences": {"budget": "中等", "travel_style": "文化体验"}
+    }
+    assert canonicalize_request(travel_input)[1] == canonicalize_request(user_input)[1]
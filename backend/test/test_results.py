@@ -0,0 +1,48 @@
+import json
+from task_queue.results import (
+    RESULT_ENCODING, decode_result, encode_result, result_fields, section_field
+)
+
+RESULT = {
+    "recommendations": {
+        "itinerary": [
+            {"day": 1, "date": "2025-05-01", "schedule": [{"time": "09:00", "activity": "故宫"}]},
+            {"day": 2, "date": "2025-05-02", "schedule": [{"time": "09:00", "activity": "长城"}]}
+        ],
+        "restaurants": [{"name": "四季民福", "location": "东城", "specialty": "烤鸭", "cost": "150元"}],
+        "attractions": [],
+        "accommodations": [],
+        "tips": ["提前预约"]
+    },
+    "analysis": "分析",
+    "status": "success"
+}
+
+
+def _stored(sections=None):
+    encoded = encode_result(RESULT)
+    return {f: encoded.get(f) for f in result_fields(sections)}
+
+
+def test_round_trip():
+    assert decode_result(RESULT_ENCODING, _stored()) == RESULT
+
+
+def test_sections_stored_separately():
+    encoded = encode_result(RESULT)
+    assert set(encoded) >= {section_field("itinerary"), section_field("tips")}
+
+
+def test_projection():
+    result = decode_result(RESULT_ENCODING, _stored(["tips"]), ["tips"])
+    assert result["recommendations"] == {"tips": ["提前预约"]}
+    assert result["analysis"] == "分析"
+
+    result = decode_result(RESULT_ENCODING, _stored(["itinerary"]), ["itinerary"], day=2)
+    assert [d["day"] for d in result["recommendations"]["itinerary"]] == [2]
+
+
+def test_legacy_json_result():
+    stored = {"result": json.dumps(RESULT, ensure_ascii=False, indent=2).encode("utf-8")}
+    assert decode_result(None, stored) == RESULT
+    assert decode_result(None, stored, ["tips"])["recommendations"] == {"tips": ["提前预约"]}
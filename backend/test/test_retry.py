@@ -0,0 +1,23 @@
+import time
+from types import SimpleNamespace
+
+from agents.cancellation import AbortSignal
+from task_queue.tasks import _will_retry
+
+
+def _signal(remaining):
+    return AbortSignal(time.time() + remaining, lambda: False)
+
+
+def test_no_retry_when_run_locally_or_exhausted():
+    assert not _will_retry(None, _signal(600))
+    assert not _will_retry(SimpleNamespace(retries=0, retry_delay=10), _signal(600))
+
+
+def test_retry_within_deadline():
+    assert _will_retry(SimpleNamespace(retries=2, retry_delay=10), _signal(600))
+
+
+def test_no_retry_past_deadline():
+    # 下次重试开始时已超过截止时间，直接失败
+    assert not _will_retry(SimpleNamespace(retries=2, retry_delay=10), _signal(5))
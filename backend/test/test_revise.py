@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("fakeredis")
+
+from agents import travel_crew
+from task_queue import async_store, metrics
+
+REQUEST = {
+    "destination": "Kyoto",
+    "travel_dates": {"start": "2025-04-01", "end": "2025-04-02"},
+    "preferences": {"budget": "中等", "travel_style": "文化体验", "interests": ["寺庙"]}
+}
+
+
+async def submit_and_revise(client, revision):
+    resp = await client.post("/api/recommend", json=REQUEST)
+    assert resp.status_code == 202
+    task_id = resp.json()["task_id"]
+    resp = await client.post(f"/api/recommend/{task_id}/revise", json=revision)
+    assert resp.status_code == 202
+    revised_id = resp.json()["task_id"]
+    assert revised_id != task_id
+    return await async_store.get_task_input(task_id), await async_store.get_task_input(revised_id)
+
+
+def test_revise_merges_preferences(api):
+    revision = {
+        "destination": "Osaka",
+        "travel_dates": {"start": "2025-05-03"},
+        "preferences": {"budget": None, "travel_style": "美食", "pace": "悠闲"}
+    }
+    original, revised = api(lambda client, _: submit_and_revise(client, revision))
+    assert original["preferences"] == {"budget": "medium", "travel_style": "cultural", "interests": ["寺庙"]}
+    # 未给出的偏好保留，null 删除该项，其余按键覆盖
+    assert revised["preferences"] == {"travel_style": "food", "interests": ["寺庙"], "pace": "悠闲"}
+    assert revised["destination"] == "大阪"
+    # 只给出 start 时沿用原来的结束日期
+    assert (revised["start_date"], revised["end_date"]) == ("2025-05-03", "2025-04-02")
+
+
+def test_revise_unknown_task(api):
+    async def scenario(client, _):
+        resp = await client.post("/api/recommend/missing/revise", json={"preferences": {"pace": "悠闲"}})
+        assert resp.status_code == 404
+    api(scenario)
+
+
+def test_revise_reuses_destination_and_reruns_changed_stages(api, monkeypatch, crew_env, run_crew):
+    monkeypatch.setattr(travel_crew, "STAGE_MEMO_ENABLED", True)
+    monkeypatch.setattr(travel_crew, "DESTINATION_CACHE_ENABLED", True)
+    original, revised = api(lambda client, _: submit_and_revise(client, {"preferences": {"budget": "豪华"}}))
+    assert revised["preferences"]["budget"] == "high"
+
+    _, calls = run_crew(original)
+    first_run = {name for name, _ in calls}
+    assert {"destination_task", "preference_task", "itinerary_task", "coordination_task"} <= first_run
+
+    # 目的地和月份未变，目的地报告直接复用；偏好变化后偏好分析和依赖它的行程规划都重新执行
+    _, calls = run_crew(revised)
+    assert {name for name, _ in calls} == {"preference_task", "itinerary_task", "coordination_task"}
+    memo = crew_env.hgetall(metrics.metric_key("travel_stage_memo_total"))
+    assert memo == {f'result="miss",stage="{name}"\tcount'.encode(): b"2"
+                    for name in ("preference_task", "itinerary_task")}
+
+    # 同一修改再提交一次时，所有阶段都复用，只重新整合
+    _, calls = run_crew(revised)
+    assert {name for name, _ in calls} == {"coordination_task"}
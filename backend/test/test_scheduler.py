@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+from task_queue import scheduler
+from task_queue.scheduler import client_id, normalize_lane, parse_queue_status
+
+
+def test_client_id_hashes_api_key():
+    key_id = client_id("secret-key", "10.0.0.8")
+    assert key_id.startswith("key:") and "secret" not in key_id
+    assert key_id == client_id("secret-key", "10.0.0.9")
+    assert client_id(None, "10.0.0.8") == "ip:10.0.0.8"
+
+
+def test_unknown_lane_falls_back_to_interactive():
+    assert normalize_lane("batch") == "batch"
+    assert normalize_lane("urgent") == "interactive"
+    assert normalize_lane(None) == "interactive"
+
+
+def test_queue_status_ahead():
+    # interactive 任务排在第 4 位：前面有 2 个任务尚未开始
+    status = parse_queue_status([b"interactive", 4, 3, 1, 3])
+    assert status == {"lane": "interactive", "position": 4, "pending": 4, "ahead": 2}
+    # batch 任务还要等 interactive 通道的积压
+    assert parse_queue_status([b"batch", 2, 5, 1, 3])["ahead"] == 3
+    # 正在执行
+    assert parse_queue_status([b"batch", 1, 5, 0, 3])["ahead"] == 0
+    # 新提交的任务排在全部积压之后
+    assert parse_queue_status([b"", 0, 6, 2, 3]) == {"lane": None, "position": None, "pending": 8, "ahead": 8}
+
+
+# --- 派发脚本（fakeredis + lupa 执行真实的 Lua）---
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+PREFIX = "travel:task:"
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.redis = fakeredis.FakeRedis()
+        self._dispatch = self.redis.register_script(scheduler.DISPATCH_SCRIPT)
+        self._enqueue = self.redis.register_script(scheduler._ENQUEUE_SCRIPT)
+        self._status = self.redis.register_script(scheduler.QUEUE_STATUS_SCRIPT)
+
+    def submit(self, task_id, lane, client, deadline=1e12):
+        self._enqueue(keys=[PREFIX + task_id], args=[
+            task_id, lane, client, f"message:{task_id}", deadline,
+            scheduler.SCHED_QUEUE_PREFIX, scheduler.SCHED_RING_PREFIX, 3600
+        ])
+
+    def dispatch(self, slots, now=0):
+        args = scheduler.dispatch_args(now, PREFIX)
+        args[1] = slots
+        keys = [scheduler.SCHED_INFLIGHT_KEY, "huey-queue", scheduler.SCHED_STATE_KEY]
+        return [t.decode() for t in self._dispatch(keys=keys, args=args)]
+
+    def finish(self, task_id):
+        self.redis.hset(PREFIX + task_id, "status", "SUCCESS")
+        self.redis.zrem(scheduler.SCHED_INFLIGHT_KEY, task_id)
+
+    def run_all(self):
+        """一次一个名额，逐个派发并结束，返回执行顺序"""
+        order = []
+        while True:
+            dispatched = self.dispatch(1)
+            if not dispatched:
+                return order
+            order += dispatched
+            self.finish(dispatched[0])
+
+    def position(self, task_id):
+        status = self._status(keys=[PREFIX + task_id, "huey-queue"], args=scheduler.queue_status_args(PREFIX))
+        return parse_queue_status(status)
+
+
+def test_round_robin_across_clients():
+    s = FakeScheduler()
+    for i in range(5):
+        s.submit(f"heavy-{i}", "interactive", "ip:heavy")
+    s.submit("light-0", "interactive", "ip:light")
+    s.submit("light-1", "interactive", "ip:light")
+    # light 的第二个任务排在 heavy 的第二个之后，而不是全部 heavy 之后
+    assert s.position("light-1")["position"] == 2 + 3
+    assert s.run_all() == ["heavy-0", "light-0", "heavy-1", "light-1", "heavy-2", "heavy-3", "heavy-4"]
+    # 子队列和轮转在排空后被删除
+    assert s.redis.keys(scheduler.SCHED_QUEUE_PREFIX + "*") == []
+    assert s.redis.keys(scheduler.SCHED_RING_PREFIX + "*") == []
+
+
+def test_client_weights(monkeypatch):
+    monkeypatch.setattr(scheduler, "CLIENT_WEIGHTS_JSON", '{"ip:heavy": 2}')
+    s = FakeScheduler()
+    for i in range(4):
+        s.submit(f"heavy-{i}", "interactive", "ip:heavy")
+        s.submit(f"light-{i}", "interactive", "ip:light")
+    assert s.run_all()[:6] == ["heavy-0", "heavy-1", "light-0", "heavy-2", "heavy-3", "light-1"]
+
+
+def test_interactive_lane_first_with_batch_share():
+    s = FakeScheduler()
+    for i in range(3):
+        s.submit(f"batch-{i}", "batch", "key:integration")
+    for i in range(6):
+        s.submit(f"user-{i}", "interactive", f"ip:user-{i}")
+    order = s.run_all()
+    burst = scheduler.SCHEDULER_INTERACTIVE_BURST
+    assert order[:burst] == [f"user-{i}" for i in range(burst)]
+    assert order[burst] == "batch-0"
+    assert order[-2:] == ["batch-1", "batch-2"]
+
+
+def test_slots_are_released_and_reclaimed():
+    s = FakeScheduler()
+    s.submit("a", "interactive", "ip:1", deadline=100)
+    s.submit("b", "interactive", "ip:2", deadline=100)
+    s.submit("c", "interactive", "ip:3", deadline=100)
+    assert s.dispatch(2, now=0) == ["a", "b"]
+    # 名额用完，不再派发
+    assert s.dispatch(2, now=0) == []
+    assert s.position("c")["position"] == 2 + 2
+    s.finish("a")
+    assert s.dispatch(2, now=0) == ["c"]
+    # b 超过截止时间 + 宽限仍未结束（worker 崩溃），名额被回收
+    assert s.dispatch(2, now=100 + scheduler.SCHEDULER_SLOT_GRACE + 1) == []
+    assert s.redis.zrange(scheduler.SCHED_INFLIGHT_KEY, 0, -1) == []
+    assert s.redis.llen("huey-queue") == 3
+
+
+def test_skips_tasks_no_longer_pending():
+    s = FakeScheduler()
+    s.submit("cancelled", "interactive", "ip:1")
+    s.submit("live", "interactive", "ip:1")
+    s.redis.hset(PREFIX + "cancelled", "status", "CANCELLED")
+    assert s.dispatch(5) == ["live"]
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+from agents.scheduling import build_dag_levels, plan_tasks
+
+
+def _task(name, context=None):
+    return SimpleNamespace(name=name, context=context, async_execution=False)
+
+
+def _crew_tasks():
+    destination = _task("destination")
+    preference = _task("preference")
+    itinerary = _task("itinerary", [destination, preference])
+    coordination = _task("coordination", [destination, preference, itinerary])
+    return [destination, preference, itinerary, coordination]
+
+def test_dag_levels():
+    levels = build_dag_levels(_crew_tasks())
+    assert [[t.name for t in level] for level in levels] == [
+        ["destination", "preference"], ["itinerary"], ["coordination"]
+    ]
+
+def test_plan_dag_marks_independent_tasks_async():
+    ordered = plan_tasks(_crew_tasks(), "dag")
+    assert [(t.name, t.async_execution) for t in ordered] == [
+        ("destination", True), ("preference", True), ("itinerary", False), ("coordination", False)
+    ]
+
+def test_plan_sequential_fallback():
+    ordered = plan_tasks(_crew_tasks(), "sequential")
+    assert not any(t.async_execution for t in ordered)
@@ -0,0 +1,149 @@
+import os
+import json
+import asyncio
+
+import pytest
+from redis.client import NEVER_DECODE
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from task_queue import async_store, scheduler
+from task_queue.queue_config import huey
+from task_queue.events import EVENTS_CHANNEL_PREFIX, task_events_log
+
+TRAVEL_INPUT = {"destination": "北京", "start_date": "2025-05-01", "end_date": "2025-05-02"}
+
+
+def run(scenario, monkeypatch):
+    """在 fakeredis 上执行单飞提交/取消/派发的真实 Lua 脚本"""
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        monkeypatch.setattr(async_store, "async_redis_client", redis)
+        for name, script in (("_submit", async_store._SUBMIT_SCRIPT), ("_cancel", async_store._CANCEL_SCRIPT),
+                             ("_dispatch", scheduler.DISPATCH_SCRIPT),
+                             ("_queue_status", scheduler.QUEUE_STATUS_SCRIPT)):
+            monkeypatch.setattr(async_store, name, redis.register_script(script))
+        return await scenario(redis)
+    return asyncio.run(main())
+
+
+async def fill_slots(redis):
+    """占满调度名额，新任务停留在调度子队列"""
+    slots = scheduler.dispatch_args(0, "")[1]
+    await redis.zadd(scheduler.SCHED_INFLIGHT_KEY, {f"running-{i}": 1e12 for i in range(slots)})
+
+
+def sub_queue(client="ip:1"):
+    return f"{scheduler.SCHED_QUEUE_PREFIX}{scheduler.DEFAULT_LANE}:{client}"
+
+
+def test_identical_submits_share_task(monkeypatch):
+    async def scenario(redis):
+        first, created = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:1")
+        second, attached_created = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:2")
+        assert created and not attached_created
+        assert second == first
+        assert await redis.hget(async_store.task_key(first), "waiters") == "2"
+        assert await redis.hget(async_store.SINGLE_FLIGHT_STATS_KEY, "saved_runs") == "1"
+        # 只派发了一次
+        assert await redis.llen(huey.storage.queue_key) == 1
+    run(scenario, monkeypatch)
+
+
+def test_alias_relabels_dates(monkeypatch):
+    async def scenario(redis):
+        first, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600)
+        later = dict(TRAVEL_INPUT, start_date="2025-06-10", end_date="2025-06-11")
+        alias, created = await async_store.submit_or_attach("hash", later, 600)
+        assert alias != first and not created
+        assert await async_store.resolve_task(alias) == (first, "2025-06-10")
+        itinerary = [{"day": 1, "date": "2025-05-01", "schedule": []},
+                     {"day": 2, "date": "2025-05-02", "schedule": []}]
+        await async_store.set_task_result(first, "SUCCESS", {
+            "recommendations": {"itinerary": itinerary}, "analysis": "", "status": "success"
+        })
+        status, result = await async_store.get_task_result(alias)
+        assert status == "SUCCESS"
+        assert [d["date"] for d in result["recommendations"]["itinerary"]] == ["2025-06-10", "2025-06-11"]
+        # 原任务的结果不受影响
+        _, original = await async_store.get_task_result(first)
+        assert original["recommendations"]["itinerary"][0]["date"] == "2025-05-01"
+    run(scenario, monkeypatch)
+
+
+def test_cancel_with_other_waiter_keeps_task(monkeypatch):
+    async def scenario(redis):
+        await fill_slots(redis)
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:1")
+        await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:2")
+        assert await async_store.cancel_task(task_id) == (task_id, "detached")
+        assert await redis.hget(async_store.task_key(task_id), "status") == "PENDING"
+        assert await redis.lrange(sub_queue(), 0, -1) == [task_id]
+    run(scenario, monkeypatch)
+
+
+def test_cancel_last_waiter_dequeues(monkeypatch):
+    async def scenario(redis):
+        await fill_slots(redis)
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:1")
+        pubsub = redis.pubsub()
+        await pubsub.subscribe(f"{EVENTS_CHANNEL_PREFIX}{task_id}")
+        await pubsub.get_message(timeout=1)  # 订阅确认
+        assert await async_store.cancel_task(task_id) == (task_id, "cancelled")
+        assert await redis.hget(async_store.task_key(task_id), "status") == "CANCELLED"
+        assert not await redis.exists(sub_queue())
+        assert await redis.lrange(f"{scheduler.SCHED_RING_PREFIX}{scheduler.DEFAULT_LANE}", 0, -1) == []
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+        assert json.loads(message["data"])["data"]["status"] == "CANCELLED"
+        assert len(await redis.lrange(task_events_log(task_id), 0, -1)) == 1
+        await pubsub.aclose()
+    run(scenario, monkeypatch)
+
+
+def test_cancel_dispatched_task_frees_slot(monkeypatch):
+    async def scenario(redis):
+        task_id, _ = await async_store.submit_or_attach("hash", TRAVEL_INPUT, 600, client="ip:1")
+        assert await redis.llen(huey.storage.queue_key) == 1
+        assert await async_store.cancel_task(task_id) == (task_id, "cancelled")
+        assert await redis.llen(huey.storage.queue_key) == 0
+        assert await redis.zcard(scheduler.SCHED_INFLIGHT_KEY) == 0
+    run(scenario, monkeypatch)
+
+
+def test_cancel_matches_decoded_task_id(monkeypatch):
+    async def scenario(redis):
+        task_id, _ = await async_store.submit_or_attach("hash-0", TRAVEL_INPUT, 600, client="ip:1")
+        # 后派发的任务排在 huey 队列前面，且输入中含有前一个任务的 id
+        other = dict(TRAVEL_INPUT, preferences={"notes": f"同行任务 {task_id}"})
+        other_id, _ = await async_store.submit_or_attach("hash-1", other, 600, client="ip:2")
+        assert await async_store.cancel_task(task_id) == (task_id, "cancelled")
+        remaining = await redis.execute_command("LRANGE", huey.storage.queue_key, 0, -1, NEVER_DECODE=True)
+        assert [huey.deserialize_task(raw).args[0] for raw in remaining] == [other_id]
+        assert await redis.zrange(scheduler.SCHED_INFLIGHT_KEY, 0, -1) == [other_id]
+    run(scenario, monkeypatch)
+
+
+def test_admission_rejects_when_backlog_exceeds_budget(monkeypatch):
+    monkeypatch.setattr(async_store, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(async_store, "ADMISSION_MAX_WAIT_SECONDS", 600)
+
+    async def scenario(redis):
+        # 平均耗时（EWMA）300 秒：空队列预计 300 秒，放行
+        await redis.set(async_store.SERVICE_TIME_KEY, 300)
+        await fill_slots(redis)
+        _, created = await async_store.submit_or_attach("hash-0", TRAVEL_INPUT, 600, client="ip:1")
+        assert created
+        # 同一通道积压 2 * WORKER_CAPACITY 个任务后预计等待超过 600 秒
+        await redis.rpush(huey.storage.queue_key, *[f"queued-{i}" for i in range(2 * scheduler.WORKER_CAPACITY)])
+        with pytest.raises(async_store.AdmissionRejected) as rejected:
+            await async_store.submit_or_attach("hash-1", TRAVEL_INPUT, 600, client="ip:2")
+        assert rejected.value.projected_wait > 600
+        assert await redis.hget(async_store.ADMISSION_STATS_KEY, "rejected") == "1"
+        assert not await redis.exists(async_store.input_key("hash-1"))
+        # 复用已有任务的提交总是放行
+        _, created = await async_store.submit_or_attach("hash-0", TRAVEL_INPUT, 600, client="ip:2")
+        assert not created
+    run(scenario, monkeypatch)
@@ -0,0 +1,40 @@
+import json
+
+from agents.streaming import IncrementalSectionParser
+
+ANSWER = {
+    "itinerary": [{"day": 1, "date": "2025-01-01", "schedule": [{"time": "09:00", "activity": "参观 {寺庙}"}]}],
+    "restaurants": [{"name": "本地餐厅", "location": "市中心", "specialty": "\"当地菜\"", "cost": "100元"}],
+    "attractions": [{"name": "著名景点", "highlight": "历史建筑", "ticket": "50元"}],
+    "accommodations": [{"name": "舒适酒店", "location": "市中心", "feature": "交通便利", "price": "500元/晚"}],
+    "tips": ["提前预约热门景点", "带上[雨伞]"]
+}
+
+
+def feed_chars(text):
+    parser = IncrementalSectionParser()
+    items = []
+    for c in text:
+        items.extend(parser.feed(c))
+    return items
+
+
+def test_items_emitted_as_they_close():
+    items = feed_chars(json.dumps(ANSWER, ensure_ascii=False))
+    assert [(section, index) for section, index, _ in items] == [
+        ("itinerary", 0), ("restaurants", 0), ("attractions", 0), ("accommodations", 0), ("tips", 0), ("tips", 1)
+    ]
+    assert items[0][2]["schedule"][0]["activity"] == "参观 {寺庙}"
+    assert items[1][2]["specialty"] == "\"当地菜\""
+    assert items[-1][2] == "带上[雨伞]"
+
+
+def test_skips_react_steps_before_final_answer():
+    text = ('Thought: 查一下 Action: search\nAction Input: {"query": "x"}\n'
+            'Thought: 完成\nFinal Answer: ' + json.dumps({"tips": ["a"]}))
+    assert feed_chars(text) == [("tips", 0, "a")]
+
+
+def test_invalid_items_dropped():
+    text = json.dumps({"restaurants": [{"name": "缺字段"}], "tips": [1, "ok"]})
+    assert feed_chars(text) == [("tips", 0, "ok")]
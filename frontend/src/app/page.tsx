@@ -27,8 +27,20 @@ interface RecommendationData {
 interface QueuePosition {
   total: number;
   position: number;
+  // 服务端按平均耗时估算的预计完成秒数
+  estimated_wait?: number | null;
 }
 
+const formatWait = (seconds?: number | null) =>
+  seconds ? `${Math.max(1, Math.ceil(seconds / 60))} 分钟` : "几分钟";
+
+const queueMessage = (position: number, estimatedWait?: number | null) =>
+  position > 1
+    ? `您的请求正在队列中，当前位置: 第 ${position} 位，大概需要等待 ${formatWait(
+        estimatedWait
+      )}，请勿关闭页面。`
+    : `预计等待${formatWait(estimatedWait)}，请勿关闭页面，您的请求正在处理中...`;
+
 export default function Home() {
   const [recommendations, setRecommendations] =
     useState<RecommendationData | null>(null);
@@ -44,9 +56,9 @@ export default function Home() {
       if (!response.ok) {
         throw new Error("队列状态查询失败");
       }
-      const data = await response.json();
-      setQueuePosition(data.position);
-      return data.position;
+      const data: QueuePosition = await response.json();
+      setQueuePosition(data);
+      return data;
     } catch (error) {
       console.error("获取队列状态失败:", error);
     }
@@ -58,16 +70,13 @@ export default function Home() {
     let timeoutId: NodeJS.Timeout | null = null;
     const poll = async () => {
       try {
-        const position = await fetchQueuePosition(taskId);
+        const status = await fetchQueuePosition(taskId);
+        const position = status?.position;
         if (position && position > 1) {
-          setStatusMsg(
-            `您的请求正在队列中，当前位置: 第 ${position} 位，大概需要等待 ${
-              position * 5
-            } 分钟，请勿关闭页面。`
-          );
+          setStatusMsg(queueMessage(position, status?.estimated_wait));
           timeoutId = setTimeout(poll, 10000); // 10s后再次请求
         } else if (position == 1) {
-          setStatusMsg("预计等待5分钟，请勿关闭页面，您的请求正在处理中...");
+          setStatusMsg(queueMessage(position, status?.estimated_wait));
           setQueuePosition(null);
           const response = await fetch(`/api/result/${taskId}`);
           if (!response.ok) {
@@ -107,6 +116,71 @@ export default function Home() {
     }, 9000000);
   };
 
+  const STAGE_LABELS: Record<string, string> = {
+    destination_task: "目的地分析",
+    preference_task: "偏好分析",
+    itinerary_task: "行程规划",
+    coordination_task: "整合推荐",
+  };
+
+  // 通过 SSE 接收排队位置、阶段进度和最终结果，连接失败时回退到轮询
+  const streamResult = (taskId: string) => {
+    if (typeof EventSource === "undefined") {
+      pollForResult(taskId);
+      return;
+    }
+    setPolling(true);
+    setStatusMsg("结果生成中...");
+    const source = new EventSource(`/api/stream/${taskId}`);
+    const completedStages: string[] = [];
+    let finished = false;
+    // 关闭页面时取消本次提交，空出的 worker 立即处理下一个任务
+    const cancelOnLeave = () => {
+      if (!finished) {
+        fetch(`/api/task/${taskId}`, { method: "DELETE", keepalive: true });
+      }
+    };
+    window.addEventListener("pagehide", cancelOnLeave);
+    // 任务结束或改为轮询后不再取消，避免之后离开页面时误取消已完成的任务
+    const stopCancelOnLeave = () =>
+      window.removeEventListener("pagehide", cancelOnLeave);
+
+    source.addEventListener("queue", (e) => {
+      const { position, estimated_wait } = JSON.parse(
+        (e as MessageEvent).data
+      );
+      setStatusMsg(queueMessage(position, estimated_wait));
+    });
+    source.addEventListener("started", () => {
+      setStatusMsg("AI团队已开始工作，请勿关闭页面...");
+    });
+    source.addEventListener("stage", (e) => {
+      const { stage } = JSON.parse((e as MessageEvent).data);
+      completedStages.push(STAGE_LABELS[stage] || stage);
+      setStatusMsg(`已完成: ${completedStages.join("、")}，请稍候...`);
+    });
+    source.addEventListener("result", (e) => {
+      finished = true;
+      source.close();
+      stopCancelOnLeave();
+      const data = JSON.parse((e as MessageEvent).data);
+      if (data.status === "SUCCESS") {
+        setRecommendations(data.result);
+        setStatusMsg(null);
+      } else {
+        setStatusMsg("推荐生成失败，请稍后重试");
+      }
+      setPolling(false);
+    });
+    source.onerror = () => {
+      source.close();
+      stopCancelOnLeave();
+      if (!finished) {
+        pollForResult(taskId);
+      }
+    };
+  };
+
   const handleFormSubmit = async (data: TravelData) => {
     setRecommendations(null);
     setStatusMsg("结果生成中...");
@@ -119,11 +193,18 @@ export default function Home() {
         body: JSON.stringify(data),
       });
 
+      if (response.status === 429) {
+        const retryAfter = Number(response.headers.get("Retry-After") || 60);
+        setStatusMsg(
+          `当前排队人数过多，请约 ${Math.ceil(retryAfter / 60)} 分钟后再试。`
+        );
+        return;
+      }
       if (response.status !== 202) {
         throw new Error("无法启动推荐任务");
       }
       const result = await response.json();
-      pollForResult(result.task_id);
+      streamResult(result.task_id);
     } catch (error) {
       setStatusMsg("推荐生成失败，请稍后重试");
     }
@@ -81,5 +81,5 @@ echo ""
 echo "按 Ctrl+C 停止所有服务"
 
 # 等待用户中断
-trap "echo '🛑 正在停止服务...'; kill $BACKEND_PID $FRONTEND_PID; $HUEY_PID; exit" INT
+trap "echo '🛑 正在停止服务...'; kill $BACKEND_PID $FRONTEND_PID $HUEY_PID; wait $HUEY_PID; exit" INT
 wait